@@ -0,0 +1,75 @@
+##################################
+# BENCHMARK: EXTRACTION OF NYT ARTICLE PAGES
+#
+# Usage: python -m benchmarks.bench_extract [--repeat 50] [--fixtures tests/fixtures]
+# Compares huginn.extract.extract_article with the previous BeautifulSoup parsing on saved pages
+# (NYT-like pages: article and blog layouts surrounded by the usual head, navigation, scripts and footer).
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from huginn.extract import extract_article
+from tests.standins import FIXTURES
+
+def extract_with_soup(content):
+    """Previous extraction: full BeautifulSoup tree of the page"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, features="lxml")
+    try:
+        image_links = [link.get('src') for link in soup.find_all('img')]
+        article_html_content = soup.find('html').find('body').find('article')
+        title = article_html_content.find('header').find('h1').get_text()
+        section = article_html_content.find('section')
+        div = article_html_content.find('div', {"class": "entry-content"})
+        paragraphs = section.find_all('p') if section else div.find_all('p')
+        text = ' '.join([title+'.'] + [p.get_text() for p in paragraphs])
+        return image_links, title, text
+    except:
+        return None, None, None
+
+def load_fixtures(directory=FIXTURES):
+    """Read the saved pages
+    :returns dictionary, keys are file names and values are bytes
+    """
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                pages[name] = f.read()
+    return pages
+
+def measure(function, content, repeat=50):
+    """Time function(content)
+    :returns list of float (seconds)
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(content)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the extraction of NYT article pages')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--fixtures', default=FIXTURES)
+    args = parser.parse_args(argv)
+
+    status = 0
+    for name, content in load_fixtures(args.fixtures).items():
+        extraction = extract_article(content)
+        images, title, text = extract_with_soup(content)
+        if extraction.error is not None or (extraction.title, extraction.text) != (title, text):
+            print('{}: extraction differs from BeautifulSoup ({})'.format(name, extraction.error))
+            status = 1
+        fast = statistics.median(measure(extract_article, content, args.repeat))
+        slow = statistics.median(measure(extract_with_soup, content, args.repeat))
+        print('{}: {:.2f}ms (BeautifulSoup {:.2f}ms, x{:.1f}) for {} KB'.format(
+            name, fast * 1000, slow * 1000, slow / fast, len(content) // 1024))
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
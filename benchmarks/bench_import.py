@@ -0,0 +1,55 @@
+##################################
+# BENCHMARK: IMPORT TIME
+#
+# Usage: python -m benchmarks.bench_import [--repeat 5] [--max-seconds 1.5]
+# Each measure runs `import huginn` in a fresh interpreter, so no module is already cached.
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['torch', 'transformers', 'spacy', 'gensim', 'plotly', 'matplotlib', 'sklearn']
+
+_CODE = """
+import sys, time
+start = time.perf_counter()
+import huginn
+elapsed = time.perf_counter() - start
+print('{};{}'.format(elapsed, ','.join(m for m in %s if m in sys.modules)))
+""" % HEAVY_MODULES
+
+def measure_import(repeat=5):
+    """Time `import huginn` in fresh interpreters
+    :argument repeat: number of interpreters to start
+    :returns list of float (seconds) and the list of heavy modules loaded by the import
+    """
+    timings, heavy = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _CODE], stdout=subprocess.PIPE, check=True)
+        elapsed, loaded = out.stdout.decode().strip().split(';')
+        timings.append(float(elapsed))
+        heavy = [m for m in loaded.split(',') if m]
+    return timings, heavy
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure `import huginn` time')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='fail if the median import time is above this value')
+    args = parser.parse_args(argv)
+
+    timings, heavy = measure_import(args.repeat)
+    median = statistics.median(timings)
+    print('import huginn: median {:.3f}s (min {:.3f}s, max {:.3f}s) over {} runs'.format(
+        median, min(timings), max(timings), len(timings)))
+    if heavy:
+        print('heavy modules loaded at import: {}'.format(', '.join(heavy)))
+        return 1
+    if args.max_seconds is not None and median > args.max_seconds:
+        print('regression: median import time above {:.3f}s'.format(args.max_seconds))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
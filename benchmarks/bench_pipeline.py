@@ -0,0 +1,242 @@
+##################################
+# BENCHMARK: EVERY STAGE OF THE PIPELINE, WITHOUT NETWORK
+#
+# Usage: python -m benchmarks.bench_pipeline [--repeat 3] [--entities 1 100 2000] [--stages interest anomalies ...]
+#                                            [--baseline my_baseline.json] [--save-baseline] [--results-only]
+#                                            [--tolerance 1.5]
+#
+# Google Trends is replaced by synthetic series, the NYT search API and article pages by a local server
+# (tests/standins.py) serving recorded fixtures, and the cache by a temporary directory.
+# LDA needs the spacy 'en' model and summaries a summarization model already in the local transformers cache
+# (--summary-model), these stages are skipped otherwise.
+# Timings (median of --repeat runs) and a few results of each stage are compared with the baseline file:
+# the benchmark fails if a stage is more than --tolerance times slower or if its results changed.
+# Timings depend on the machine, so the committed benchmarks/baseline.json only holds the results: record the timings
+# of your machine once (python -m benchmarks.bench_pipeline --save-baseline --baseline my_baseline.json), then compare
+# with --baseline my_baseline.json. The benchmark fails if the baseline has no timing for a stage, unless --results-only
+# is given (only the results are compared, ex: in CI).
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from huginn import anomalies, articles, interest
+from huginn.cache import configure_cache, CACHE_DIR
+from huginn.scheduler import configure_scheduler, PER_MINUTE, PER_DAY
+from huginn.extract import extract_article
+
+from tests.standins import StandInTrendReq, StandInServer, FIXTURES, MONTHS
+
+from .bench_import import measure_import
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STAGES = ['import', 'interest', 'anomalies', 'extract', 'articles', 'lda', 'summary']
+ANOMALY_DATES = pd.DatetimeIndex(['2018-01-01', '2018-02-01', '2018-03-01'])
+
+def synthetic_frame(n_entities, months=len(MONTHS)):
+    """Interest of n_entities synthetic entities (dataframe, one column per entity)"""
+    rng = np.random.default_rng(n_entities)
+    values = 20 + rng.random((months, n_entities)) * 10
+    bursts = rng.integers(0, months, (3, n_entities))
+    values[bursts, np.arange(n_entities)] += 80
+    return pd.DataFrame(values, index=MONTHS[:months], columns=['entity{}'.format(i) for i in range(n_entities)])
+
+def timed(function, repeat, setup=None):
+    """Median time of function() over repeat runs (setup() is called before each run, outside the timing)
+    :returns the median in seconds and the result of the last run
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+_cache_dirs = [] #temporary directories of fresh_cache, removed by remove_caches
+
+def fresh_cache():
+    """Empty cache in a new temporary directory"""
+    directory = tempfile.TemporaryDirectory(prefix='huginn_bench_')
+    _cache_dirs.append(directory)
+    configure_cache(directory=directory.name)
+
+def remove_caches():
+    """Go back to the default cache and remove the directories of fresh_cache"""
+    configure_cache(directory=CACHE_DIR)
+    while _cache_dirs:
+        _cache_dirs.pop().cleanup()
+
+def bench_import(args):
+    timings, heavy = measure_import(args.repeat)
+    return {'import': (statistics.median(timings), {'heavy_modules': heavy})}
+
+def bench_interest(args):
+    results = {}
+    trends = StandInTrendReq()
+    get_pytrend = interest.get_pytrend
+    interest.get_pytrend = lambda: trends
+    try:
+        for n in args.entities:
+            names = ['entity{}'.format(i) for i in range(n)]
+            cold, frame = timed(lambda: interest.get_interests(names), args.repeat, setup=fresh_cache)
+            warm, _ = timed(lambda: interest.get_interests(names), args.repeat)
+            results['interest_cold_{}'.format(n)] = (cold, {'shape': list(frame.shape)})
+            results['interest_warm_{}'.format(n)] = (warm, {'shape': list(frame.shape)})
+    finally:
+        interest.get_pytrend = get_pytrend
+    return results
+
+def bench_anomalies(args):
+    results = {}
+    for n in args.entities:
+        frame = synthetic_frame(n)
+        for method in ['ewm', 'rolling', 'constant']:
+            seconds, found = timed(lambda: anomalies.detect_anomalies(frame, method=method), args.repeat)
+            first = found[frame.columns[0]]
+            results['anomalies_{}_{}'.format(method, n)] = (seconds, {'first_entity': [str(date.date()) for date in first.index]})
+    return results
+
+def bench_extract(args):
+    results = {}
+    for name in ['nyt_article.html', 'nyt_blog.html']:
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            content = f.read()
+        seconds, extraction = timed(lambda: [extract_article(content) for _ in range(100)], args.repeat)
+        results['extract_{}'.format(name.split('.')[0])] = (seconds / 100, {'words': len(extraction[0].text.split())})
+    return results
+
+def bench_articles(args):
+    os.environ.setdefault('NYT_API_KEY', 'benchmark')
+    with StandInServer() as server:
+        api_url = articles.NYT_API_URL
+        articles.NYT_API_URL = server.search_url
+        configure_scheduler(per_minute=10 ** 6, per_day=10 ** 9)
+        try:
+            seconds, table = timed(lambda: articles.get_article_table('benchmark', ANOMALY_DATES, num_links=20),
+                                   args.repeat, setup=fresh_cache)
+        finally:
+            articles.NYT_API_URL = api_url
+            configure_scheduler(per_minute=PER_MINUTE, per_day=PER_DAY)
+        counts = {'articles': len(table), 'searches': server.searches // args.repeat, 'pages': server.pages // args.repeat}
+    return {'articles': (seconds, counts)}
+
+def _fixture_texts(n_dates, per_date=10):
+    """Articles extracted from the fixtures, made different from each other"""
+    texts = []
+    for name in ['nyt_article.html', 'nyt_blog.html']:
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            texts.append(extract_article(f.read()).text)
+    topics = ['markets', 'elections', 'technology', 'energy', 'health']
+    return {date: ['{} {} {}'.format(texts[i % 2], topics[(i + j) % 5], topics[j % 5] * (i % 3)) for j in range(per_date)]
+            for i, date in enumerate(pd.date_range('2018-01-01', periods=n_dates, freq='MS'))}
+
+def bench_lda(args):
+    from huginn import LDA
+    from huginn.exceptions import NLPNotFoundError
+    try:
+        LDA.get_nlp()
+    except (ImportError, NLPNotFoundError):
+        return {'lda': None}
+    dic_sentences = _fixture_texts(5)
+    seconds, topics = timed(lambda: LDA.run_lda(dic_sentences, n_components=2), args.repeat, setup=fresh_cache)
+    return {'lda': (seconds, {'articles': sum(len(ids) for date in topics.values() for ids in date.values())})}
+
+def bench_summary(args):
+    os.environ.setdefault('HF_HUB_OFFLINE', '1') #only models already downloaded
+    os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+    from huginn import summarizer
+    try:
+        summarizer.get_summarizer(args.summary_model)
+    except Exception: #transformers missing or model not in the local cache
+        return {'summary': None}
+    text = ' '.join(_fixture_texts(1, per_date=3)[pd.Timestamp('2018-01-01')])
+    seconds, summary = timed(lambda: summarizer.run_summary(text, 20, 60, model=args.summary_model), args.repeat,
+                             setup=fresh_cache)
+    return {'summary': (seconds, {'words': len(summary.split())})}
+
+BENCHMARKS = {'import': bench_import, 'interest': bench_interest, 'anomalies': bench_anomalies,
+              'extract': bench_extract, 'articles': bench_articles, 'lda': bench_lda, 'summary': bench_summary}
+
+def run(args):
+    """Run the benchmarks of the selected stages
+    :returns dictionary, keys are benchmark names and values are {'seconds': float, 'result': dict} (None if skipped)
+    """
+    measures = {}
+    try:
+        for stage in args.stages:
+            for name, measure in BENCHMARKS[stage](args).items():
+                measures[name] = None if measure is None else {'seconds': measure[0], 'result': measure[1]}
+    finally:
+        remove_caches()
+    return measures
+
+def compare(measures, baseline, tolerance, results_only=False):
+    """Compare measures with a baseline
+    :argument results_only: True to only compare the results, otherwise a measure without timing in the baseline is
+        a regression (a speed regression could not be detected)
+    :returns list of str (one per regression)
+    """
+    regressions = []
+    for name, measure in measures.items():
+        reference = baseline.get(name)
+        if measure is None or (reference is None and results_only):
+            continue
+        if reference is None or ('seconds' not in reference and not results_only):
+            regressions.append('{}: no timing in the baseline, record one with --save-baseline --baseline my_baseline.json '
+                               '(or only compare the results with --results-only)'.format(name))
+            continue
+        if not results_only and measure['seconds'] > reference['seconds'] * tolerance:
+            regressions.append('{}: {:.4f}s, baseline {:.4f}s'.format(name, measure['seconds'], reference['seconds']))
+        if measure['result'] != reference['result']:
+            regressions.append('{}: result {} differs from baseline {}'.format(name, measure['result'], reference['result']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time every stage of huginn without network')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--entities', type=int, nargs='+', default=[1, 100, 2000])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--summary-model', default='sshleifer/distilbart-xsum-1-1')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write the measures as the new baseline')
+    parser.add_argument('--results-only', action='store_true',
+                        help='save or compare the results only, without timings')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='fail if a stage is more than tolerance times slower than the baseline')
+    args = parser.parse_args(argv)
+
+    measures = run(args)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    for name, measure in measures.items():
+        if measure is None:
+            print('{:<28} skipped'.format(name))
+            continue
+        reference = baseline.get(name)
+        ratio = '' if reference is None or 'seconds' not in reference else \
+            '  x{:.2f} vs baseline'.format(measure['seconds'] / reference['seconds'])
+        print('{:<28} {:>10.4f}s{}'.format(name, measure['seconds'], ratio))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({name: {'result': measure['result']} if args.results_only else measure
+                       for name, measure in measures.items() if measure is not None}, f, indent=1, sort_keys=True)
+        return 0
+    regressions = compare(measures, baseline, args.tolerance, results_only=args.results_only)
+    for regression in regressions:
+        print('regression: ' + regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,37 +1,84 @@
 ##################################
 # LDA
 
-import spacy, gensim
-import pandas as pd
+import hashlib
+import numbers
+import os
+import pickle
+import re
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import numpy as np
+from scipy.sparse import csr_matrix, vstack
 from sklearn.decomposition import LatentDirichletAllocation
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
 
 from .exceptions import NLPNotFoundError
+from .cache import get_cache, get_cache_dir
+from .instrument import span
+
+SPACY_MODEL = 'en'
+ALLOWED_POSTAGS = ['NOUN', 'ADJ', 'VERB', 'ADV'] #type of words kept by the lemmatization
+BATCH_SIZE = 64 #number of documents processed together by spacy
+MAX_CORPUS_ARTICLES = 20000 #articles whose counts are kept by a CorpusLDA (the most recent ones)
+MODELS_DIR = 'lda_models' #directory of the CorpusLDA files, in the cache directory
+
+_nlp = None #spacy model shared by the whole process (see get_nlp)
+_nlp_lock = threading.Lock()
 
 def sent_to_words(sentences):
     """From list of sentence (str) to a list of list of words (str)
     :argument sentences: list of str (list of sentences)
     :returns a generator of list of words (each word of the sentence)
     """
+    import gensim #heavy import, only done when LDA is run
     for sentence in sentences:
         yield(gensim.utils.simple_preprocess(str(sentence), deacc=True))  # deacc=True removes punctuations
 
-def lemmatization(texts, nlp, allowed_postags=['NOUN', 'ADJ', 'VERB', 'ADV']):
-    """Lemmatize the text
+def lemmatization(texts, nlp, allowed_postags=ALLOWED_POSTAGS, batch_size=BATCH_SIZE, n_process=1):
+    """Lemmatize the text, streaming the documents through nlp.pipe
     :argument texts: list of list of words
     :argument nlp: spacy model (english in our case)
     :argument allowed_postags: list (type of words to keep)
+    :argument batch_size: number of documents processed together by spacy
+    :argument n_process: number of processes used by spacy
     :returns a list of lemmatized sentences
     """
     texts_out = []
-    for sent in texts:
-        doc = nlp(" ".join(sent)) 
-        texts_out.append(" ".join([token.lemma_ if token.lemma_ not in ['-PRON-'] else '' 
+    for doc in nlp.pipe((" ".join(sent) for sent in texts), batch_size=batch_size, n_process=n_process):
+        texts_out.append(" ".join([token.lemma_ if token.lemma_ not in ['-PRON-'] else ''
                                    for token in doc if token.pos_ in allowed_postags]))
     return texts_out
 
+def _lemmas_key(sentence, allowed_postags):
+    """Key of the lemmas of an article in the cache (hash of the text, the spacy model and the kept types of words)"""
+    return hashlib.sha1('\x1f'.join([SPACY_MODEL, ','.join(allowed_postags), sentence]).encode('utf-8')).hexdigest()
+
+def lemmatize_articles(sentences, allowed_postags=ALLOWED_POSTAGS, batch_size=BATCH_SIZE, n_process=1):
+    """Remove ponctuation, pronouns and other words and lemmatize articles
+    Lemmas are kept in the persistent cache, so an article is only lemmatized once (spacy is not even loaded if
+    every article is cached)
+    :argument sentences: list of str (articles)
+    :argument allowed_postags: list (type of words to keep)
+    :argument batch_size: number of documents processed together by spacy
+    :argument n_process: number of processes used by spacy
+    :returns a list of lemmatized sentences (same order)
+    """
+    cache = get_cache('lemmas')
+    keys = [_lemmas_key(str(sentence), allowed_postags) for sentence in sentences]
+    lemmas = [cache.get(key) for key in keys]
+    missing = [i for i, lemma in enumerate(lemmas) if lemma is None]
+    if missing:
+        data = sent_to_words([sentences[i] for i in missing]) #remove ponctuation and convert to list of list
+        new_lemmas = lemmatization(data, get_nlp(), allowed_postags, batch_size=batch_size, n_process=n_process)
+        for i, lemma in zip(missing, new_lemmas):
+            lemmas[i] = lemma
+            cache.set(keys[i], lemma)
+    return lemmas
+
 def vectorize(vectorizer, sentences):
     """Vectorizes sentences
     :argument vectorize: CountVectorize
@@ -40,69 +87,246 @@ def vectorize(vectorizer, sentences):
     """
     return vectorizer.fit_transform(sentences)
 
-def preprocess(sentences, nlp):
-    """Preprocess sentences to feed LDA algorithm (sparse matrix speeds up the training)
-    :argument sentences: list of str (sentences)
-    :argument nlp: spacy language model
+def preprocess(lemmas, nlp=None):
+    """Preprocess lemmatized sentences to feed LDA algorithm (sparse matrix speeds up the training)
+    :argument lemmas: list of str (lemmatized sentences, see lemmatize_articles)
+    :argument nlp: deprecated, preprocess(sentences, nlp) lemmatizes the sentences with nlp first (not cached)
     :returns a sparse matrix and the vectorizer
     """
+    if nlp is not None:
+        warnings.warn('preprocess(sentences, nlp) is deprecated, use preprocess(lemmatize_articles(sentences))',
+                      DeprecationWarning, stacklevel=2)
+        lemmas = lemmatization(list(sent_to_words(lemmas)), nlp)
     #for each anomaly date, we need a vectorizer
-    vectorizer = CountVectorizer(analyzer='word',               
-                                 stop_words='english',             # remove stop words
-                                 lowercase=True,                   # convert all words to lowercase
-                                 token_pattern='[a-zA-Z0-9]{3,}')  # num chars > 3
-    
-    data = list(sent_to_words(sentences)) #remove ponctuation and convert to list of list
-    data = lemmatization(data, nlp) #remove pronouns and other words, convert to list of sentences
-    data = vectorize(vectorizer, sentences) #remove stopwords, lowercase, num_chars > 3
+    vectorizer = _new_vectorizer()
+    data = vectorize(vectorizer, lemmas) #remove stopwords, lowercase, num_chars > 3
     return data, vectorizer
 
-def run_lda_once(sentences, nlp, n_components):
+def _new_vectorizer():
+    """CountVectorizer used to feed LDA"""
+    return CountVectorizer(analyzer='word',
+                           stop_words='english',             # remove stop words
+                           lowercase=True,                   # convert all words to lowercase
+                           token_pattern='[a-zA-Z0-9]{3,}')  # num chars > 3
+
+def topic_partition(doc_topic):
+    """Group documents by dominant topic
+    :argument doc_topic: array (n_doc * n_components), distribution of each document through topics (lda.transform)
+    :returns a dictionary: keys are topics (sorted by number of documents, biggest first) and values are arrays of ids of documents
+    """
+    dominant_topic = np.argmax(doc_topic, axis=1)
+    counts = np.bincount(dominant_topic, minlength=doc_topic.shape[1])
+    topics = np.argsort(-counts, kind='stable') #sort topics by dominance across documents
+    ids = np.argsort(dominant_topic, kind='stable') #ids of documents grouped by topic (in increasing order inside a topic)
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    return {int(topic): ids[bounds[topic]:bounds[topic + 1]] for topic in topics if counts[topic] > 0}
+
+def _fit_lda(preprocess_data, n_components):
+    """Train LDA on a sparse matrix and partition its documents (see topic_partition)"""
+    if preprocess_data.shape[0] == 0:
+        return {}
+    lda = LatentDirichletAllocation(n_components = n_components, random_state=230, max_iter=20)
+    lda.fit(preprocess_data) #train LDA
+    #return partition of each topic for each document (dense array of size n_doc * n_components)
+    return topic_partition(lda.transform(preprocess_data))
+
+def _limit_threads(n_threads):
+    """Limit the number of threads used by BLAS/OpenMP in a worker process (so workers don't oversubscribe the cores)"""
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=n_threads)
+    except ImportError: #only effective for libraries not loaded yet
+        for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+            os.environ[variable] = str(n_threads)
+
+def run_lda_once(lemmas, n_components, nlp=None):
     """Run LDA algorithm for only one anomaly date
     :argument n_components: int (number of topics, set to 2 by default: out of scope and in the scope)
-    :argument sentences: list of str (sentences)
-    :argument nlp: spacy language model
+    :argument lemmas: list of str (lemmatized sentences, see lemmatize_articles)
+    :argument nlp: deprecated, run_lda_once(sentences, nlp, n_components) lemmatizes the sentences with nlp first
     :returns a dictionary: keys are topics and values are ids of articles to keep for each topic (for each topic t, only keep articles whose dominant topic is t)
     """
+    if not isinstance(n_components, numbers.Integral): #former signature run_lda_once(sentences, nlp, n_components)
+        nlp, n_components = n_components, nlp
+    if nlp is not None:
+        warnings.warn('run_lda_once(sentences, nlp, n_components) is deprecated, '
+                      'use run_lda_once(lemmatize_articles(sentences), n_components)', DeprecationWarning, stacklevel=2)
+        lemmas = lemmatization(list(sent_to_words(lemmas)), nlp)
+    if not lemmas:
+        return {}
     #preprocess sentences
-    preprocess_data, vectorizer = preprocess(sentences, nlp)
-    
-    lda = LatentDirichletAllocation(n_components = n_components, random_state=230, max_iter=20)
-    lda.fit(preprocess_data) #train LDA
-    #return partition of each topic for each document (dense array of size n_doc * n_components)
-    lda_output = lda.transform(preprocess_data) 
-
-    # Create dataframe
-    topicnames = ["Topic" + str(i) for i in range(n_components)] #column names
-    docnames = ["Doc" + str(i) for i in range(preprocess_data.shape[0])] # index names
-    df_document_topic = pd.DataFrame(lda_output, columns=topicnames, index=docnames)
-
-    # Get dominant topic for each document
-    dominant_topic = np.argmax(df_document_topic.values, axis=1)
-    df_document_topic['dominant_topic'] = dominant_topic
-    
-    ids_topic = {} #create number of topics set of articles (this is a partition of the set of all articles)
-    topics = list(df_document_topic.groupby('dominant_topic').count()['Topic0'].sort_values(ascending = False).index) #sort topics by dominance across documents
-    for topic in topics:
-        ids_topic[topic] = list(map(lambda x: int(x[3:]),
-                          list(df_document_topic[df_document_topic['dominant_topic']==topic].index)))
-    
-    return ids_topic
-
-def run_lda(dic_sentences, n_components):
+    preprocess_data, vectorizer = preprocess(lemmas)
+    return _fit_lda(preprocess_data, n_components)
+
+class CorpusLDA:
+    """One vocabulary and one LDA model for the whole article corpus of an entity
+    The vectorizer is fitted on the first articles only and then reused with transform, the LDA model is
+    trained online (partial_fit) on each batch of new articles. Every article is vectorized once:
+    the corpus is kept as a single sparse matrix (one row per distinct article), so topics are
+    comparable between anomaly dates and a refresh only processes new articles.
+    Words that were not in the first articles are ignored by later batches. Only the counts of the max_articles most
+    recent articles are kept (the LDA model keeps what it learned from the older ones).
+    """
+    def __init__(self, n_components, max_articles=MAX_CORPUS_ARTICLES):
+        """
+        :argument n_components: int (number of topics)
+        :argument max_articles: int, maximum number of articles kept in matrix
+        """
+        self.n_components = n_components
+        self.max_articles = max_articles
+        self.vectorizer = None
+        self.lda = LatentDirichletAllocation(n_components=n_components, learning_method='online', random_state=230)
+        self.matrix = None #sparse matrix, one row per article
+        self.rows = {} #key of the lemmas of an article -> row in matrix
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, lemmas):
+        """Vectorize the new articles and train the model on them
+        :argument lemmas: list of str (lemmatized articles, see lemmatize_articles)
+        :returns an array of int, the row of each article in matrix (same order)
+        """
+        keys = [hashlib.sha1(lemma.encode('utf-8')).hexdigest() for lemma in lemmas]
+        new_lemmas = []
+        for key, lemma in zip(keys, lemmas):
+            if key not in self.rows:
+                self.rows[key] = len(self.rows)
+                new_lemmas.append(lemma)
+
+        if new_lemmas:
+            if self.vectorizer is None:
+                self.vectorizer = _new_vectorizer()
+                data = self.vectorizer.fit_transform(new_lemmas)
+            else:
+                data = self.vectorizer.transform(new_lemmas)
+            self.matrix = data if self.matrix is None else vstack([self.matrix, data], format='csr')
+            self.lda.partial_fit(data) #online update of the topics with the new batch only
+            self._trim(keys)
+        return np.array([self.rows[key] for key in keys], dtype=np.int64)
+
+    def _trim(self, keys):
+        """Keep the counts of at most max_articles articles: the articles of keys and the most recent other ones"""
+        if len(self.rows) <= self.max_articles:
+            return
+        kept = set(keys)
+        for key in sorted(self.rows, key=self.rows.get, reverse=True):
+            if len(kept) >= self.max_articles:
+                break
+            kept.add(key)
+        kept = sorted(kept, key=self.rows.get)
+        self.matrix = self.matrix[[self.rows[key] for key in kept]]
+        self.rows = {key: row for row, key in enumerate(kept)}
+
+    def partition(self, rows):
+        """Group articles by dominant topic
+        :argument rows: array of int (see add)
+        :returns a dictionary: keys are topics and values are arrays of positions in rows (see topic_partition)
+        """
+        if len(rows) == 0:
+            return {}
+        return topic_partition(self.lda.transform(self.matrix[rows]))
+
+def _corpus_path(entity, n_components):
+    """File of the CorpusLDA of an entity: a file per entity, never evicted as the entries of the cache are"""
+    digest = hashlib.sha1(repr((entity, n_components, SPACY_MODEL, tuple(ALLOWED_POSTAGS))).encode('utf-8')).hexdigest()[:10]
+    return get_cache_dir() / MODELS_DIR / '{}-{}.pkl'.format(re.sub(r'[^\w.-]+', '_', entity)[:60], digest)
+
+def load_corpus_lda(entity, n_components):
+    """Get the CorpusLDA of an entity (a new one if there is none)"""
+    if entity is None:
+        return CorpusLDA(n_components)
+    path = _corpus_path(entity, n_components)
+    if not path.exists():
+        return CorpusLDA(n_components)
+    with open(str(path), 'rb') as f:
+        return pickle.load(f)
+
+def save_corpus_lda(entity, corpus):
+    """Persist the CorpusLDA of an entity, a re-run only processes new articles
+    The file is written atomically (through a temporary file).
+    """
+    if entity is None:
+        return
+    path = _corpus_path(entity, corpus.n_components)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(str(tmp), 'wb') as f:
+        pickle.dump(corpus, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(str(tmp), str(path))
+
+def get_nlp():
+    """Get the spacy 'en' model, loaded only once per process
+    Only the tagger component is kept (for efficiency)
+    :returns spacy language model
+    """
+    global _nlp
+    with _nlp_lock:
+        if _nlp is None:
+            import spacy #heavy import, only done when LDA is run
+            try:
+                _nlp = spacy.load(SPACY_MODEL, disable=['parser', 'ner'])
+            except:
+                raise NLPNotFoundError("No spacy 'en' model were found, please run in terminal: python3 -m spacy download en")
+        return _nlp
+
+def run_lda(dic_sentences, n_components, batch_size=BATCH_SIZE, n_process=1, n_jobs=1, threads_per_job=1,
+            shared=False, entity=None):
     """Run LDA algorithm
     :argument dic_sentences: dic, keys are date and values are list of sentences
     :argument n_components: int (number of topics, set to 2 by default: out of scope and in the scope)
-    :returns a dic - keys are dates, values are a list of 3 dataframes (see run_lda_once for more information)
+    :argument batch_size: number of documents processed together by spacy
+    :argument n_process: number of processes used by spacy
+    :argument n_jobs: number of processes training the LDA of each date in parallel
+    :argument threads_per_job: number of BLAS/OpenMP threads of each of these processes
+    :argument shared: if True, a single vocabulary and LDA model are used for all dates (see CorpusLDA)
+        instead of one per date, n_jobs is then ignored
+    :argument entity: str, name of the entity, the shared model is persisted under it (not persisted if None)
+    :returns a dic - keys are dates, values are dictionaries (see run_lda_once for more information)
     """
-    # Initialize spacy 'en' model, keeping only tagger component (for efficiency)
-    try:
-        nlp = spacy.load('en', disable=['parser', 'ner'])
-    except:
-        raise NLPNotFoundError("No spacy 'en' model were found, please run in terminal: python3 -m spacy download en")
-        
-    dates = dic_sentences.keys()
-    dic_info = {}
-    for date in dates:
-        dic_info[date] = run_lda_once(dic_sentences[date], nlp, n_components=n_components)
-    return dic_info
\ No newline at end of file
+    dates = list(dic_sentences.keys())
+    sentences = [sentence for date in dates for sentence in dic_sentences[date]]
+    offsets = np.cumsum([0] + [len(dic_sentences[date]) for date in dates])
+    partitions = _run_lda(sentences, offsets, n_components, batch_size, n_process, n_jobs, threads_per_job, shared, entity)
+    return dict(zip(dates, partitions))
+
+def run_lda_table(table, n_components, batch_size=BATCH_SIZE, n_process=1, n_jobs=1, threads_per_job=1,
+                  shared=False, entity=None):
+    """Run LDA algorithm on an ArticleTable (see run_lda for the arguments)
+    :returns a dic - keys are dates, values are dictionaries whose keys are topics and values are arrays of ids (rows of table)
+    """
+    sentences = table.text.take(range(len(table)))
+    partitions = _run_lda(sentences, table.offsets, n_components, batch_size, n_process, n_jobs, threads_per_job,
+                          shared, entity)
+    return {date: {topic: ids + table.offsets[i] for topic, ids in partition.items()}
+            for i, (date, partition) in enumerate(zip(table.dates, partitions))}
+
+def _run_lda(sentences, offsets, n_components, batch_size, n_process, n_jobs, threads_per_job, shared, entity):
+    """Run LDA on the articles of several dates
+    :argument sentences: list of str, articles of all dates
+    :argument offsets: array of int, articles of the i-th date are sentences[offsets[i]:offsets[i+1]]
+    :returns a list (one item per date) of dictionaries, keys are topics and values are arrays of positions within the date
+    """
+    with span('lda', dates=len(offsets) - 1, shared=shared):
+        return _run_lda_stages(sentences, offsets, n_components, batch_size, n_process, n_jobs, threads_per_job, shared,
+                               entity)
+
+def _run_lda_stages(sentences, offsets, n_components, batch_size, n_process, n_jobs, threads_per_job, shared, entity):
+    """See _run_lda"""
+    #the articles of all dates are lemmatized together
+    with span('lemmatization'):
+        lemmas = lemmatize_articles(sentences, batch_size=batch_size, n_process=n_process)
+    bounds = list(zip(offsets[:-1], offsets[1:]))
+
+    if shared:
+        corpus = load_corpus_lda(entity, n_components)
+        rows = corpus.add(lemmas)
+        save_corpus_lda(entity, corpus)
+        return [corpus.partition(rows[start:end]) for start, end in bounds]
+
+    matrices = [preprocess(lemmas[start:end])[0] if end > start else csr_matrix((0, 0)) for start, end in bounds]
+    if n_jobs > 1 and len(matrices) > 1: #each date is independent
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(matrices)),
+                                 initializer=_limit_threads, initargs=(threads_per_job,)) as executor:
+            return list(executor.map(_fit_lda, matrices, repeat(n_components)))
+    return [_fit_lda(matrix, n_components) for matrix in matrices]
@@ -1,3 +1,4 @@
 __version__ = "0.1.4"
 
 from .huginn import Huginn
+from .batch import HuginnBatch
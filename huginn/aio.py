@@ -0,0 +1,124 @@
+##################################
+# ASYNCIO (coroutines for async services, see the aget_* methods of Huginn)
+#
+# Article pages are downloaded with aiohttp when it is installed (otherwise with the shared requests session in the
+# default executor of the loop). NYT searches and Google Trends calls are few and rate limited: they stay blocking
+# calls, run in the default executor. CPU work (parsing, LDA, summarization) runs in a configurable executor.
+
+import asyncio
+import functools
+import threading
+import weakref
+
+import requests
+
+from .session import get_session, TIMEOUT, MAX_WORKERS
+from .articles import (get_article_urls_all_dates, _cached_article, _keep_article, _extract_response, _build_table)
+from .extract import failure, REQUEST_ERROR
+from .instrument import span, count
+
+_executor = None
+_executor_lock = threading.Lock()
+_client_sessions = weakref.WeakKeyDictionary() #event loop -> aiohttp.ClientSession
+
+def configure_executor(executor=None):
+    """Set the executor running the CPU work of the coroutines
+    :argument executor: concurrent.futures.Executor, None for the default executor of the event loop.
+        Huginn methods update the Huginn object, so it must run them in the same process (ThreadPoolExecutor):
+        use n_jobs/n_process of the LDA to use several processes.
+    """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+def get_executor():
+    """Get the executor set by configure_executor (None is the default executor of the event loop)"""
+    with _executor_lock:
+        return _executor
+
+async def run_blocking(function, *args, **kwargs):
+    """Run a blocking call (network I/O) in the default executor of the running loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+async def run_cpu(function, *args, **kwargs):
+    """Run CPU-bound work in the executor set by configure_executor"""
+    return await asyncio.get_running_loop().run_in_executor(get_executor(),
+                                                            functools.partial(function, *args, **kwargs))
+
+def _aiohttp():
+    """aiohttp module, None if it isn't installed"""
+    try:
+        import aiohttp
+    except ImportError:
+        return None
+    return aiohttp
+
+async def _get_client_session(aiohttp):
+    """aiohttp session of the running loop (connections are pooled and kept alive as with session.get_session)"""
+    loop = asyncio.get_running_loop()
+    session = _client_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_connect=TIMEOUT[0], sock_read=TIMEOUT[1]))
+        _client_sessions[loop] = session
+    return session
+
+async def close():
+    """Close the aiohttp session of the running loop (call it before the loop is closed)"""
+    session = _client_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+async def afetch(url):
+    """GET url without blocking the event loop
+    :returns the HTTP status (int) and the body (bytes)
+    :raises requests.RequestException, aiohttp.ClientError or asyncio.TimeoutError if the request failed
+    """
+    aiohttp = _aiohttp()
+    if aiohttp is None:
+        r = await run_blocking(get_session().get, url, timeout=TIMEOUT)
+        return r.status_code, r.content
+    session = await _get_client_session(aiohttp)
+    async with session.get(url) as r:
+        return r.status, await r.read()
+
+def _request_errors():
+    """Exceptions raised by afetch when a request fails"""
+    aiohttp = _aiohttp()
+    return (requests.RequestException, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp else ())
+
+async def ascrape_article(article_url):
+    """Coroutine version of articles.scrape_article
+    :returns Extraction (see huginn.extract)
+    """
+    #the cache is a sqlite file: its reads and writes don't run on the event loop either
+    extraction = await run_blocking(_cached_article, article_url)
+    if extraction is not None:
+        return extraction
+    count('requests', service='nyt_article')
+    try:
+        status, content = await afetch(article_url)
+    except _request_errors():
+        return await run_blocking(_keep_article, article_url, failure(REQUEST_ERROR))
+    extraction = await run_cpu(_extract_response, status, content)
+    return await run_blocking(_keep_article, article_url, extraction)
+
+async def aget_article_table(keyword, dates, num_links='all', max_workers=MAX_WORKERS):
+    """Coroutine version of articles.get_article_table
+    :argument max_workers: maximum number of concurrent searches and of concurrent article downloads
+    :returns ArticleTable
+    """
+    dates = list(dates)
+    with span('search', keyword=keyword):
+        urls_by_date = await run_blocking(get_article_urls_all_dates, keyword, dates, num_links=num_links,
+                                          max_workers=max_workers)
+    unique_urls = list(dict.fromkeys(url for articles_url in urls_by_date for url in articles_url))
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def scrape(url):
+        async with semaphore:
+            return tuple((await ascrape_article(url))[:3])
+
+    with span('scrape', keyword=keyword):
+        records = dict(zip(unique_urls, await asyncio.gather(*[scrape(url) for url in unique_urls])))
+    scrapped_by_date = [[records[url] for url in articles_url] for articles_url in urls_by_date]
+    return await run_cpu(_build_table, dates, urls_by_date, scrapped_by_date)
@@ -1,5 +1,215 @@
 ##################################
 # ANOMALIES
+#
+# Detectors work on a 2-D array (entities x months) in one pass:
+# the score of a point is (xn - mu_hat(n-1)) / std_hat(n-1), and anomalies are the points with a score above k.
+
+import numpy as np
+import pandas as pd
+
+from .instrument import span
+
+MAX_ANOMALIES = 10 #default maximum number of anomalies (the 10 'biggest' ones)
+
+def _as_2d(values):
+    """From a 1-D (one series) or 2-D (entities x months) array-like to a 2-D float array"""
+    values = np.asarray(values, dtype=np.float64)
+    return values[np.newaxis, :] if values.ndim == 1 else values
+
+# The helpers below work on time-major arrays (months x entities): each month is a contiguous row.
+
+def _shift(values):
+    """Shift every series by one month (the first month becomes NaN)"""
+    shifted = np.empty_like(values)
+    shifted[0] = np.nan
+    shifted[1:] = values[:-1]
+    return shifted
+
+def _alpha(halflife):
+    return 1 - np.exp(np.log(0.5) / halflife)
+
+def _ewm_mean(values, halflife):
+    """Exponential moving weighted mean of every series (same as pandas .ewm(halflife).mean())
+    :argument values: 2-D array (months x entities)
+    :returns 2-D array
+    """
+    factor = 1 - _alpha(halflife)
+    output = np.empty_like(values)
+    mean = values[0].copy()
+    old_wt = np.ones(values.shape[1])
+    output[0] = mean
+    for t in range(1, len(values)):
+        x = values[t]
+        observed = ~np.isnan(x)
+        started = ~np.isnan(mean)
+        update = started & observed
+        old_wt = np.where(started, old_wt * factor, old_wt)
+        changed = update & (mean != x)
+        mean = np.where(changed, (old_wt * mean + x) / (old_wt + 1), mean)
+        old_wt = np.where(update, old_wt + 1, old_wt)
+        mean = np.where(~started & observed, x, mean)
+        output[t] = mean
+    return output
+
+def _ewm_std(values, halflife):
+    """Exponential moving weighted std of every series (same as pandas .ewm(halflife).std(), bias corrected)"""
+    factor = 1 - _alpha(halflife)
+    output = np.full_like(values, np.nan)
+    mean = values[0].copy()
+    var = np.zeros(values.shape[1])
+    sum_wt, sum_wt2, old_wt = np.ones(values.shape[1]), np.ones(values.shape[1]), np.ones(values.shape[1])
+    for t in range(1, len(values)):
+        x = values[t]
+        observed = ~np.isnan(x)
+        started = ~np.isnan(mean)
+        update = started & observed
+        sum_wt = np.where(started, sum_wt * factor, sum_wt)
+        sum_wt2 = np.where(started, sum_wt2 * factor ** 2, sum_wt2)
+        old_wt = np.where(started, old_wt * factor, old_wt)
+        old_mean = mean
+        new_mean = np.where(update & (mean != x), (old_wt * mean + x) / (old_wt + 1), mean)
+        new_var = (old_wt * (var + (old_mean - new_mean) ** 2) + (x - new_mean) ** 2) / (old_wt + 1)
+        var = np.where(update, new_var, var)
+        mean = np.where(~started & observed, x, new_mean)
+        sum_wt = np.where(update, sum_wt + 1, sum_wt)
+        sum_wt2 = np.where(update, sum_wt2 + 1, sum_wt2)
+        old_wt = np.where(update, old_wt + 1, old_wt)
+        numerator = sum_wt * sum_wt
+        denominator = numerator - sum_wt2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            output[t] = np.where(denominator > 0, numerator / denominator * var, np.nan)
+    return np.sqrt(output)
+
+def _rolling_sum(values, window):
+    """Sum of the last window months (NaN until window months are available, or if one of them is NaN)"""
+    output = np.full_like(values, np.nan)
+    if window > len(values):
+        return output
+    missing = np.isnan(values)
+    has_missing = missing.any()
+    cumsum = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(np.where(missing, 0, values) if has_missing else values, axis=0, out=cumsum[1:])
+    output[window - 1:] = cumsum[window:] - cumsum[:-window]
+    if has_missing:
+        count = np.zeros(cumsum.shape, dtype=np.int64)
+        np.cumsum(missing, axis=0, out=count[1:])
+        output[window - 1:][(count[window:] - count[:-window]) > 0] = np.nan
+    return output
+
+def _rolling_mean(values, window):
+    """Rolling mean of every series (same as pandas .rolling(window).mean())"""
+    return _rolling_sum(values, window) / window
+
+def _rolling_std(values, window):
+    """Rolling std of every series (same as pandas .rolling(window).std())"""
+    if window < 2:
+        return np.full_like(values, np.nan)
+    mean = _rolling_sum(values, window) / window
+    var = np.clip((_rolling_sum(values ** 2, window) - window * mean ** 2) / (window - 1), 0, None)
+    changes = np.zeros_like(values)
+    changes[1:] = values[1:] != values[:-1]
+    constant = _rolling_sum(changes, window - 1) == 0 #no change in the window
+    return np.sqrt(np.where(constant & ~np.isnan(var), 0, var)) #exact 0 for constant windows (no rounding noise)
+
+_PARAMS = {'constant': (), #names (mean parameter, std parameter) and default values of each method
+           'rolling': (('lookback_mean', 1), ('lookback_std', 10)),
+           'ewm': (('halflife_mean', 1), ('halflife_std', 10))}
+
+def _check_params(method, params):
+    """Raise an error if the method or its parameters are unknown"""
+    if method not in _PARAMS:
+        raise ValueError('Unknown method \'{}\', use one of ewm, rolling, constant'.format(method))
+    unknown = set(params) - set(name for name, _ in _PARAMS[method])
+    if unknown:
+        raise TypeError('Unexpected parameters for method \'{}\': {}'.format(method, ', '.join(sorted(unknown))))
+
+def _mean(values, method, param):
+    """mu_hat(n-1) of every point (time-major values)"""
+    if method == 'constant':
+        return np.nanmean(values, axis=0, keepdims=True)
+    if method == 'rolling':
+        return _shift(_rolling_mean(values, param))
+    return _shift(_ewm_mean(values, param))
+
+def _std(values, method, param):
+    """std_hat(n-1) of every point (time-major values), NaN if it is 0"""
+    if method == 'constant':
+        std = np.nanstd(values, axis=0, ddof=1, keepdims=True)
+    elif method == 'rolling':
+        std = _shift(_rolling_std(values, param))
+    else:
+        std = _shift(_ewm_std(values, param))
+    return np.where(std > 0, std, np.nan)
+
+def _scores(values, method, **params):
+    """Score of every point: (xn - mean) / std, mean and std depending on the method
+    :argument values: 2-D array (entities x months)
+    :argument method: ewm, rolling or constant
+    :returns 2-D array (entities x months) of scores (NaN if undefined or if std is 0)
+    """
+    _check_params(method, params)
+    values = np.ascontiguousarray(values.T)
+    mean_param, std_param = [params.get(name, default) for name, default in _PARAMS[method]] or [None, None]
+    with np.errstate(invalid='ignore'):
+        return ((values - _mean(values, method, mean_param)) / _std(values, method, std_param)).T
+
+def _select(scores, k, top_k):
+    """Keep the top_k biggest scores above k along the last axis (months)
+    :returns positions and scores (same shape as scores but top_k months) sorted by position, padded with -1 and NaN
+    """
+    with np.errstate(invalid='ignore'):
+        masked = np.where(scores > k, scores, -np.inf)
+    n_months = scores.shape[-1]
+    top_k = n_months if top_k is None else min(top_k, n_months)
+    if top_k < n_months:
+        positions = np.argpartition(-masked, top_k - 1, axis=-1)[..., :top_k] #partial selection, no full sort
+    else:
+        positions = np.broadcast_to(np.arange(n_months), masked.shape)
+    top_scores = np.take_along_axis(masked, positions, axis=-1)
+    positions = np.where(np.isfinite(top_scores), positions, n_months)
+    order = np.argsort(positions, axis=-1)
+    positions = np.take_along_axis(positions, order, axis=-1)
+    top_scores = np.take_along_axis(top_scores, order, axis=-1)
+    valid = positions < n_months
+    return np.where(valid, positions, -1), np.where(valid, top_scores, np.nan)
+
+def detect(values, method='ewm', k=1, top_k=MAX_ANOMALIES, **params):
+    """Detect anomalies of many series at once
+
+    :argument values: 2-D array (entities x months), or 1-D array (one series)
+    :argument method: ewm (halflife_mean, halflife_std), rolling (lookback_mean, lookback_std) or constant
+    :argument k: float, a point is an anomaly if its score is above k
+    :argument top_k: int, maximum number of anomalies per series (the biggest scores), None to keep all
+
+    :returns positions (int) and scores (float) of the anomalies, two 2-D arrays (entities x top_k) sorted by position,
+        padded with -1 and NaN when a series has less than top_k anomalies
+    """
+    return _select(_scores(_as_2d(values), method, **params), k, top_k)
+
+def detect_anomalies(data, method="ewm", k=1, top_k=MAX_ANOMALIES, **kwargs):
+    """Get anomalies and their scores for every column of data at once (see detect)
+
+    :argument data: dataframe with one column per entity (interest) and pandas dates as index
+    :returns a dictionary, keys are columns and values are series (anomaly dates as index, scores as values)
+    """
+    with span('anomalies', method=method, entities=data.shape[1]):
+        positions, scores = detect(data.values.T, method=method, k=k, top_k=top_k, **kwargs)
+    results = {}
+    for i, column in enumerate(data.columns):
+        valid = positions[i] >= 0
+        results[column] = pd.Series(scores[i][valid], index=data.index[positions[i][valid]], name=column)
+    return results
+
+def get_anomalies(data, method="ewm", **kwargs):
+    """Get anomalies of every column of data at once (see detect)
+
+    :argument data: dataframe with one column per entity (interest) and pandas dates as index
+    :argument method: ewm, rolling or constant
+    :argument **kwargs: parameters of the method, k and top_k
+
+    :returns a dictionary, keys are columns and values are anomalies as DatetimeIndex sorted(dtype=datetime64[ns])
+    """
+    return {column: scores.index for column, scores in detect_anomalies(data, method, **kwargs).items()}
 
 def constant_sd(data, k = 1):
     """method to get anomalies as dates (DatetimeIndex) (dtype=datetime64[ns])
@@ -15,10 +225,7 @@ def constant_sd(data, k = 1):
 
     :returns anomalies as DatetimeIndex sorted(dtype=datetime64[ns])
     """
-    mean = data.mean()[0]
-    std = data.std()[0]
-    tmp = data-mean-k*std
-    return tmp[tmp.iloc[:,0]>0].sort_values(by = tmp.columns[0], ascending=False)[0:10].index.sort_values()
+    return get_anomalies(data.iloc[:, :1], "constant", k=k)[data.columns[0]]
 
 def rolling_std(data, lookback_mean = 1, lookback_std = 10, k = 1):
     """method to get anomalies as dates (DatetimeIndex) (dtype=datetime64[ns])
@@ -34,13 +241,10 @@ def rolling_std(data, lookback_mean = 1, lookback_std = 10, k = 1):
 
     :returns anomalies as DatetimeIndex sorted(dtype=datetime64[ns])
     """
-    mean = data.rolling(lookback_mean).mean().shift(1)
-    std = data.rolling(lookback_std).std().shift(1)
-    std = std[std>0]
-    tmp = (data-mean)/(k*std)
-    return tmp[tmp.iloc[:,0]>1].sort_values(by = tmp.columns[0], ascending = False)[0:10].index.sort_values()
+    return get_anomalies(data.iloc[:, :1], "rolling", k=k,
+                         lookback_mean=lookback_mean, lookback_std=lookback_std)[data.columns[0]]
 
-def ewm_std(data, halflife_mean=1, halflife_std=10, k = 1): 
+def ewm_std(data, halflife_mean=1, halflife_std=10, k = 1):
     """method to get anomalies as dates (DatetimeIndex) (dtype=datetime64[ns])
     - exponential moving weighted (emw) mean mu_hat(n)
     - emw std sigma_hat(n)
@@ -54,8 +258,80 @@ def ewm_std(data, halflife_mean=1, halflife_std=10, k = 1):
 
     :returns anomalies as DatetimeIndex sorted(dtype=datetime64[ns])
     """
-    mean = data.ewm(halflife = halflife_mean).mean().shift(1)
-    std = data.ewm(halflife = halflife_std).std().shift(1)
-    std = std[std>0]
-    tmp = (data-mean)/(k*std)
-    return tmp[tmp.iloc[:,0]>1].sort_values(by = tmp.columns[0], ascending = False)[0:10].index.sort_values()
+    return get_anomalies(data.iloc[:, :1], "ewm", k=k,
+                         halflife_mean=halflife_mean, halflife_std=halflife_std)[data.columns[0]]
+
+class AnomalySweep:
+    """Anomalies for every combination of a grid of detector parameters
+
+    - params: dataframe, one row per combination (parameters of the method and k)
+    - flags: bool array (combinations x entities x months), True if the month is an anomaly for the combination
+    - dates: DatetimeIndex of the months
+    - columns: list of entities
+    """
+    def __init__(self, params, flags, dates, columns):
+        self.params = params
+        self.flags = flags
+        self.dates = dates
+        self.columns = list(columns)
+
+    def matrix(self, column=None):
+        """Anomaly matrix of one entity (the first one by default)
+        :returns dataframe of bool, one row per combination (same index as params) and one column per month
+        """
+        i = 0 if column is None else self.columns.index(column)
+        return pd.DataFrame(self.flags[:, i, :], index=self.params.index, columns=self.dates)
+
+    def stability(self):
+        """Share of the combinations flagging each month as an anomaly
+        :returns dataframe with dates as index and one column per entity (float between 0 and 1)
+        """
+        return pd.DataFrame(self.flags.mean(axis=0).T, index=self.dates, columns=self.columns)
+
+    def stable_anomalies(self, min_share=0.5):
+        """Months flagged by at least min_share of the combinations
+        :returns a dictionary, keys are entities and values are anomalies as DatetimeIndex
+        """
+        stability = self.stability()
+        return {column: stability.index[stability[column].values >= min_share] for column in self.columns}
+
+def sweep(data, method="ewm", k=1, top_k=MAX_ANOMALIES, **grid):
+    """Get anomalies for a whole grid of parameters at once
+
+    The means and stds are computed once per parameter value (not once per combination) for all entities,
+    and every k is applied to the same scores.
+
+    :argument data: dataframe with one column per entity (interest) and pandas dates as index
+    :argument method: ewm, rolling or constant
+    :argument k: float or list of floats
+    :argument top_k: maximum number of anomalies per combination and entity
+    :argument **grid: float or list of floats for each parameter of the method
+        (ex: halflife_mean=[1, 2], halflife_std=[5, 10, 20] for ewm)
+
+    :returns AnomalySweep
+    """
+    _check_params(method, grid)
+    names = [name for name, _ in _PARAMS[method]]
+    grids = [list(np.atleast_1d(grid.get(name, default))) for name, default in _PARAMS[method]] or [[None], [None]]
+    ks = np.atleast_1d(np.asarray(k, dtype=np.float64))
+
+    values = np.ascontiguousarray(data.values, dtype=np.float64) #months x entities
+    means = {param: _mean(values, method, param) for param in grids[0]}
+    stds = {param: _std(values, method, param) for param in grids[1]}
+
+    n_months, n_entities = values.shape
+    rows, flags = [], []
+    for mean_param in grids[0]:
+        for std_param in grids[1]:
+            with np.errstate(invalid='ignore'):
+                scores = ((values - means[mean_param]) / stds[std_param]).T
+            positions, _ = _select(scores[np.newaxis], ks[:, np.newaxis, np.newaxis], top_k)
+            combination_flags = np.zeros((len(ks), n_entities, n_months + 1), dtype=bool)
+            np.put_along_axis(combination_flags, np.where(positions >= 0, positions, n_months), True, axis=-1)
+            flags.append(combination_flags[..., :n_months])
+            for k_value in ks:
+                row = dict(zip(names, (mean_param, std_param)))
+                row['k'] = k_value
+                rows.append(row)
+
+    return AnomalySweep(pd.DataFrame(rows), np.concatenate(flags), data.index, data.columns)
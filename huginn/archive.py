@@ -0,0 +1,182 @@
+##################################
+# SAVED INVESTIGATIONS (see Huginn.save and Huginn.load)
+#
+# An investigation is a zip file:
+# - manifest.json: format version, entity, mid, parameters of each stage, topics and summaries
+# - .npy arrays: interest, anomalies and the small columns of the articles (urls, titles, images)
+# - text/<i>.zlib: the texts of the articles of each stored date, compressed, read only when they are accessed
+
+import io
+import json
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from .article_table import StringColumn, ArticleTable
+from .exceptions import ArchiveError
+
+FORMAT = 'huginn-investigation'
+FORMAT_VERSION = 1
+
+class CompressedBuffer:
+    """utf-8 buffer of a StringColumn stored as compressed blocks in a zip file, blocks are decompressed on first access
+    - path: the zip file
+    - names: name of each block in the zip file
+    - bounds: int64 array of size n+1, block i is the bytes bounds[i]:bounds[i+1] of the buffer
+    """
+    def __init__(self, path, names, bounds):
+        self.path = path
+        self.names = names
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _block(self, i):
+        with self._lock:
+            if i not in self._blocks:
+                with zipfile.ZipFile(self.path) as archive:
+                    self._blocks[i] = np.frombuffer(zlib.decompress(archive.read(self.names[i])), dtype=np.uint8)
+            return self._blocks[i]
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def __getitem__(self, item):
+        start, stop, step = item.indices(len(self))
+        if step != 1:
+            raise IndexError('CompressedBuffer only supports contiguous slices')
+        if stop <= start:
+            return np.zeros(0, dtype=np.uint8)
+        first = np.searchsorted(self.bounds, start, side='right') - 1
+        last = np.searchsorted(self.bounds, stop, side='left')
+        parts = [self._block(i) for i in range(first, last)]
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return data[start - self.bounds[first]:stop - self.bounds[first]]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[0:len(self)]
+        return data if dtype is None else data.astype(dtype)
+
+def _encode_key(key):
+    """Key of a stage result (date, parameters of the stages...) as JSON"""
+    def encode(value):
+        return [encode(item) for item in value] if isinstance(value, tuple) else value
+    return [key[0].isoformat()] + encode(key[1:])
+
+def _decode_key(key):
+    def decode(value):
+        return tuple(decode(item) for item in value) if isinstance(value, list) else value
+    return (pd.Timestamp(key[0]),) + decode(key[1:])
+
+def save_investigation(path, state):
+    """Write the state of a Huginn object (see Huginn.save)
+    :argument state: dictionary with name, mid, interest, anomalies, anomaly_scores, stages, results, options and
+        global_summary, summary_of_summaries (None if not computed)
+    """
+    arrays = {'interest_values': state['interest'].values.astype(np.float64),
+              'interest_dates': state['interest'].index.values}
+    if state['anomalies'] is not None:
+        arrays['anomalies'] = np.asarray(state['anomalies'].values)
+    if state['anomaly_scores'] is not None:
+        arrays['anomaly_scores'] = state['anomaly_scores'].values.astype(np.float64)
+
+    results = state['results']
+    #articles of the current anomalies first, so that load can use them without copying (see load_investigation)
+    current = state['current_articles']
+    article_keys = current + [key for key in results['articles'] if key not in current]
+    blocks = []
+    if article_keys:
+        table = ArticleTable.concat([results['articles'][key] for key in article_keys],
+                                    dates=[key[0] for key in article_keys])
+        for name in ['offsets', 'found', 'image_offsets']:
+            arrays['articles_' + name] = getattr(table, name)
+        for column in ['url', 'title', 'images']:
+            arrays['articles_{}_data'.format(column)] = np.asarray(getattr(table, column).data)
+            arrays['articles_{}_offsets'.format(column)] = getattr(table, column).offsets
+        arrays['articles_text_offsets'] = table.text.offsets
+        bounds = table.text.offsets[table.offsets]
+        arrays['articles_text_bounds'] = bounds
+        blocks = [zlib.compress(np.asarray(table.text.data[start:end]).tobytes())
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+
+    manifest = {'format': FORMAT, 'version': FORMAT_VERSION, 'name': state['name'], 'mid': state['mid'],
+                'interest_columns': [str(column) for column in state['interest'].columns],
+                'interest_index_name': state['interest'].index.name,
+                'stages': {stage: list(value) if isinstance(value, tuple) else value
+                           for stage, value in state['stages'].items()},
+                'options': state['options'],
+                'articles': [_encode_key(key) for key in article_keys], 'current_articles': len(current),
+                'topics': [[_encode_key(key), {str(topic): [int(i) for i in ids] for topic, ids in topics.items()}]
+                           for key, topics in results['topics'].items()],
+                'summaries': [[_encode_key(key), {str(topic): summary for topic, summary in summaries.items()}]
+                              for key, summaries in results['summaries'].items()],
+                'global_summary': state['global_summary'], 'summary_of_summaries': state['summary_of_summaries']}
+
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('manifest.json', json.dumps(manifest))
+        for name, array in arrays.items():
+            buffer = io.BytesIO()
+            np.save(buffer, array, allow_pickle=False)
+            archive.writestr(name + '.npy', buffer.getvalue())
+        for i, block in enumerate(blocks): #already compressed
+            archive.writestr('text/{}.zlib'.format(i), block, compress_type=zipfile.ZIP_STORED)
+
+def load_investigation(path):
+    """Read a file written by save_investigation, the texts of the articles are read when they are accessed
+    :returns the state (see save_investigation), plus 'table': the article table of the current anomalies (None if none)
+    :raises ArchiveError if the file isn't a saved investigation or was written by a newer version of huginn
+    """
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise ArchiveError('{} is not a saved Huginn investigation'.format(path))
+    with archive:
+        try:
+            manifest = json.loads(archive.read('manifest.json').decode('utf-8'))
+        except KeyError:
+            raise ArchiveError('{} is not a saved Huginn investigation'.format(path))
+        if manifest.get('format') != FORMAT:
+            raise ArchiveError('{} is not a saved Huginn investigation'.format(path))
+        if manifest['version'] > FORMAT_VERSION:
+            raise ArchiveError('{} was saved with format version {}, this version of huginn reads up to version {}'.format(
+                path, manifest['version'], FORMAT_VERSION))
+        names = set(archive.namelist())
+        arrays = {name[:-4]: np.load(io.BytesIO(archive.read(name)), allow_pickle=False)
+                  for name in names if name.endswith('.npy')}
+
+    interest = pd.DataFrame(arrays['interest_values'], index=pd.DatetimeIndex(arrays['interest_dates']),
+                            columns=manifest['interest_columns'])
+    interest.index.name = manifest['interest_index_name']
+    anomalies = pd.DatetimeIndex(arrays['anomalies']) if 'anomalies' in arrays else None
+    anomaly_scores = None
+    if 'anomaly_scores' in arrays:
+        anomaly_scores = pd.Series(arrays['anomaly_scores'], index=anomalies, name=manifest['name'])
+
+    results = {'articles': {}, 'topics': {}, 'summaries': {}}
+    article_keys = [_decode_key(key) for key in manifest['articles']]
+    table = None
+    if article_keys:
+        bounds = arrays['articles_text_bounds']
+        text = StringColumn(CompressedBuffer(path, ['text/{}.zlib'.format(i) for i in range(len(article_keys))], bounds),
+                            arrays['articles_text_offsets'])
+        columns = {column: StringColumn(arrays['articles_{}_data'.format(column)], arrays['articles_{}_offsets'.format(column)])
+                   for column in ['url', 'title', 'images']}
+        stored = ArticleTable([key[0] for key in article_keys], arrays['articles_offsets'], arrays['articles_found'],
+                              columns['url'], columns['title'], text, columns['images'], arrays['articles_image_offsets'])
+        for i, key in enumerate(article_keys):
+            results['articles'][key] = stored._date_table(i)
+        if manifest['current_articles']:
+            table = stored.head(manifest['current_articles'])
+    for key, topics in manifest['topics']:
+        results['topics'][_decode_key(key)] = {int(topic): np.asarray(ids, dtype=np.int64) for topic, ids in topics.items()}
+    for key, summaries in manifest['summaries']:
+        results['summaries'][_decode_key(key)] = {int(topic): summary for topic, summary in summaries.items()}
+
+    stages = {stage: tuple(value) if isinstance(value, list) else value for stage, value in manifest['stages'].items()}
+    return {'name': manifest['name'], 'mid': manifest['mid'], 'interest': interest, 'anomalies': anomalies,
+            'anomaly_scores': anomaly_scores, 'stages': stages, 'results': results, 'options': manifest['options'],
+            'global_summary': manifest['global_summary'], 'summary_of_summaries': manifest['summary_of_summaries'],
+            'table': table}
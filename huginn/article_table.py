@@ -0,0 +1,196 @@
+##################################
+# ARTICLE TABLE (articles of all anomaly dates, one row per article)
+
+import os
+
+import numpy as np
+import pandas as pd
+
+class StringColumn:
+    """Column of strings stored once as a single utf-8 buffer
+    - data: uint8 array (possibly memory-mapped), the concatenated strings
+    - offsets: int64 array of size n+1, string i is data[offsets[i]:offsets[i+1]]
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        """Build a column from a list of str"""
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    @classmethod
+    def concat(cls, columns):
+        """Concatenate several columns"""
+        sizes = [column.offsets[-1] - column.offsets[0] for column in columns]
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        offsets = [np.zeros(1, dtype=np.int64)] + [column.offsets[1:] - column.offsets[0] + start
+                                                    for column, start in zip(columns, starts)]
+        data = np.concatenate([np.asarray(column.data[column.offsets[0]:column.offsets[-1]]) for column in columns]
+                              + [np.zeros(0, dtype=np.uint8)])
+        return cls(data, np.concatenate(offsets))
+
+    def slice(self, start, end):
+        """Column of the strings start to end (the data is shared, not copied)"""
+        return StringColumn(self.data, self.offsets[start:end + 1])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def take(self, ids):
+        """Get several strings
+        :argument ids: array of int (rows)
+        :returns list of str
+        """
+        return [self[i] for i in ids]
+
+    def join(self, ids, sep=' '):
+        """Concatenate several strings (as ' '.join(self.take(ids)) without decoding each string)"""
+        if len(ids) == 0:
+            return ''
+        ids = np.asarray(ids)
+        chunks = [self.data[start:end] for start, end in zip(self.offsets[ids], self.offsets[ids + 1])]
+        separator = np.frombuffer(sep.encode('utf-8'), dtype=np.uint8)
+        parts = [chunks[0]]
+        for chunk in chunks[1:]:
+            parts.extend([separator, chunk])
+        return np.concatenate(parts).tobytes().decode('utf-8')
+
+class ArticleTable:
+    """Scrapped articles of several anomaly dates, addressed by integer ids (rows):
+    - dates: the anomaly dates, rows of the i-th date are offsets[i]:offsets[i+1]
+    - found: number of links found for each date (articles that could not be scrapped have no row)
+    - url, title, text: one StringColumn each, text can be memory-mapped (see save and load)
+    - images: StringColumn of all image links, images of row i are image_offsets[i]:image_offsets[i+1]
+
+    urls, titles, texts and images are always aligned (same rows).
+    """
+    COLUMNS = ['url', 'title', 'text', 'images']
+
+    def __init__(self, dates, offsets, found, url, title, text, images, image_offsets):
+        self.dates = pd.DatetimeIndex(dates)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.found = np.asarray(found, dtype=np.int64)
+        self.url = url
+        self.title = title
+        self.text = text
+        self.images = images
+        self.image_offsets = np.asarray(image_offsets, dtype=np.int64)
+
+    @classmethod
+    def from_scrapped(cls, dates, urls_by_date, scrapped_by_date):
+        """Build the table from the output of the scrapping
+        :argument dates: list of pandas datetime
+        :argument urls_by_date: list (one item per date) of lists of urls
+        :argument scrapped_by_date: list (one item per date) of lists of (images, title, text), (None, None, None) if not scrapped
+        """
+        urls, titles, texts, images, n_images, counts = [], [], [], [], [], []
+        for articles_url, scrapped in zip(urls_by_date, scrapped_by_date):
+            count = 0
+            for url, (image_links, title, text) in zip(articles_url, scrapped):
+                if image_links is not None:
+                    count += 1
+                    urls.append(url)
+                    titles.append(title)
+                    texts.append(text)
+                    images.extend([str(link) for link in image_links])
+                    n_images.append(len(image_links))
+            counts.append(count)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        image_offsets = np.concatenate([[0], np.cumsum(n_images)])
+        return cls(dates, offsets, [len(articles_url) for articles_url in urls_by_date],
+                   StringColumn.from_strings(urls), StringColumn.from_strings(titles), StringColumn.from_strings(texts),
+                   StringColumn.from_strings(images), image_offsets)
+
+    def __len__(self):
+        return len(self.url)
+
+    def select(self, positions):
+        """Table of some dates only
+        :argument positions: list of int (positions of the dates in dates)
+        :returns ArticleTable (rows are renumbered)
+        """
+        return ArticleTable.concat([self._date_table(i) for i in positions], dates=self.dates[list(positions)])
+
+    def head(self, n):
+        """Table of the first n dates (the data is shared, not copied)"""
+        end = self.offsets[n]
+        return ArticleTable(self.dates[:n], self.offsets[:n + 1], self.found[:n], self.url.slice(0, end),
+                            self.title.slice(0, end), self.text.slice(0, end),
+                            self.images.slice(0, self.image_offsets[end]), self.image_offsets[:end + 1])
+
+    def _date_table(self, i):
+        """Table of the i-th date only"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        image_start, image_end = self.image_offsets[start], self.image_offsets[end]
+        return ArticleTable(self.dates[i:i + 1], [0, end - start], self.found[i:i + 1], self.url.slice(start, end),
+                            self.title.slice(start, end), self.text.slice(start, end),
+                            self.images.slice(image_start, image_end),
+                            self.image_offsets[start:end + 1] - image_start)
+
+    @classmethod
+    def concat(cls, tables, dates=None):
+        """Concatenate the dates of several tables
+        :argument tables: list of ArticleTable
+        :argument dates: the dates of the result (the dates of the tables if None)
+        """
+        if dates is None:
+            dates = [date for table in tables for date in table.dates]
+        counts = [count for table in tables for count in np.diff(table.offsets)]
+        n_images = [count for table in tables for count in np.diff(table.image_offsets)]
+        return cls(dates, np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]),
+                   np.concatenate([table.found for table in tables] + [np.zeros(0, dtype=np.int64)]),
+                   *[StringColumn.concat([getattr(table, column) for table in tables]) for column in cls.COLUMNS],
+                   np.concatenate([[0], np.cumsum(n_images, dtype=np.int64)]))
+
+    def rows(self, i):
+        """Ids of the articles of the i-th date"""
+        return np.arange(self.offsets[i], self.offsets[i + 1])
+
+    def get_images(self, row):
+        """Image links of an article"""
+        return self.images.take(range(self.image_offsets[row], self.image_offsets[row + 1]))
+
+    def by_date(self, column):
+        """Get a column as a dictionary
+        :argument column: url, title, text or images
+        :returns a dictionary, keys are dates and values are lists (one item per article)
+        """
+        if column == 'images':
+            get = self.get_images
+        else:
+            get = getattr(self, column).__getitem__
+        return {date: [get(row) for row in self.rows(i)] for i, date in enumerate(self.dates)}
+
+    def save(self, directory):
+        """Write the table as .npy files in a directory (the text can then be memory-mapped by load)"""
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'dates': self.dates.values.astype('datetime64[ns]'), 'offsets': self.offsets, 'found': self.found,
+                  'image_offsets': self.image_offsets}
+        for column in self.COLUMNS:
+            arrays[column + '_data'] = np.asarray(getattr(self, column).data)
+            arrays[column + '_offsets'] = getattr(self, column).offsets
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, name + '.npy'), array, allow_pickle=False)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Read a table written by save
+        :argument mmap: True to memory-map the text instead of reading it
+        """
+        def read(name, mmap_mode=None):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+        columns = {}
+        for column in cls.COLUMNS:
+            #np.load can't memory-map an empty file
+            mmap_mode = 'r' if mmap and column == 'text' and read(column + '_offsets')[-1] > 0 else None
+            columns[column] = StringColumn(read(column + '_data', mmap_mode), read(column + '_offsets'))
+        return cls(read('dates'), read('offsets'), read('found'), columns['url'], columns['title'], columns['text'],
+                   columns['images'], read('image_offsets'))
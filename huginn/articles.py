@@ -5,10 +5,20 @@ import requests
 import os
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
 
-from .exceptions import NytApiError, DotEnvError, ConfigNotFoundError
+from .exceptions import NytApiError, DotEnvError, ConfigNotFoundError, CacheMissError
+from .session import get_session, fetch_all, TIMEOUT, MAX_WORKERS
+from .cache import get_cache, is_offline
+from .scheduler import get_scheduler
+from .article_table import ArticleTable
+from .instrument import span, count, progress
+from .extract import Extraction, extract_article, failure, REQUEST_ERROR, HTTP_ERROR, OFFLINE
+
+NYT_API_URL = 'https://api.nytimes.com/svc/search/v2/articlesearch.json'
+PAGE_SIZE = 10 #number of results per page of the NYT search API
+MAX_PAGES = 100 #the NYT search API doesn't go further than page 100
 
 def _timestamp_to_string(timestamp):
     """Extracts the date from a pandas timestamp and convert to a string
@@ -43,25 +53,114 @@ def get_api_key():
 
     return api_key
 
-def get_nyt_url(keyword, date):
+def _get_search_bounds(date):
+    """Get the first and last days to search articles for an anomaly date (from 2 days before to 1 month and 2 days after)
+
+    :returns two pandas timestamps
+    """
+    return date - pd.DateOffset(days=2), date + pd.DateOffset(months = 1) + pd.DateOffset(days=2)
+
+def _get_search_window(date):
+    """Get the dates to search articles for an anomaly date (see _get_search_bounds)
+
+    :returns two strings (begin_date and end_date) of the format: '20190908'
+    """
+    begin, end = _get_search_bounds(date)
+    return _timestamp_to_string(begin), _timestamp_to_string(end)
+
+def plan_searches(dates):
+    """Group the anomaly dates whose search windows overlap or are adjacent, each group is searched with one query
+
+    :argument dates: list of pandas timestamps
+    :returns a list of groups (lists of positions in dates), dates are sorted inside and between groups
+    """
+    groups, group_end = [], None
+    for i in sorted(range(len(dates)), key=lambda i: dates[i]):
+        begin, end = _get_search_bounds(dates[i])
+        if groups and begin <= group_end + pd.DateOffset(days=1):
+            groups[-1].append(i)
+            group_end = max(group_end, end)
+        else:
+            groups.append([i])
+            group_end = end
+    return groups
+
+def get_nyt_url(keyword, date, page=0):
     """Construct NYT API URL
 
     :argument keyword: entity you are interested in
     :argument date: pandas timestemp
+    :argument page: int, page of the results (10 results per page)
 
     :returns: corresponding url as a string
     """
-    begin_date = _timestamp_to_string(date - pd.DateOffset(days=2))
-    end_date = _timestamp_to_string(date + pd.DateOffset(months = 1) + pd.DateOffset(days=2))
-    start_url = 'https://api.nytimes.com/svc/search/v2/articlesearch.json?'
+    begin_date, end_date = _get_search_window(date)
+    return _get_window_url(keyword, begin_date, end_date, page)
+
+def _get_window_url(keyword, begin_date, end_date, page=0):
+    """Construct NYT API URL for a search window (see get_nyt_url), dates are strings of the format: '20190908'"""
+    start_url = NYT_API_URL + '?'
     api_key = get_api_key()
     sections = _get_sections()
 
-    url = (start_url+"q={}&fq=section_name:({})&api-key={}&begin_date={}&end_date={}") \
-        .format(keyword, sections, api_key, begin_date, end_date)
+    url = (start_url+"q={}&fq=section_name:({})&api-key={}&begin_date={}&end_date={}&page={}") \
+        .format(keyword, sections, api_key, begin_date, end_date, page)
     return url
 
-def get_article_urls(keyword, date, num_links='all'):
+def _search_articles(keyword, date, pages=1):
+    """Get the documents returned by the NYT search API for ONE anomaly date
+    Responses are kept in the persistent cache, keyed by (keyword, begin_date, end_date, sections),
+    only the pages that are not cached yet are requested
+
+    :argument keyword: str keyword to search by
+    :argument date: pd.Timestamp containing the date of anomaly
+    :argument pages: int, number of pages of results to get (10 results per page)
+
+    :returns a list of dictionaries (keys are web_url, document_type and pub_date) and a bool (True if there are no more results)
+    """
+    begin_date, end_date = _get_search_window(date)
+    return _search_window(keyword, begin_date, end_date, pages)
+
+def _search_window(keyword, begin_date, end_date, pages=1):
+    """Get the documents returned by the NYT search API for a search window (see _search_articles)
+    dates are strings of the format: '20190908'
+    """
+    key = (keyword, begin_date, end_date, _get_sections())
+    cache = get_cache('nyt_search')
+    search = cache.get(key, {'docs': [], 'pages': 0, 'hits': None})
+    exhausted = search['hits'] is not None and len(search['docs']) >= search['hits']
+    if search['pages'] >= pages or exhausted:
+        docs = search['docs'][:pages * PAGE_SIZE]
+        #exhausted only if there is no other cached document after the requested pages
+        return docs, exhausted and len(docs) == len(search['docs'])
+    if is_offline():
+        raise CacheMissError('No cached NYT search for {} (page {})'.format(key[:3], search['pages']))
+
+    scheduler = get_scheduler()
+    for page in range(search['pages'], pages):
+        r = scheduler.get(_get_window_url(keyword, begin_date, end_date, page=page))
+
+        # Look for a fault in the returned data
+        try:
+            fault = r.json()['fault']['faultstring']
+            raise NytApiError(fault)
+
+        except KeyError:
+            response = r.json()['response']
+            docs = [{'web_url': news['web_url'],
+                     'document_type': news['document_type'],
+                     'pub_date': news.get('pub_date')} for news in response['docs']]
+            search['docs'].extend(docs)
+            search['pages'] = page + 1
+            search['hits'] = response.get('meta', {}).get('hits', search['hits'])
+            if len(docs) < PAGE_SIZE:
+                search['hits'] = len(search['docs'])
+            cache.set(key, search)
+            if search['hits'] is not None and len(search['docs']) >= search['hits']:
+                return search['docs'], True
+    return search['docs'][:pages * PAGE_SIZE], False
+
+def get_article_urls(keyword, date, num_links='all', max_pages=1):
     """ Returns the links to NYT in the month preceding the input date with a keyword input
 
     Note - we search the month before the anomaly date as well
@@ -69,71 +168,160 @@ def get_article_urls(keyword, date, num_links='all'):
     :argument keyword: str keyword to search by
     :argument date: pd.Timestamp containing the date of anomaly, to search the month before
     :argument num_links: The number of links to return. Default is all.
+    :argument max_pages: number of pages of results (10 results per page) to consider if num_links is 'all'.
+        If num_links is an int, pages are requested until num_links articles are found.
 
     :returns a list of links of length num_links (corresponding to articles for ONE anomaly)
     """
-    url = get_nyt_url(keyword, date)
-    r = requests.get(url)
-
-    # Look for a fault in the returned data
-    try:
-        fault = r.json()['fault']['faultstring']
-        raise NytApiError(fault)
-
-    except KeyError:
+    pages = max_pages if num_links == 'all' else max(1, -(-num_links // PAGE_SIZE))
+    while True:
+        docs, exhausted = _search_articles(keyword, date, pages)
         #only keep article (not multimedia content)
-        articles = [news['web_url'] for news in r.json()['response']['docs'] if news['document_type'] == 'article']
+        articles = [news['web_url'] for news in docs if news['document_type'] == 'article']
         if num_links == 'all':
             return articles
-        else:
+        if len(articles) >= num_links or exhausted or pages >= MAX_PAGES:
             return articles[:num_links]
+        pages += 1
+
+def _in_window(doc, begin_date, end_date):
+    """True if a document was published in a search window (documents without pub_date are kept)"""
+    pub_date = (doc.get('pub_date') or '')[:10].replace('-', '')
+    return not pub_date or begin_date <= pub_date <= end_date
+
+def _get_article_urls_group(keyword, dates, num_links='all', max_pages=1):
+    """Links of the articles of several anomaly dates whose windows overlap, with a single search on the union of their windows
+    Results are split back between dates by publication date. The search is paged until every date has enough
+    results (as get_article_urls would for each date), for at most as many pages as separate searches would start
+    with; dates that are still short of articles are then searched on their own.
+
+    :returns a list (one item per date) of lists of links (see get_article_urls)
+    """
+    windows = [_get_search_window(date) for date in dates]
+    begin_date, end_date = min(window[0] for window in windows), max(window[1] for window in windows)
+    first_pages = max_pages if num_links == 'all' else max(1, -(-num_links // PAGE_SIZE))
+
+    def enough(docs):
+        if num_links == 'all':
+            return len(docs) >= max_pages * PAGE_SIZE
+        return sum(doc['document_type'] == 'article' for doc in docs) >= num_links
+
+    pages = first_pages
+    while True:
+        docs, exhausted = _search_window(keyword, begin_date, end_date, pages)
+        docs_by_date = [[doc for doc in docs if _in_window(doc, *window)] for window in windows]
+        complete = [exhausted or enough(date_docs) for date_docs in docs_by_date]
+        if all(complete) or pages >= min(MAX_PAGES, first_pages * len(dates)):
+            break
+        pages += 1
+
+    urls = []
+    for date, date_docs, date_complete in zip(dates, docs_by_date, complete):
+        if not date_complete: #the date is drowned by the other ones, search it on its own
+            urls.append(get_article_urls(keyword, date, num_links=num_links))
+        elif num_links == 'all':
+            urls.append([doc['web_url'] for doc in date_docs[:max_pages * PAGE_SIZE] if doc['document_type'] == 'article'])
+        else:
+            urls.append([doc['web_url'] for doc in date_docs if doc['document_type'] == 'article'][:num_links])
+    return urls
+
+def get_article_urls_all_dates(keyword, dates, num_links='all', max_workers=MAX_WORKERS):
+    """Links of the articles of several anomaly dates (see get_article_urls)
+    Dates whose search windows overlap are searched together (see plan_searches), searches are run concurrently.
+
+    :argument keyword: str keyword to search by
+    :argument dates: list of pd.Timestamp
+    :argument num_links: The number of links to return for each date. Default is all.
+    :argument max_workers: maximum number of concurrent searches
+
+    :returns a list (one item per date) of lists of links
+    """
+    dates = list(dates)
+    groups = plan_searches(dates)
+
+    def search(group):
+        if len(group) == 1:
+            return [get_article_urls(keyword, dates[group[0]], num_links=num_links)]
+        return _get_article_urls_group(keyword, [dates[i] for i in group], num_links=num_links)
+
+    urls_by_date = [None] * len(dates)
+    for group, urls in zip(groups, fetch_all(search, groups, max_workers=max_workers)):
+        for i, date_urls in zip(group, urls):
+            urls_by_date[i] = date_urls
+    return urls_by_date
 
 def get_article_title_text_images(article_url):
     """Get the images, title and text of ONE article from its url
+    Successfully scrapped articles are kept in the persistent cache, keyed by url
 
     :argument article_url: str corresponding to the web url of the article
 
-    :returns the images, title and content of the article as a string
+    :returns the images, title and content of the article as a string (None, None, None if it could not be scrapped,
+        see scrape_article for the reason)
     """
-    r = requests.get(article_url)
-    soup = BeautifulSoup(r.content, features="lxml")
-    try:
-        image_links = []
-        for link in soup.find_all('img'):
-            imgSrc = link.get('src')
-            image_links.append(imgSrc)
+    images, title, text, error = scrape_article(article_url)
+    return images, title, text
 
-        article_html_content = soup.find('html').find('body').find('article')
+def scrape_article(article_url):
+    """Get the images, title and text of ONE article from its url, with the reason of the failure if it could not be scrapped
+    Successfully scrapped articles are kept in the persistent cache, keyed by url
 
-        title = article_html_content.find('header').find('h1').get_text()
-        section = article_html_content.find('section')
-        div = article_html_content.find('div', {"class": "entry-content"})
+    :argument article_url: str corresponding to the web url of the article
 
-        if section: #NYT article
-            paragraphs = section.find_all('p')
-        else: #NYT blog article
-            paragraphs = div.find_all('p')
+    :returns Extraction (see huginn.extract)
+    """
+    extraction = _cached_article(article_url)
+    if extraction is None:
+        extraction = _keep_article(article_url, _scrape_article(article_url))
+    return extraction
+
+def _cached_article(article_url):
+    """Extraction of an article from the cache, the OFFLINE failure if it isn't cached in offline mode, None otherwise"""
+    record = get_cache('articles').get(article_url)
+    if record is not None:
+        return Extraction(*record, None)
+    if is_offline():
+        return failure(OFFLINE)
+    return None
+
+def _keep_article(article_url, extraction):
+    """Cache a successful extraction (or count the failure)
+    :returns extraction
+    """
+    if extraction.error is None:
+        get_cache('articles').set(article_url, tuple(extraction[:3]))
+    else:
+        count('scrape_failures', reason=extraction.error)
+    return extraction
+
+def _scrape_article(article_url):
+    """Download and parse ONE article (see scrape_article)"""
+    count('requests', service='nyt_article')
+    try:
+        r = get_session().get(article_url, timeout=TIMEOUT)
+    except requests.RequestException:
+        return failure(REQUEST_ERROR)
+    return _extract_response(r.status_code, r.content)
 
-        text = ' '.join([title+'.'] + [p.get_text() for p in paragraphs])
-        return image_links, title, text
-    except:
-        return None, None, None
+def _extract_response(status, content):
+    """Extraction of an article page from the HTTP status and the body of the response"""
+    count('bytes', len(content), service='nyt_article')
+    if status >= 400:
+        return failure(HTTP_ERROR)
+    return extract_article(content)
 
-def get_articles_title_text_images(keyword, date, num_links = 'all'):
-    """Get the images, title and text for ALL articles related to keyword at a specific date
+def _group_scrapped_articles(articles_url, scrapped):
+    """Keep successfully scrapped articles, in the order of articles_url
 
-    :argument keyword: str keyword (entity)
-    :argument date: pandas datetime (anomaly date)
-    :argument num_links: number of links (articles) to consider, default to all
+    :argument articles_url: list of str (urls)
+    :argument scrapped: list of (images, title, text), one per url
 
-    :returns a dictionary (keys are urls, images, titles and texts), values are a list of str, corresponding to the urls, images, title or text of each article and an int (S), the number of articles that could have been scrapped
+    :returns the same output as get_articles_title_text_images
     """
-    articles_url = get_article_urls(keyword, date, num_links=num_links)
     results = {}
     results['urls'], results['titles'], results['texts'], results['images'] = articles_url, [], [], []
     S = 0
-    for url in articles_url:
-        images, title, text = get_article_title_text_images(url)
+    for images, title, text in scrapped:
         if images is not None:
             S+=1
             results['titles'].append(title)
@@ -141,23 +329,83 @@ def get_articles_title_text_images(keyword, date, num_links = 'all'):
             results['images'].append(images)
     return S, results
 
-def get_articles_title_text_images_all_dates(keyword, dates, num_links = 'all'):
+def get_articles_title_text_images(keyword, date, num_links = 'all', max_workers = MAX_WORKERS):
+    """Get the images, title and text for ALL articles related to keyword at a specific date
+
+    :argument keyword: str keyword (entity)
+    :argument date: pandas datetime (anomaly date)
+    :argument num_links: number of links (articles) to consider, default to all
+    :argument max_workers: maximum number of articles downloaded at the same time
+
+    :returns a dictionary (keys are urls, images, titles and texts), values are a list of str, corresponding to the urls, images, title or text of each article and an int (S), the number of articles that could have been scrapped
+    """
+    articles_url = get_article_urls(keyword, date, num_links=num_links)
+    scrapped = fetch_all(get_article_title_text_images, articles_url, max_workers=max_workers)
+    return _group_scrapped_articles(articles_url, scrapped)
+
+def _scrape_all_dates(keyword, dates, num_links, max_workers):
+    """Search the articles of every date, then download all article pages concurrently
+    Each url is downloaded once, even if it was found for several dates.
+
+    :returns a list (one item per date) of lists of urls and a list (one item per date) of lists of (images, title, text)
+    """
+    with span('search', keyword=keyword):
+        urls_by_date = get_article_urls_all_dates(keyword, dates, num_links=num_links, max_workers=max_workers)
+    unique_urls = list(dict.fromkeys(url for articles_url in urls_by_date for url in articles_url))
+    with span('scrape', keyword=keyword):
+        records = dict(zip(unique_urls, fetch_all(get_article_title_text_images, unique_urls, max_workers=max_workers)))
+    scrapped_by_date = [[records[url] for url in articles_url] for articles_url in urls_by_date]
+    return urls_by_date, scrapped_by_date
+
+def get_article_table(keyword, dates, num_links = 'all', max_workers = MAX_WORKERS):
+    """Get ALL scrapped articles for ALL dates (anomalies) related to keyword as one table (see get_articles_title_text_images_all_dates)
+
+    :argument keyword: str keyword (entity or person)
+    :argument dates: DatetimeIndex of pandas datetime (dtype=datetime64[ns])
+    :argument num_links: number of links (articles) to consider, default to all
+    :argument max_workers: maximum number of concurrent HTTP calls
+
+    :returns ArticleTable, one row per scrapped article, rows of each date follow the order of the search results
+    """
+    dates = list(dates)
+    urls_by_date, scrapped_by_date = _scrape_all_dates(keyword, dates, num_links, max_workers)
+    return _build_table(dates, urls_by_date, scrapped_by_date)
+
+def _build_table(dates, urls_by_date, scrapped_by_date):
+    """ArticleTable of the scrapped articles (see ArticleTable.from_scrapped), the share retrieved is reported for each date"""
+    table = ArticleTable.from_scrapped(dates, urls_by_date, scrapped_by_date)
+    for i, (date, N, S) in enumerate(zip(dates, table.found, np.diff(table.offsets))):
+        _report_retrieved(i, date, N, S)
+    return table
+
+def _report_retrieved(i, date, found, retrieved):
+    """Progress event: number of articles found and retrieved for the i-th anomaly date"""
+    share = int(retrieved / found * 100) if found else 0 #no article found at all
+    progress('anomaly n°{0}: {1} articles were found and {2}% were retrieved'.format(i + 1, found, share),
+             date=date, found=int(found), retrieved=int(retrieved))
+
+def get_articles_title_text_images_all_dates(keyword, dates, num_links = 'all', max_workers = MAX_WORKERS):
     """Get ALL articles urls, images, title and text for ALL dates (anomalies) related to keyword (entity or person)
 
+    NYT searches are run concurrently for all dates, then all article pages are downloaded
+    concurrently (at most max_workers at the same time). Results keep the order of the dates and of the search results.
+
     :argument keyword: str keyword (entity or person)
     :argument dates: DatetimeIndex of pandas datetime (dtype=datetime64[ns])
     :argument num_links: number of links (articles) to consider, default to all
+    :argument max_workers: maximum number of concurrent HTTP calls
 
     :returns a dictionary (keys are titles and texts) of dictionary whose keys are dates (anomalies) and values are lists containing urls, titles, images or text of articles
     """
+    dates = list(dates)
+    urls_by_date, scrapped_by_date = _scrape_all_dates(keyword, dates, num_links, max_workers)
+
     results = {'urls': {}, 'titles':{}, 'texts':{}, 'images':{}}
-    for i,date in enumerate(dates):
-        S, tmp = get_articles_title_text_images(keyword, date, num_links)
+    for i,(date, articles_url, scrapped) in enumerate(zip(dates, urls_by_date, scrapped_by_date)):
+        S, tmp = _group_scrapped_articles(articles_url, scrapped)
         results['urls'][date] = tmp['urls']
         results['titles'][date] = tmp['titles']
         results['texts'][date] = tmp['texts']
         results['images'][date] = tmp['images']
-        N=len(tmp['urls'])
-        print('anomaly n°{0}: {1} articles were found and {2}% were retrieved'.format(
-            str(i+1), str(N), str(int(S/N*100))))
+        _report_retrieved(i, date, len(tmp['urls']), S)
     return results
\ No newline at end of file
@@ -0,0 +1,69 @@
+##################################
+# BATCH OF ENTITIES
+
+from .huginn import Huginn
+from .interest import get_interests, resolve_mid
+from .anomalies import detect_anomalies, MAX_ANOMALIES
+from .session import MAX_WORKERS
+
+class HuginnBatch:
+    def __init__(self, keywords, mids=None, mid_policy=None):
+        """Create a Huginn object for each entity of a list
+        Interest is fetched 5 entities per Google Trends call, and every entity shares the same Trends session,
+        HTTP connection pools, spacy model and summarization model.
+        :argument keywords: list of persons or entities you would like information about
+        :argument mids: list of mids (same order as keywords), keywords are searched as they are if None
+        :argument mid_policy: if mids is None, resolve the mids with this policy (see interest.resolve_mid)
+        """
+        self.names = list(keywords)
+        if mids is None and mid_policy is not None:
+            mids = [resolve_mid(name, policy=mid_policy) for name in self.names]
+        self.interest = get_interests(self.names, mids)
+        self.huginns = {name: Huginn(name, mid=False, interest=self.interest[[name]]) for name in self.names}
+
+    def __getitem__(self, name):
+        return self.huginns[name]
+
+    def __iter__(self):
+        return iter(self.huginns.values())
+
+    def __len__(self):
+        return len(self.huginns)
+
+    def get_anomalies(self, method="ewm", top_k=MAX_ANOMALIES, **kwargs):
+        """Get anomalies of every entity at once (see Huginn.get_anomalies for the arguments)
+        :returns a dictionary, keys are entities and values are the anomalies as a DateIndex
+        """
+        scores = detect_anomalies(self.interest, method=method, top_k=top_k, **kwargs)
+        anomalies = {}
+        for name, huginn in self.huginns.items():
+            huginn.anomaly_scores = scores[name]
+            huginn._set_anomalies(scores[name].index)
+            anomalies[name] = scores[name].index
+        return anomalies
+
+    def get_articles_info(self, num_links='all', max_workers=MAX_WORKERS):
+        """Get all information about articles for each anomaly of each entity (see Huginn.get_articles_info)"""
+        for huginn in self:
+            huginn.get_articles_info(num_links=num_links, max_workers=max_workers)
+
+    def get_local_summaries(self, n_components = 2, min_length = 50, max_length = 150, model = None):
+        """Compute the summary for each anomaly date of each entity
+        The topic articles of all entities are summarized together (see summarizer.summarize_groups)
+        :returns a dictionary, keys are entities and values are summaries (see Huginn.get_local_summaries)
+        """
+        from .summarizer import summarize_groups
+
+        pending, groups = {}, []
+        for name, huginn in self.huginns.items():
+            huginn._request_summaries(n_components, min_length, max_length, model)
+            pending[name] = huginn._pending_summaries() #only dates not summarized yet
+            groups.extend(pending[name][2])
+
+        summaries = summarize_groups(groups, min_length, max_length, model=model)
+
+        start = 0
+        for name, (dates, topic_keys, _) in pending.items():
+            self.huginns[name]._set_summaries(dates, topic_keys, summaries[start:start + len(topic_keys)])
+            start += len(topic_keys)
+        return {name: huginn.summary_by_anomalies_by_topics for name, huginn in self.huginns.items()}
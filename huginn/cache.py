@@ -0,0 +1,210 @@
+##################################
+# PERSISTENT CACHE (NYT searches, scrapped articles, ...)
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .instrument import count
+
+CACHE_DIR = os.environ.get('HUGINN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'huginn'))
+MAX_SIZE = 512 * 1024 ** 2 #maximum size (bytes) of the values stored in one cache
+MAX_PENDING = 1000 #access times kept in memory before they are written (see DiskCache._lookup)
+
+_config = {'directory': CACHE_DIR, #where the cache files are stored
+           'ttl': None, #time to live in seconds (None: entries never expire, historical articles never change)
+           'max_size': MAX_SIZE,
+           'offline': False, #if True, a cache miss raises CacheMissError instead of calling the network
+           'enabled': True}
+_caches = {}
+_caches_lock = threading.Lock()
+
+def configure_cache(**kwargs):
+    """Configure the persistent cache used by huginn
+    :argument directory: str, directory of the cache files (default HUGINN_CACHE_DIR or ~/.cache/huginn)
+    :argument ttl: int or None, number of seconds an entry stays valid (None: never expires)
+    :argument max_size: int, maximum number of bytes stored by each cache, least recently used entries are evicted first
+    :argument offline: bool, only use the cache (a miss raises CacheMissError)
+    :argument enabled: bool, set to False to disable the cache
+    """
+    for key in kwargs:
+        if key not in _config:
+            raise TypeError('configure_cache() got an unexpected keyword argument \'{}\''.format(key))
+    with _caches_lock:
+        _config.update(kwargs)
+        _caches.clear()
+
+def get_cache_dir():
+    """Directory of the cache files"""
+    return Path(_config['directory'])
+
+def is_offline():
+    """True if huginn must not call the network on a cache miss"""
+    return _config['offline']
+
+def get_cache(name):
+    """Get the cache called name (one sqlite file per name in the cache directory)
+    :argument name: str, name of the cache (ex: 'nyt_search')
+    :returns DiskCache (or NullCache if the cache is disabled)
+    """
+    with _caches_lock:
+        if name not in _caches:
+            if _config['enabled']:
+                path = Path(_config['directory']) / (name + '.sqlite')
+                _caches[name] = DiskCache(path, ttl=_config['ttl'], max_size=_config['max_size'])
+            else:
+                _caches[name] = NullCache()
+        return _caches[name]
+
+def _hash_key(key):
+    """From any key (str, tuple of str...) to a fixed length str"""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+class NullCache:
+    """Cache that never stores anything (used when the cache is disabled)"""
+    hits = 0
+    misses = 0
+
+    def get(self, key, default=None):
+        return default
+
+    def stats(self):
+        return {'hits': 0, 'misses': 0, 'entries': 0, 'size': 0}
+
+    def set(self, key, value):
+        pass
+
+    def __contains__(self, key):
+        return False
+
+    def clear(self):
+        pass
+
+class DiskCache:
+    """Key-value store persisted in a sqlite file
+    Values are pickled. Entries older than ttl seconds are ignored, and when the values take more than max_size bytes
+    the least recently used entries are evicted. hits and misses count the calls to get of this process.
+    A hit only reads the file: access times are kept in memory and written with the next set (or every MAX_PENDING
+    hits), and the total size of the values is kept in the meta table instead of being summed at every set.
+    """
+    def __init__(self, path, ttl=None, max_size=MAX_SIZE):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local() #sqlite connections can't be shared between threads
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._accessed = {} #hashed key -> access time not written yet
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+            #files written before the meta table: sum the sizes once
+            connection.execute("INSERT OR IGNORE INTO meta SELECT 'size', COALESCE(SUM(size), 0) FROM cache")
+
+    def _connection(self):
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = sqlite3.connect(str(self.path), timeout=30)
+        return self._local.connection
+
+    def get(self, key, default=None):
+        """Get the value stored for key (default if missing or expired)"""
+        value = self._lookup(key)
+        with self._counter_lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count('cache_misses' if value is _MISSING else 'cache_hits', cache=self.path.stem)
+        return default if value is _MISSING else value
+
+    def _lookup(self, key):
+        """Get the value stored for key (_MISSING if missing or expired)"""
+        hashed = _hash_key(key)
+        connection = self._connection()
+        row = connection.execute('SELECT value, created FROM cache WHERE key = ?', (hashed,)).fetchone()
+        if row is None:
+            return _MISSING
+        value, created = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            with connection:
+                self._delete(connection, hashed)
+            return _MISSING
+        with self._counter_lock:
+            self._accessed[hashed] = time.time()
+            flush = len(self._accessed) >= MAX_PENDING
+        if flush:
+            with connection:
+                self._write_accessed(connection)
+        return pickle.loads(value)
+
+    def _write_accessed(self, connection):
+        """Write the access times kept in memory"""
+        with self._counter_lock:
+            accessed, self._accessed = self._accessed, {}
+        connection.executemany('UPDATE cache SET accessed = ? WHERE key = ?',
+                               [(when, hashed) for hashed, when in accessed.items()])
+
+    def _add_size(self, connection, size):
+        connection.execute("UPDATE meta SET value = value + ? WHERE name = 'size'", (size,))
+
+    def _delete(self, connection, hashed):
+        row = connection.execute('SELECT size FROM cache WHERE key = ?', (hashed,)).fetchone()
+        if row is not None and connection.execute('DELETE FROM cache WHERE key = ?', (hashed,)).rowcount:
+            self._add_size(connection, -row[0])
+
+    def set(self, key, value):
+        """Store value for key, then evict least recently used entries if the cache is too big"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        hashed = _hash_key(key)
+        now = time.time()
+        with self._connection() as connection:
+            self._add_size(connection, len(blob)) #first write: the size of a replaced value is read under the lock
+            self._delete(connection, hashed)
+            connection.execute('INSERT INTO cache VALUES (?, ?, ?, ?, ?)', (hashed, sqlite3.Binary(blob), len(blob), now, now))
+            self._write_accessed(connection)
+            self._evict(connection)
+
+    def _evict(self, connection):
+        """Delete least recently used entries until the total size is below max_size"""
+        if self.max_size is None:
+            return
+        total = connection.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+        if total <= self.max_size:
+            return
+        for key, size in connection.execute('SELECT key, size FROM cache ORDER BY accessed').fetchall():
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+        connection.execute("UPDATE meta SET value = ? WHERE name = 'size'", (total,))
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def stats(self):
+        """Hits and misses of get, number of entries and total size (bytes) of the values"""
+        with self._connection() as connection:
+            entries = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            size = connection.execute("SELECT value FROM meta WHERE name = 'size'").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size': size}
+
+    def __len__(self):
+        with self._connection() as connection:
+            return connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache')
+            connection.execute("UPDATE meta SET value = 0 WHERE name = 'size'")
+        with self._counter_lock:
+            self._accessed = {}
+
+_MISSING = object()
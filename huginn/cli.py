@@ -0,0 +1,78 @@
+##################################
+# COMMAND LINE (huginn run entities.txt -o results.jsonl, see runner.py)
+
+import json
+import logging
+import sys
+
+import click
+
+from .runner import read_entities, policy_from_name, run_batch, STAGES, OK, QUOTA_EXHAUSTED
+from .anomalies import MAX_ANOMALIES
+
+class NumLinks(click.ParamType):
+    """Number of articles per anomaly: 'all' or a positive integer"""
+    name = 'num_links'
+
+    def convert(self, value, param, ctx):
+        if value == 'all' or isinstance(value, int):
+            number = value
+        else:
+            try:
+                number = int(value)
+            except ValueError:
+                number = None
+        if number != 'all' and (number is None or number <= 0):
+            self.fail("{!r} is not 'all' or a positive integer".format(value), param, ctx)
+        return number
+
+@click.group()
+@click.option('-v', '--verbose', is_flag=True, help='Log the progress of each entity.')
+def main(verbose):
+    """Detect anomalous events and news related to entities"""
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING, format='%(asctime)s %(message)s')
+
+@main.command()
+@click.argument('entity_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='JSON lines file, one result per entity (standard output by default).')
+@click.option('--checkpoints', type=click.Path(file_okay=False), default='huginn_checkpoints', show_default=True,
+              help='Directory of the results of each stage of each entity, a new run resumes from them.')
+@click.option('--stage', 'last_stage', type=click.Choice(STAGES[1:]), default='summaries', show_default=True,
+              help='Last stage to run.')
+@click.option('--processes', type=int, default=None,
+              help='Number of processes (number of CPUs by default, 0 to run in the current process).')
+@click.option('--nyt-concurrency', type=int, default=1, show_default=True,
+              help='Maximum number of processes calling the NYT API at once (they share its rate limits).')
+@click.option('--mid-policy', default='none', show_default=True,
+              help="Mid of the entities without one in the entity file: 'none' (search the name), 'first' "
+                   "(first Google Trends suggestion) or a type to prefer (ex: Company).")
+@click.option('--method', type=click.Choice(['ewm', 'rolling', 'constant']), default='ewm', show_default=True)
+@click.option('--top-k', type=int, default=MAX_ANOMALIES, show_default=True, help='Maximum number of anomalies.')
+@click.option('--num-links', type=NumLinks(), default='all', show_default=True,
+              help="Number of articles per anomaly ('all' or a positive integer).")
+@click.option('--n-components', type=int, default=2, show_default=True, help='Number of LDA topics.')
+@click.option('--min-length', type=int, default=50, show_default=True)
+@click.option('--max-length', type=int, default=150, show_default=True)
+@click.option('--model', default=None, help='Summarization model (the default one if not given).')
+def run(entity_file, output, checkpoints, last_stage, processes, nyt_concurrency, mid_policy, method, top_k, num_links,
+        n_components, min_length, max_length, model):
+    """Run the pipeline for every entity of ENTITY_FILE (one entity per line, optionally followed by a tab and its mid)
+
+    Stop it at any time (or let the NYT daily quota stop it) and run the same command again to resume.
+    """
+    options = {'stages': STAGES[:STAGES.index(last_stage) + 1], 'method': method, 'top_k': top_k,
+               'num_links': num_links, 'n_components': n_components,
+               'min_length': min_length, 'max_length': max_length, 'model': model}
+    statuses = []
+    for record in run_batch(read_entities(entity_file), checkpoints, options, processes=processes,
+                            nyt_concurrency=nyt_concurrency, policy=policy_from_name(mid_policy)):
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+        statuses.append(record['status'])
+    if QUOTA_EXHAUSTED in statuses:
+        click.echo('NYT daily quota exhausted, run the same command again later to resume', err=True)
+    failed = sum(status != OK for status in statuses)
+    if failed:
+        click.echo('{} entities out of {} were not processed'.format(failed, len(statuses)), err=True)
+        sys.exit(1)
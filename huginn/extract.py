@@ -0,0 +1,84 @@
+##################################
+# EXTRACTION OF THE TITLE, TEXT AND IMAGES OF A NYT ARTICLE PAGE
+
+import io
+from collections import namedtuple
+
+from lxml import etree
+
+#reasons why an article could not be extracted
+REQUEST_ERROR = 'request_error' #the page could not be downloaded
+HTTP_ERROR = 'http_error' #the server answered with an error status
+OFFLINE = 'offline' #the page is not cached and the network must not be used
+PARSE_ERROR = 'parse_error' #the page is not valid html
+NO_ARTICLE = 'no_article' #no <article> in the page
+NO_TITLE = 'no_title' #no <header><h1> in the article
+NO_PARAGRAPHS = 'no_paragraphs' #neither a <section> nor a <div class="entry-content"> in the article
+
+Extraction = namedtuple('Extraction', ['images', 'title', 'text', 'error'])
+Extraction.__doc__ = """Result of the extraction of an article: images (list of str), title and text (str), and error
+(None if the article was extracted, otherwise one of the reasons above, images, title and text are then None)"""
+
+def failure(error):
+    """Extraction of an article that could not be extracted"""
+    return Extraction(None, None, None, error)
+
+def _find_article(content):
+    """Parse the page until the end of its first <article> (the rest of the page is never parsed)
+    :argument content: bytes (html page)
+    :returns the <article> element, or None if there is none
+    """
+    for _, element in etree.iterparse(io.BytesIO(content), events=('end',), tag='article', html=True,
+                                      recover=True, no_network=True, remove_comments=True):
+        return element
+    return None
+
+def _text(element):
+    """Text of an element and its children (as BeautifulSoup get_text)"""
+    return ''.join(element.itertext())
+
+def _in_header(element, article):
+    """True if element is inside a <header> of article (headers around the article don't count)"""
+    for ancestor in element.iterancestors():
+        if ancestor is article:
+            return False
+        if ancestor.tag == 'header':
+            return True
+    return False
+
+def extract_article(content):
+    """Extract the title, text and images of a NYT article page
+    Only the <article> element is looked at: its title is the <h1> of its <header>, its paragraphs the <p> of its
+    first <section> (NYT article) or of its <div class="entry-content"> (NYT blog article), and its images
+    the <img> inside it. Everything is collected in one walk through the article.
+
+    :argument content: bytes (html page)
+    :returns Extraction, the text is the title followed by the paragraphs
+    """
+    try:
+        article = _find_article(content)
+    except (etree.LxmlError, ValueError):
+        return failure(PARSE_ERROR)
+    if article is None:
+        return failure(NO_ARTICLE)
+
+    images, title, section, entry_content = [], None, None, None
+    for element in article.iter('img', 'h1', 'section', 'div'):
+        if element.tag == 'img':
+            images.append(element.get('src'))
+        elif element.tag == 'h1':
+            if title is None and _in_header(element, article):
+                title = _text(element)
+        elif element.tag == 'section':
+            section = element if section is None else section
+        elif entry_content is None and 'entry-content' in (element.get('class') or '').split():
+            entry_content = element
+
+    if title is None:
+        return failure(NO_TITLE)
+    container = section if section is not None else entry_content
+    if container is None:
+        return failure(NO_PARAGRAPHS)
+
+    text = ' '.join([title+'.'] + [_text(p) for p in container.iter('p')])
+    return Extraction(images, title, text, None)
@@ -1,41 +1,120 @@
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
-from .interest import get_interest, get_mid
-from .anomalies import constant_sd, rolling_std, ewm_std
-from .visualize import plot_data_plotly, plot_data, plot_data_with_anomalies, plot_data_with_anomalies_plotly
-from .articles import get_articles_title_text_images_all_dates
-from .LDA import run_lda
-from .summarizer import lda_filter_articles_anomalies, get_summaries_by_topic, run_summary
+from .interest import get_interest, resolve_mid, ask_mid
+from .anomalies import detect_anomalies, sweep, MAX_ANOMALIES
+from .articles import get_article_table
+from .article_table import ArticleTable
+from .session import MAX_WORKERS
+#visualize (matplotlib, plotly), LDA (spacy, gensim, scikit-learn) and summarizer (torch, transformers) are heavy:
+#they are imported on first use so that `import huginn` stays fast for interest and anomalies only
 
 class Huginn:
-    def __init__(self, keyword, mid=True):
+    def __init__(self, keyword, mid=True, interest=None, mid_policy=ask_mid):
         """Create a Huginn object
         :argument keyword: person or entity you would like information about
+        :argument mid: True to choose the mid of the entity, False to search the keyword, or the mid itself (str)
+        :argument interest: dataframe (dates as index, one column named keyword) if the interest is already known
+        :argument mid_policy: how to choose the mid among Google Trends suggestions when it is not known yet
+            (ask_mid asks the user, first_suggestion or prefer_type('Company') run unattended, see interest.resolve_mid)
         """
         self.name = keyword
-        if mid: self.__mid = get_mid(self.name) #private attribute
+        if isinstance(mid, str): self.__mid = mid #private attribute
+        elif mid and interest is None: self.__mid = resolve_mid(self.name, policy=mid_policy)
         else: self.__mid = None
-        self.interest = get_interest(self.name, self.__mid)
+        self.interest = interest if interest is not None else get_interest(self.name, self.__mid)
+        #pipeline: anomalies -> articles -> topics -> summaries
+        #parameters of the last request of each stage after anomalies, and results of each stage by
+        #(date, parameters of the stage and of the previous ones): a date is only processed again if these change
+        self.__stages = {}
+        self.__results = {'articles': {}, 'topics': {}, 'summaries': {}}
+        self.__options = {} #execution options (number of workers...) and the current article table
+
+    @classmethod
+    async def acreate(cls, keyword, mid=True, interest=None, mid_policy=ask_mid):
+        """Coroutine creating a Huginn object (see Huginn), the Google Trends calls don't block the event loop"""
+        from .aio import run_blocking
+        return await run_blocking(cls, keyword, mid=mid, interest=interest, mid_policy=mid_policy)
+
+    def save(self, path):
+        """Save the investigation (interest, anomalies, articles, topics and summaries) in a single file
+        The file is a zip of numpy arrays and compressed article texts (see huginn.archive), without any pickle:
+        it can be shared and opened with Huginn.load.
+        :argument path: str, path of the file (ex: 'point72.huginn')
+        """
+        from .archive import save_investigation
+        current = []
+        if 'articles' in self.__stages and not self.__missing('articles'):
+            current = [self.__key('articles', date) for date in self.anomalies]
+        save_investigation(path, {
+            'name': self.name, 'mid': self.__mid, 'interest': self.interest,
+            'anomalies': getattr(self, 'anomalies', None), 'anomaly_scores': getattr(self, 'anomaly_scores', None),
+            'stages': self.__stages, 'results': self.__results, 'current_articles': current,
+            'options': {key: value for key, value in self.__options.items() if key in ('max_workers', 'n_process', 'n_jobs')},
+            'global_summary': getattr(self, 'global_summary', None),
+            'summary_of_summaries': getattr(self, 'summary_of_summaries', None)})
 
-    def get_anomalies(self, method="ewm", **kwargs):
+    @classmethod
+    def load(cls, path):
+        """Open an investigation saved by Huginn.save, without any network call
+        Texts of the articles are only read from the file when they are accessed.
+        :argument path: str, path of the file
+        :returns Huginn
+        """
+        from .archive import load_investigation
+        state = load_investigation(path)
+        huginn = cls(state['name'], mid=state['mid'] or False, interest=state['interest'])
+        if state['anomalies'] is not None:
+            huginn._set_anomalies(state['anomalies'])
+        if state['anomaly_scores'] is not None:
+            huginn.anomaly_scores = state['anomaly_scores']
+        for name in ['global_summary', 'summary_of_summaries']:
+            if state[name] is not None:
+                setattr(huginn, name, state[name])
+        huginn.__stages.update(state['stages'])
+        huginn.__results = state['results']
+        huginn.__options.update(state['options'], memmap=None)
+        if state['table'] is not None: #article table of the current anomalies, texts not read yet
+            huginn.__options.update(table=state['table'], table_key=huginn.__table_key())
+        return huginn
+
+    def get_anomalies(self, method="ewm", top_k=MAX_ANOMALIES, **kwargs):
         """Get anomalies under method assumption (by default ewm)
 
         :argument method: ewm, rolling or constant
+        :argument top_k: maximum number of anomalies (the biggest ones), 10 by default
         :argument **kwargs: if ewm halflife_mean, halflife_std, k (set to 1, 10 and 1 by default)
                             if rolling lookback_mean, lookback_std, k (set to 1, 10 and 1 by default)
                             if constant k (set to 1 by default)
 
-        :returns the anomalies as a DateIndex
+        :returns the anomalies as a DateIndex (their scores are in the attribute anomaly_scores)
         """
-        if method == "ewm":
-            self.anomalies = ewm_std(self.interest, **kwargs)
-        if method == "rolling":
-            self.anomalies = rolling_std(self.interest, **kwargs)
-        if method == "constant":
-            self.anomalies = constant_sd(self.interest, **kwargs)
-        self.anomalies_formatted = np.array(self.anomalies, dtype='datetime64[D]')
+        self.anomaly_scores = detect_anomalies(self.interest, method=method, top_k=top_k, **kwargs)[self.name]
+        self._set_anomalies(self.anomaly_scores.index)
         return self.anomalies
 
+    def sweep_anomalies(self, method="ewm", k=1, top_k=MAX_ANOMALIES, **grid):
+        """Get anomalies for a whole grid of parameters at once, to choose the parameters of get_anomalies
+
+        :argument method: ewm, rolling or constant
+        :argument k: float or list of floats
+        :argument **grid: list of values for each parameter of the method (ex: halflife_std=[5, 10, 20])
+
+        :returns AnomalySweep (see anomalies.sweep): .matrix() is the parameters x dates anomaly matrix,
+            .stability() how often each date is flagged across the grid
+        """
+        return sweep(self.interest, method=method, k=k, top_k=top_k, **grid)
+
+    def _set_anomalies(self, anomalies):
+        """Set the anomalies (DatetimeIndex), also used by HuginnBatch
+        Articles, topics and summaries of the other dates are kept: only new dates are processed when they are accessed
+        """
+        self.anomalies = anomalies
+        self.anomalies_formatted = np.array(self.anomalies, dtype='datetime64[D]')
+
     #private method
     def __check_got_anomalies(self):
         """Method to check if get_anomalies has been called, used primarily as a check in later functions"""
@@ -45,17 +124,30 @@ class Huginn:
     #private method
     def __check_got_articles(self):
         """Method to check if get_articles_info has been called, used primarily as a check in later functions"""
-        if not hasattr(self, 'articles'):
+        self.__check_got_anomalies()
+        if 'articles' not in self.__stages:
             raise AttributeError('Huginn has not gotten articles yet. Use \'get_articles_info\'.')
 
     #private method
     def __check_got_summaries(self):
-        """Method to check if get_articles_info_and_summary_after_LDA has been called, used primarily as a check in later functions"""
-        if not hasattr(self, 'summary_by_anomalies_by_topics'):
-            raise AttributeError('Huginn has not gotten summaries yet. Use \'get_articles_info_and_summary_after_LDA\'.')
+        """Method to check if get_local_summaries has been called, used primarily as a check in later functions"""
+        self.__check_got_articles()
+        if 'summaries' not in self.__stages:
+            raise AttributeError('Huginn has not gotten summaries yet. Use \'get_local_summaries\'.')
+
+    def __key(self, stage, date):
+        """Key of the result of a stage for one date"""
+        stages = ['articles', 'topics', 'summaries']
+        return (date,) + tuple(self.__stages[previous] for previous in stages[:stages.index(stage) + 1])
+
+    def __missing(self, stage):
+        """Anomaly dates whose result of the stage is not computed yet"""
+        results = self.__results[stage]
+        return [date for date in self.anomalies if self.__key(stage, date) not in results]
 
     def plot_interest(self, plotly=False):
         """Plot only the interest the month of the entity or person under study"""
+        from .visualize import plot_data, plot_data_plotly
         if not plotly:
             plot_data(self.interest)
         else:
@@ -66,70 +158,257 @@ class Huginn:
         Plot interest by month and the anomalies (as vertical lines)
         """
         self.__check_got_anomalies()
+        from .visualize import plot_data_with_anomalies, plot_data_with_anomalies_plotly
         if not plotly:
             plot_data_with_anomalies(self.interest, self.anomalies)
         else:
             return plot_data_with_anomalies_plotly(self.interest, self.anomalies)
 
-    def get_articles_info(self, num_links='all'):
+    def get_articles_info(self, num_links='all', max_workers=MAX_WORKERS, memmap=None):
         """Get all information about articles (images, urls, content, titles) for each anomaly
-        :argument num_links: number of links to keep for each anomaly ('all' by default). The maximum number of articles is 10 due to API quota limit.
-        :returns dictionary, keys are anomaly dates and values are list of images, urls, contents or titles
+        Articles of the dates already fetched with the same num_links are reused. Later, when anomalies change,
+        the articles of the new dates are fetched when they are accessed.
+        :argument num_links: number of links to keep for each anomaly ('all' by default, which is the first page of 10 results).
+            More than 10 links are fetched page by page, within the NYT API rate limits.
+        :argument max_workers: maximum number of concurrent HTTP calls
+        :argument memmap: directory where the articles are written, their texts are then memory-mapped instead of kept in memory
+        :returns ArticleTable (attribute article_table), urls, titles, articles and images are derived from it
         """
         self.__check_got_anomalies() #check if we have anomalies
-        tmp = get_articles_title_text_images_all_dates(self.name, self.anomalies, num_links)
-        self.urls = tmp['urls']
-        self.titles = tmp['titles']
-        self.articles = tmp['texts']
-        self.images = tmp['images']
+        self.__stages['articles'] = num_links
+        self.__options.update(max_workers=max_workers, memmap=memmap)
+        return self.article_table
+
+    async def aget_articles_info(self, num_links='all', max_workers=MAX_WORKERS, memmap=None):
+        """Coroutine version of get_articles_info: articles are downloaded without blocking the event loop (see huginn.aio)"""
+        self.__check_got_anomalies()
+        self.__stages['articles'] = num_links
+        self.__options.update(max_workers=max_workers, memmap=memmap)
+        await self.__afetch_articles()
+        from .aio import run_cpu
+        return await run_cpu(lambda: self.article_table)
+
+    def _set_article_table(self, table, num_links='all', max_workers=MAX_WORKERS):
+        """Use articles already fetched (ex: saved by the batch runner) for the dates of table, as get_articles_info would
+        :argument table: ArticleTable (see get_articles_info)
+        :argument num_links: num_links used to fetch table
+        """
+        self.__check_got_anomalies()
+        self.__stages['articles'] = num_links
+        self.__options.update(max_workers=max_workers, memmap=None)
+        self.__store_articles(list(table.dates), table)
+
+    async def __afetch_articles(self):
+        """Download the articles of the anomaly dates not fetched yet without blocking the event loop"""
+        missing = self.__missing('articles')
+        if missing:
+            from .aio import aget_article_table
+            table = await aget_article_table(self.name, missing, self.__stages['articles'],
+                                             max_workers=self.__options['max_workers'])
+            self.__store_articles(missing, table)
+
+    def __store_articles(self, dates, table):
+        """Keep the articles of each date of table (rows of the i-th date are those of dates[i])"""
+        for i, date in enumerate(dates):
+            self.__results['articles'][self.__key('articles', date)] = table.select([i])
+
+    @property
+    def article_table(self):
+        """ArticleTable of the anomaly dates (see get_articles_info), articles of new anomaly dates are fetched on access"""
+        self.__check_got_articles()
+        results = self.__results['articles']
+        missing = self.__missing('articles')
+        if missing:
+            table = get_article_table(self.name, missing, self.__stages['articles'],
+                                      max_workers=self.__options['max_workers'])
+            self.__store_articles(missing, table)
+
+        key = self.__table_key()
+        if self.__options.get('table_key') != key:
+            table = ArticleTable.concat([results[self.__key('articles', date)] for date in self.anomalies],
+                                        dates=self.anomalies)
+            directory = None
+            if self.__options['memmap'] is not None:
+                #a new directory each time: the files of the previous table may still be memory-mapped
+                os.makedirs(self.__options['memmap'], exist_ok=True)
+                directory = tempfile.mkdtemp(prefix='articles-', dir=self.__options['memmap'])
+                table.save(directory)
+                table = ArticleTable.load(directory, mmap=True)
+            previous = self.__options.get('table_directory')
+            self.__options.update(table=table, table_key=key, table_directory=directory)
+            if previous is not None: #mapped pages stay valid after the files are removed (POSIX)
+                shutil.rmtree(previous, ignore_errors=True)
+        return self.__options['table']
+
+    def __table_key(self):
+        """Key of the current article table: the anomalies, num_links and where the texts are stored"""
+        return (tuple(self.anomalies), self.__stages['articles'], self.__options.get('memmap'))
+
+    @property
+    def urls(self):
+        """Urls of the scrapped articles, dictionary whose keys are anomaly dates"""
+        return self.article_table.by_date('url')
+
+    @property
+    def titles(self):
+        """Titles of the scrapped articles, dictionary whose keys are anomaly dates"""
+        return self.article_table.by_date('title')
+
+    @property
+    def articles(self):
+        """Texts of the scrapped articles, dictionary whose keys are anomaly dates"""
+        return self.article_table.by_date('text')
+
+    @property
+    def images(self):
+        """Image links of the scrapped articles, dictionary whose keys are anomaly dates"""
+        return self.article_table.by_date('images')
 
     #private method
-    def __get_topics_with_lda(self, n_components):
-        """Must have run get_anomalies() and get_title_text() to have requisite articles in session
+    def __get_topics_with_lda(self, n_components, n_process=1, n_jobs=1, shared=False):
+        """Must have run get_anomalies() and get_articles_info() to have requisite articles in session
            prior to running LDA on the object
-        Get distribution of articles through topics for each anomaly date
+        Get distribution of articles through topics for each anomaly date (only for dates not processed yet)
         :argument n_components: number of topics for LDA, set to 2 by default (out of scope and in focus area).
-        :returns a dictionary, keys are dates, values are dictionary (keys are topics and values are list of articles)
+        :argument n_process: number of processes used by spacy to lemmatize the articles
+        :argument n_jobs: number of processes training the LDA of each anomaly date in parallel
+        :argument shared: True to use one vocabulary and one LDA model for all anomaly dates (persisted, see LDA.CorpusLDA),
+            topics of the dates already processed are kept
+        :returns a dictionary, keys are dates, values are dictionary (keys are topics and values are arrays of ids of articles)
         """
-        self.__check_got_anomalies()
         self.__check_got_articles()
-        self.__lda_output = run_lda(self.articles, n_components=n_components) #private attributes
+        self.__stages['topics'] = (n_components, shared)
+        table = self.article_table
+        results = self.__results['topics']
+        missing = self.__missing('topics')
+        if missing:
+            from .LDA import run_lda_table
+            selected = table.select([list(self.anomalies).index(date) for date in missing])
+            topics = run_lda_table(selected, n_components=n_components, n_process=n_process, n_jobs=n_jobs,
+                                   shared=shared, entity=self.name)
+            for i, date in enumerate(missing): #ids of the articles within their date
+                results[self.__key('topics', date)] = {topic: ids - selected.offsets[i] for topic, ids in topics[date].items()}
+        return {date: {topic: ids + table.offsets[i] for topic, ids in results[self.__key('topics', date)].items()}
+                for i, date in enumerate(self.anomalies)}
 
-    def get_local_summaries(self, n_components = 2, min_length = 50, max_length = 150):
+    def get_local_summaries(self, n_components = 2, min_length = 50, max_length = 150, model = None, n_process = 1, n_jobs = 1,
+                            shared = False):
         """Compute the summary for each anoamly date
+        All topic texts are sent to the summarization model in batches (the model is loaded once per process)
+        Only anomaly dates not summarized yet with the same parameters are processed. Later, when anomalies change,
+        the new dates are summarized when summary_by_anomalies_by_topics is accessed.
         :argument max_length: int, max length of the summary
         :argument n_components: number of topics for LDA
+        :argument model: name of the summarization model (None for the default one)
+        :argument n_process: number of processes used by spacy to lemmatize the articles
+        :argument n_jobs: number of processes training the LDA of each anomaly date in parallel
+        :argument shared: True to use one vocabulary and one LDA model for all anomaly dates (topics are comparable between dates)
         :returns a summary (str) for each anomaly date, for each topic (dic of dic)
         """
-        self.__check_got_anomalies()
+        self._request_summaries(n_components, min_length, max_length, model, n_process=n_process, n_jobs=n_jobs,
+                                shared=shared)
+        return self.summary_by_anomalies_by_topics
+
+    async def aget_local_summaries(self, n_components = 2, min_length = 50, max_length = 150, model = None, n_process = 1,
+                                   n_jobs = 1, shared = False):
+        """Coroutine version of get_local_summaries: missing articles are downloaded without blocking the event loop,
+        LDA and summarization run in the executor of huginn.aio (see configure_executor)
+        """
+        self._request_summaries(n_components, min_length, max_length, model, n_process=n_process, n_jobs=n_jobs,
+                                shared=shared)
+        await self.__afetch_articles()
+        from .aio import run_cpu
+        return await run_cpu(lambda: self.summary_by_anomalies_by_topics)
+
+    def _request_summaries(self, n_components, min_length, max_length, model, n_process=1, n_jobs=1, shared=False):
+        """Set the parameters of the local summaries (see get_local_summaries), also used by HuginnBatch"""
         self.__check_got_articles()
-        self.__get_topics_with_lda(n_components = n_components)
+        self.__stages['topics'] = (n_components, shared)
+        self.__stages['summaries'] = (min_length, max_length, model)
+        self.__options.update(n_process=n_process, n_jobs=n_jobs)
 
-        lda_filter_articles = lda_filter_articles_anomalies(self.__lda_output, self.articles)
-        self.summary_by_anomalies_by_topics = get_summaries_by_topic(lda_filter_articles, min_length, max_length)
+    @property
+    def summary_by_anomalies_by_topics(self):
+        """Summary of each topic of each anomaly date (see get_local_summaries), new anomaly dates are summarized on access"""
+        self.__check_got_summaries()
+        dates, keys, groups = self._pending_summaries()
+        if dates:
+            from .summarizer import summarize_groups
+            min_length, max_length, model = self.__stages['summaries']
+            self._set_summaries(dates, keys, summarize_groups(groups, min_length, max_length, model=model))
+        results = self.__results['summaries']
+        return {date.strftime('%m-%Y'): results[self.__key('summaries', date)] for date in self.anomalies}
 
-        return self.summary_by_anomalies_by_topics
+    def _pending_summaries(self):
+        """Articles of each topic of the anomaly dates not summarized yet with the current parameters, also used by HuginnBatch
+        :returns the list of these dates, a list of (date, topic) and a list of lists of articles (str), one per (date, topic)
+        """
+        missing = self.__missing('summaries')
+        keys, groups = [], []
+        if missing:
+            n_components, shared = self.__stages['topics']
+            articles_by_topic = self._get_articles_by_topic(n_components, n_process=self.__options['n_process'],
+                                                            n_jobs=self.__options['n_jobs'], shared=shared)
+            for date in missing:
+                for topic, articles in articles_by_topic[date].items():
+                    keys.append((date, topic))
+                    groups.append(articles)
+        return missing, keys, groups
+
+    def _set_summaries(self, dates, keys, summaries):
+        """Store summaries for the current parameters, also used by HuginnBatch
+        :argument dates: list of dates (see _pending_summaries)
+        :argument keys: list of (date, topic)
+        :argument summaries: list of str (one per key)
+        """
+        results = self.__results['summaries']
+        for date in dates:
+            results[self.__key('summaries', date)] = {}
+        for (date, topic), summary in zip(keys, summaries):
+            results[self.__key('summaries', date)][topic] = summary
 
-    def get_global_summary(self, min_length = 50, max_length = 150):
+    def _get_articles_by_topic(self, n_components, n_process=1, n_jobs=1, shared=False):
+        """Run LDA and concatenate the articles of each topic
+        :returns a dictionary of dictionary, keys are dates and values are dictionary whose keys are topics and values are lists of articles (str)
+        """
+        self.__check_got_articles()
+        lda_output = self.__get_topics_with_lda(n_components = n_components, n_process = n_process, n_jobs = n_jobs, shared = shared)
+        from .summarizer import lda_filter_table
+        return lda_filter_table(lda_output, self.article_table, join=False)
+
+    def get_global_summary(self, min_length = 50, max_length = 150, model = None):
         """Get a global summary (summarize all articles as one)
         No LDA, no matter what the anomaly date is.
+        Articles are summarized by chunks which are then summarized together (see summarizer.summarize_groups),
+        chunk summaries are shared with get_local_summaries.
+        :argument model: name of the summarization model (None for the default one)
         """
-        self.__check_got_anomalies()
         self.__check_got_articles()
+        from .summarizer import summarize_documents
 
-        sentence = ' '.join([text for texts in list(self.articles.values()) for text in texts]) #concatenate all articles
+        table = self.article_table
+        articles = table.text.take(range(len(table))) #all articles
 
-        self.global_summary = run_summary(sentence, min_length, max_length)
+        self.global_summary = summarize_documents(articles, min_length, max_length, model=model)
         return self.global_summary
 
-    def get_summary_of_summaries(self, min_length = 50, max_length = 150):
+    async def aget_global_summary(self, min_length = 50, max_length = 150, model = None):
+        """Coroutine version of get_global_summary (see aget_local_summaries)"""
+        self.__check_got_articles()
+        await self.__afetch_articles()
+        from .aio import run_cpu
+        return await run_cpu(self.get_global_summary, min_length, max_length, model=model)
+
+    def get_summary_of_summaries(self, min_length = 50, max_length = 150, model = None):
         """Get summary of summaries to compare with get_global_summary
         :argument max_length: max length of the summary
+        :argument model: name of the summarization model (None for the default one)
         :returns str (summary)
         """
         self.__check_got_summaries() #check if summaries are available
+        from .summarizer import summarize_documents
 
         tmp = [list(dic.values()) for dic in list(self.summary_by_anomalies_by_topics.values())]
-        sentence = ' '.join([text for texts in tmp for text in texts]) #concatenate all summaries
-        self.summary_of_summaries = run_summary(sentence, min_length, max_length)
+        summaries = [text for texts in tmp for text in texts] #all summaries
+        self.summary_of_summaries = summarize_documents(summaries, min_length, max_length, model=model)
         return self.summary_of_summaries
@@ -0,0 +1,142 @@
+##################################
+# INSTRUMENTATION (timing spans, counters and progress events, sent to pluggable sinks)
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger('huginn')
+
+#kinds of events
+SPAN = 'span' #value is the duration of a stage in seconds
+COUNTER = 'counter' #value is an increment (requests, retries, bytes, cache hits, model loads...)
+PROGRESS = 'progress' #value is a message for the user
+
+Event = namedtuple('Event', ['kind', 'name', 'value', 'labels'])
+Event.__doc__ = """Instrumentation event: kind (span, counter or progress), name (ex: 'search'), value and labels (dict)"""
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+def add_sink(sink):
+    """Send every event to sink
+    :argument sink: callable taking an Event (ex: a function, LoggingSink(), get_metrics().record)
+    :returns sink (to remove it later with remove_sink)
+    """
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+def remove_sink(sink):
+    """Stop sending events to sink"""
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+def emit(kind, name, value, **labels):
+    """Send an event to every sink (progress events are also logged at INFO level by the 'huginn' logger)"""
+    event = Event(kind, name, value, labels)
+    if kind == PROGRESS:
+        logger.info(value)
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        sink(event)
+
+def count(name, value=1, **labels):
+    """Increment a counter (ex: count('requests', service='nyt'))"""
+    emit(COUNTER, name, value, **labels)
+
+def progress(message, **labels):
+    """Report progress to the user"""
+    emit(PROGRESS, 'progress', message, **labels)
+
+@contextmanager
+def span(name, **labels):
+    """Time a stage of the pipeline:
+
+        with span('search', keyword=keyword):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit(SPAN, name, time.perf_counter() - start, **labels)
+
+class LoggingSink:
+    """Sink writing every event to a logger"""
+    def __init__(self, logger=logger, level=logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event):
+        if event.kind == PROGRESS: #already logged by emit
+            return
+        labels = ' '.join('{}={}'.format(key, value) for key, value in sorted(event.labels.items()))
+        self.logger.log(self.level, '%s %s %s %s', event.kind, event.name, event.value, labels)
+
+class Metrics:
+    """Sink aggregating events: total of each counter and number/total duration of each span, by name and labels"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {} #(name, labels) -> total
+        self.spans = {} #(name, labels) -> [number of spans, total seconds]
+
+    def __call__(self, event):
+        self.record(event)
+
+    def record(self, event):
+        key = (event.name, tuple(sorted(event.labels.items())))
+        with self._lock:
+            if event.kind == COUNTER:
+                self.counters[key] = self.counters.get(key, 0) + event.value
+            elif event.kind == SPAN:
+                total = self.spans.setdefault(key, [0, 0.])
+                total[0] += 1
+                total[1] += event.value
+
+    def counter(self, name, **labels):
+        """Total of a counter (summed over every labels if none is given)"""
+        with self._lock:
+            return sum(value for (key, key_labels), value in self.counters.items()
+                       if key == name and set(labels.items()) <= set(key_labels))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.spans.clear()
+
+    def prometheus_text(self, prefix='huginn'):
+        """Dump the metrics in the Prometheus text exposition format"""
+        def labels_text(labels):
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+                for (key, labels), value in sorted(self.counters.items()):
+                    if key == name:
+                        lines.append('{}_{}_total{} {}'.format(prefix, name, labels_text(labels), value))
+            for name in sorted({name for name, _ in self.spans}):
+                lines.append('# TYPE {}_{}_seconds summary'.format(prefix, name))
+                for (key, labels), (number, total) in sorted(self.spans.items()):
+                    if key == name:
+                        lines.append('{}_{}_seconds_count{} {}'.format(prefix, name, labels_text(labels), number))
+                        lines.append('{}_{}_seconds_sum{} {:.6f}'.format(prefix, name, labels_text(labels), total))
+        return '\n'.join(lines) + '\n'
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """Get the Metrics of the process, created and added as a sink on first call"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = add_sink(Metrics())
+        return _metrics
@@ -3,48 +3,234 @@
 
 from pytrends.request import TrendReq
 import pandas as pd
-import os
+import threading
+import time
+
+from .cache import get_cache, is_offline
+from .exceptions import CacheMissError
+from .interest_store import get_interest_store
+from .instrument import span, count
+
+MAX_TERMS = 5 #pytrends build_payload accepts up to 5 terms
+OVERLAP = 3 #number of cached months fetched again to match the scale of new points
+REFRESH_AFTER = 24 * 3600 #number of seconds before a cached series is refreshed
+
+_pytrends = None
+_pytrends_lock = threading.Lock()
 
 def get_pytrend():
-    """Get pytrends to scrap Google Trends data"""
-    pytrends = TrendReq(hl='en-US', #language
-                        tz=360) #timezone (US CST is 360)
-    return pytrends
+    """Get pytrends to scrap Google Trends data
+    The same TrendReq (and its Google session) is shared by the whole process
+    """
+    global _pytrends
+    with _pytrends_lock:
+        if _pytrends is None:
+            _pytrends = TrendReq(hl='en-US', #language
+                                 tz=360) #timezone (US CST is 360)
+        return _pytrends
 
-def get_mid(keyword):
-    """Ask for the mid your are interested in. Pytrends has a very useful method '.suggestions' which enables to
+def get_suggestions(keyword):
+    """Get the Google Trends suggestions for a keyword (kept in the persistent cache)
+
+    :argument keyword: entity name
+    :return: list of dictionaries (keys are mid, title and type)
+    """
+    cache = get_cache('suggestions')
+    suggestions = cache.get(keyword)
+    if suggestions is None:
+        if is_offline():
+            raise CacheMissError('No cached suggestions for {}'.format(keyword))
+        suggestions = get_pytrend().suggestions(keyword)
+        cache.set(keyword, suggestions)
+    return suggestions
+
+def ask_mid(keyword, suggestions):
+    """Ranking policy asking the user to enter the mid (interactive)"""
+    mid = input('{}\nEnter the mid you are interested in: '.format(suggestions))
+    return mid
+
+def first_suggestion(keyword, suggestions):
+    """Ranking policy choosing the first suggestion of Google Trends"""
+    return suggestions[0]['mid'] if suggestions else None
+
+def prefer_type(*types):
+    """Ranking policy choosing the first suggestion whose type contains one of types (ex: prefer_type('Company')),
+    or the first suggestion if none matches
+    """
+    def policy(keyword, suggestions):
+        for suggestion in suggestions:
+            if any(t.lower() in suggestion.get('type', '').lower() for t in types):
+                return suggestion['mid']
+        return first_suggestion(keyword, suggestions)
+    return policy
+
+def set_mid(keyword, mid):
+    """Save the mid of a keyword in the persistent keyword -> mid map"""
+    get_cache('mids').set(keyword, mid)
+
+def resolve_mid(keyword, policy=ask_mid):
+    """Get the mid of an entity. Pytrends has a very useful method '.suggestions' which enables to
     specify your research (Ex: Apple could be a company or a fruit)
+
+    The chosen mid is saved in a persistent keyword -> mid map, so a keyword is only resolved once (without any network call afterwards).
+
+    :argument keyword: entity name
+    :argument policy: callable (keyword, suggestions) -> mid, choosing among the suggestions (ask_mid, first_suggestion,
+        prefer_type('Company')...)
+    :return: mid (str), None if no mid was chosen
+    """
+    mid = get_cache('mids').get(keyword)
+    if mid is not None:
+        return mid
+    mid = policy(keyword, get_suggestions(keyword))
+    if mid:
+        set_mid(keyword, mid)
+        return mid
+    return None
+
+def get_mid(keyword):
+    """Ask for the mid your are interested in (see resolve_mid)"""
+    return resolve_mid(keyword, policy=ask_mid)
+
+def _fetch_interest(terms, timeframe='all', gprop='news', geo=''):
+    """One Google Trends call for up to 5 terms
+
+    :argument terms: list of mids or keywords
+    :argument timeframe: 'all' or 'YYYY-MM-DD YYYY-MM-DD'
+    :argument gprop: what property to filter to (images, news, youtube or froogle (for Google Shopping results))
+    :argument geo: two letter country abreviation (default to world)
+
+    :return: dataframe with months as index and one column per term, and a bool (True if the last month is partial)
     """
     pytrends = get_pytrend()
-    print(pytrends.suggestions(keyword))
-    mid = input('Enter the mid you are interested in: ')
-    return mid
+    count('requests', service='google_trends')
+    pytrends.build_payload(terms, #up to 5 terms in the list
+                           cat=0, #default to no category
+                           timeframe=timeframe, #Date to start from
+                           geo=geo,
+                           gprop=gprop)
+    data = pytrends.interest_over_time() #one column per term and isPartial + index = date
+    if data.empty: #no interest at all for these terms
+        return pd.DataFrame(columns=terms, dtype=float), False
+    partial = data['isPartial'].iloc[-1] in (True, 'True')
+    data = data.drop(columns = 'isPartial')[terms].astype(float)
+    data = data.resample('MS').mean() #timeframes shorter than 5 years come by week or day
+    return data, partial
+
+def _rescale(series):
+    """Scale a series to peak at 100 (as Google Trends does)"""
+    peak = series.max()
+    return series / peak * 100 if peak > 0 else series
+
+def _append_months(cached, cached_partial, new):
+    """Append the months of new after the last complete month of cached
+
+    Google Trends scales every call differently, so new is first scaled to match cached on the months they share.
+
+    :returns the merged series (peak at 100), or None if the two series can't be matched (no interest on the shared months)
+    """
+    if cached_partial:
+        cached = cached.iloc[:-1] #the partial month was refetched
+    overlap = cached.index.intersection(new.index)
+    reference, current = cached[overlap].sum(), new[overlap].sum()
+    if len(cached) == 0 or reference <= 0 or current <= 0:
+        return None
+    new_points = new[new.index > cached.index[-1]] * (reference / current)
+    return _rescale(pd.concat([cached, new_points]))
+
+def _chunks(keys):
+    """Group keys by (gprop, geo), then by groups of at most MAX_TERMS distinct terms"""
+    groups = {}
+    for key in keys:
+        groups.setdefault((key[2], key[3]), []).append(key)
+    for (gprop, geo), group in groups.items():
+        terms = list(dict.fromkeys(_term(key) for key in group))
+        for start in range(0, len(terms), MAX_TERMS):
+            chunk_terms = terms[start:start + MAX_TERMS]
+            yield gprop, geo, chunk_terms, [key for key in group if _term(key) in chunk_terms]
+
+def _term(key):
+    """Term searched on Google Trends for a key (the mid, or the keyword if there is no mid)"""
+    return key[1] if key[1] else key[0]
 
-def get_interest(keyword, mid=None):
+def _update_interests(keys):
+    """Make sure the interest store has an up to date series for every key
+
+    New keys are fetched from 2004 ('all'). Keys fetched more than REFRESH_AFTER seconds ago only fetch the months
+    from their last cached point (minus OVERLAP months used to match the scales), which are appended.
+
+    :argument keys: list of (keyword, mid, gprop, geo)
+    """
+    store = get_interest_store()
+    now = time.time()
+    missing, stale = [], []
+    for key in dict.fromkeys(keys):
+        cached = store.get(key)
+        if cached is None:
+            missing.append(key)
+        elif now - cached[2] > REFRESH_AFTER:
+            #no point to append new months to: fetch the whole history again
+            (missing if len(cached[0]) == 0 else stale).append(key)
+
+    if is_offline():
+        if missing:
+            raise CacheMissError('No cached interest for {}'.format(', '.join(key[0] for key in missing)))
+        return
+    if not missing and not stale:
+        return
+
+    today = pd.Timestamp.today().strftime('%Y-%m-%d')
+    for gprop, geo, terms, chunk in _chunks(stale):
+        start = min(store.get(key)[0].index[-1] for key in chunk) - pd.DateOffset(months=OVERLAP)
+        data, partial = _fetch_interest(terms, '{} {}'.format(start.strftime('%Y-%m-01'), today), gprop, geo)
+        for key in chunk:
+            series, cached_partial, _ = store.get(key)
+            merged = _append_months(series, cached_partial, data[_term(key)]) if _term(key) in data else None
+            if merged is None:
+                missing.append(key) #fetch the whole history again
+            else:
+                store.put(key, merged, partial)
+
+    for gprop, geo, terms, chunk in _chunks(missing):
+        data, partial = _fetch_interest(terms, 'all', gprop, geo)
+        for key in chunk:
+            store.put(key, _rescale(data[_term(key)]), partial)
+
+    store.save()
+
+def get_interest(keyword, mid=None, gprop='news', geo=''):
     """Get the time series of interest by month for the selected entity (keyword and mid)
 
+    Series are kept in the interest store of the cache directory, only the months after the last cached point are fetched.
+
     :argument keyword: entity name
     :argument mid: returned by the above function to get precision
+    :argument gprop: what property to filter to (images, news, youtube or froogle (for Google Shopping results))
+    :argument geo: two letter country abreviation (default to world)
 
     :return: dataframe with dates as index and one column named keyword which corresponds to the interest by month
     """
-    try:
-        interest = pd.read_csv(os.path.join(os.path.dirname(__file__), 'interest_cache/' + keyword + '.csv'), index_col=0)
-        interest.index = pd.to_datetime(interest.index)
-        return interest
-    except:
-        pytrends = get_pytrend()
-
-        if not mid:
-            mid = keyword
-
-        pytrends.build_payload([mid], #up to 5 terms in the list
-                               cat=0, #default to no category
-                               timeframe='all', #Date to start from
-                               geo='', #two letter country abreviation (default to world)
-                               gprop='news') #what property to filter to (images, news, youtube or froogle
-                                         #(for Google Shopping results))
-        data = pytrends.interest_over_time() #two columns (mid name <-> interest and isPartial) + index = date
-        data.drop(columns = 'isPartial', inplace = True) #rermove isPartial column
-        data.columns = [keyword] #rename the column with the keyword name instead of the mid name
-        return data
+    return get_interests([keyword], [mid], gprop=gprop, geo=geo)
+
+def get_interests(keywords, mids=None, gprop='news', geo=''):
+    """Get the time series of interest by month for several entities, fetching up to 5 entities per Google Trends call
+
+    Google Trends scales the terms of one call together (the biggest term peaks at 100), so each column is rescaled
+    to peak at 100 to stay comparable with get_interest (small entities lose some precision: values are rounded by Google).
+
+    :argument keywords: list of entity names
+    :argument mids: list of mids (same order as keywords), keywords are used if None
+    :argument gprop: what property to filter to (images, news, youtube or froogle (for Google Shopping results))
+    :argument geo: two letter country abreviation (default to world)
+
+    :return: dataframe with dates as index and one column per keyword
+    """
+    keywords = list(keywords)
+    if mids is None:
+        mids = [None] * len(keywords)
+    keys = [(keyword, mid if mid else '', gprop, geo) for keyword, mid in zip(keywords, mids)]
+    with span('interest', entities=len(keys)):
+        _update_interests(keys)
+    interest = get_interest_store().frame(keys, columns=keywords)
+    interest.index.name = 'date'
+    return interest
@@ -0,0 +1,163 @@
+##################################
+# INTEREST STORE (cached interest series, one binary file for all entities)
+
+import contextlib
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .cache import get_cache_dir
+
+STORE_FILE = 'interest.npz'
+_SEP = '\x1f' #separator of the fields of a key in the file
+LOCK_TIMEOUT = 60. #seconds after which the lock file of a killed process is removed
+
+@contextlib.contextmanager
+def _file_lock(path, timeout=LOCK_TIMEOUT, poll=.05):
+    """Lock shared by the processes writing path (a lock file next to it, created exclusively)"""
+    lock_path = path + '.lock'
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > timeout:
+                    os.remove(lock_path)
+                    continue
+            except OSError: #released meanwhile
+                continue
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+
+def _version(path):
+    """Identifies a version of the file (every save replaces it by a new file), None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+class InterestStore:
+    """Interest series of many entities, stored in one numpy file as columns:
+    - keys: one key per series, (keyword, mid, gprop, geo)
+    - months: the months of all series (datetime64[M])
+    - values: float matrix (series x months), NaN where a series has no data
+    - partial: True if the last point of a series was partial (current month) when fetched
+    - fetched: time (seconds since epoch) of the last fetch of each series
+
+    Everything is loaded with a single read, and written back atomically by save. Several processes can save the
+    same store: save merges the series saved by the other processes since the file was read.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.RLock()
+        self._series = {} #key -> (series, partial, fetched)
+        self._loaded = False
+        self._version = None #version of the file when it was last read or written
+
+    def _read(self):
+        """Read the store file
+        :returns dictionary, key -> (series, partial, fetched)
+        """
+        self._version = _version(self.path)
+        if self._version is None:
+            return {}
+        with np.load(self.path, allow_pickle=False) as data:
+            keys, months, values = data['keys'], data['months'], data['values']
+            partial, fetched = data['partial'], data['fetched']
+        index = pd.DatetimeIndex(months.astype('datetime64[ns]'))
+        return {tuple(str(key).split(_SEP)): (pd.Series(values[i], index=index).dropna(), bool(partial[i]), float(fetched[i]))
+                for i, key in enumerate(keys)}
+
+    def _load(self):
+        """Read the store file once"""
+        if self._loaded:
+            return
+        self._loaded = True
+        self._series.update(self._read())
+
+    def keys(self):
+        with self._lock:
+            self._load()
+            return list(self._series)
+
+    def get(self, key):
+        """Get a cached series
+        :argument key: (keyword, mid, gprop, geo)
+        :returns (series, partial, fetched) or None if the key is not in the store
+        """
+        with self._lock:
+            self._load()
+            return self._series.get(tuple(key))
+
+    def put(self, key, series, partial, fetched=None):
+        """Store a series (call save to write the file)
+        :argument key: (keyword, mid, gprop, geo)
+        :argument series: pandas series with monthly dates as index
+        :argument partial: bool, True if the last point is partial
+        """
+        with self._lock:
+            self._load()
+            self._series[tuple(key)] = (series.astype(float), bool(partial), time.time() if fetched is None else fetched)
+
+    def frame(self, keys, columns=None):
+        """Get several series aligned on the same months
+        :argument keys: list of (keyword, mid, gprop, geo)
+        :argument columns: list of column names (keywords if None)
+        :returns dataframe with dates as index and one column per key
+        """
+        with self._lock:
+            self._load()
+            columns = [key[0] for key in keys] if columns is None else columns
+            return pd.concat([self._series[tuple(key)][0] for key in keys], axis=1, keys=columns).sort_index()
+
+    def save(self):
+        """Write the store file, with the series saved by other processes since it was read"""
+        with self._lock:
+            self._load()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with _file_lock(self.path):
+                if _version(self.path) != self._version:
+                    #saved by another process: keep the most recent fetch of each series
+                    for key, cached in self._read().items():
+                        if key not in self._series or cached[2] > self._series[key][2]:
+                            self._series[key] = cached
+                self._write()
+
+    def _write(self):
+        """Write every series to the store file (atomically, through a temporary file)"""
+        keys = list(self._series)
+        if keys:
+            data = pd.concat([self._series[key][0] for key in keys], axis=1).sort_index()
+            months = data.index.values.astype('datetime64[M]')
+            values = data.values.T
+        else:
+            months, values = np.array([], dtype='datetime64[M]'), np.zeros((0, 0))
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path,
+                 keys=np.array([_SEP.join(key) for key in keys], dtype=str),
+                 months=months,
+                 values=values.astype(np.float64),
+                 partial=np.array([self._series[key][1] for key in keys], dtype=bool),
+                 fetched=np.array([self._series[key][2] for key in keys], dtype=np.float64))
+        os.replace(tmp_path, self.path)
+        self._version = _version(self.path)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_interest_store():
+    """Get the interest store of the cache directory (see huginn.cache.configure_cache)"""
+    global _store
+    path = os.path.join(str(get_cache_dir()), STORE_FILE)
+    with _store_lock:
+        if _store is None or _store.path != path:
+            _store = InterestStore(path)
+        return _store
@@ -0,0 +1,177 @@
+##################################
+# ONLINE ANOMALIES (one new point at a time)
+
+import math
+from collections import deque, namedtuple
+
+from .anomalies import _alpha
+
+AnomalyEvent = namedtuple('AnomalyEvent', ['key', 'date', 'value', 'score'])
+
+class _EwmMean:
+    """Running exponential moving weighted mean (same as pandas .ewm(halflife).mean())"""
+    def __init__(self, halflife, state=None):
+        self.factor = 1 - _alpha(halflife)
+        self.mean, self.old_wt = state if state is not None else (math.nan, 1.)
+
+    def value(self):
+        return self.mean
+
+    def update(self, x):
+        if math.isnan(self.mean):
+            if not math.isnan(x):
+                self.mean, self.old_wt = x, 1.
+            return
+        self.old_wt *= self.factor
+        if not math.isnan(x):
+            if self.mean != x:
+                self.mean = (self.old_wt * self.mean + x) / (self.old_wt + 1)
+            self.old_wt += 1
+
+    def state(self):
+        return [self.mean, self.old_wt]
+
+class _EwmStd:
+    """Running exponential moving weighted std (same as pandas .ewm(halflife).std())"""
+    def __init__(self, halflife, state=None):
+        self.factor = 1 - _alpha(halflife)
+        if state is None:
+            state = (math.nan, 0., 1., 1., 1.)
+        self.mean, self.var, self.sum_wt, self.sum_wt2, self.old_wt = state
+
+    def value(self):
+        numerator = self.sum_wt * self.sum_wt
+        denominator = numerator - self.sum_wt2
+        if math.isnan(self.mean) or denominator <= 0:
+            return math.nan
+        return math.sqrt(numerator / denominator * self.var)
+
+    def update(self, x):
+        if math.isnan(self.mean):
+            if not math.isnan(x):
+                self.mean = x
+            return
+        self.sum_wt *= self.factor
+        self.sum_wt2 *= self.factor ** 2
+        self.old_wt *= self.factor
+        if not math.isnan(x):
+            old_mean = self.mean
+            if self.mean != x:
+                self.mean = (self.old_wt * self.mean + x) / (self.old_wt + 1)
+            self.var = (self.old_wt * (self.var + (old_mean - self.mean) ** 2) + (x - self.mean) ** 2) / (self.old_wt + 1)
+            self.sum_wt += 1
+            self.sum_wt2 += 1
+            self.old_wt += 1
+
+    def state(self):
+        return [self.mean, self.var, self.sum_wt, self.sum_wt2, self.old_wt]
+
+class _RollingWindow:
+    """Last window points, to get the rolling mean and std (same as pandas .rolling(window))"""
+    def __init__(self, window, state=None):
+        self.window = window
+        self.points = deque(state if state is not None else [], maxlen=window)
+
+    def mean(self):
+        if len(self.points) < self.window:
+            return math.nan
+        return sum(self.points) / self.window
+
+    def std(self):
+        if len(self.points) < self.window or self.window < 2:
+            return math.nan
+        if all(x == self.points[0] for x in self.points):
+            return 0.
+        mean = sum(self.points) / self.window
+        var = (sum(x * x for x in self.points) - self.window * mean ** 2) / (self.window - 1)
+        return math.sqrt(max(var, 0.))
+
+    def update(self, x):
+        self.points.append(x)
+
+    def state(self):
+        return list(self.points)
+
+class OnlineDetector:
+    """Anomaly detector updated one point at a time, for as many entities (keys) as needed
+
+    Each key keeps a constant size state (running ewm mean and variance, or the points of the rolling windows),
+    so a new point costs the same whatever the length of the history. A point xn is an anomaly as soon as
+    xn - mu_hat(n-1) > k*std_hat(n-1), with the same mu_hat and std_hat as anomalies.ewm_std and anomalies.rolling_std.
+    """
+    def __init__(self, method='ewm', k=1, **params):
+        """
+        :argument method: ewm (halflife_mean, halflife_std set to 1, 10 by default)
+                          or rolling (lookback_mean, lookback_std set to 1, 10 by default)
+        :argument k: float, threshold on the score (xn - mu_hat(n-1)) / std_hat(n-1)
+        """
+        if method == 'ewm':
+            self.params = {'halflife_mean': params.pop('halflife_mean', 1), 'halflife_std': params.pop('halflife_std', 10)}
+        elif method == 'rolling':
+            self.params = {'lookback_mean': params.pop('lookback_mean', 1), 'lookback_std': params.pop('lookback_std', 10)}
+        else:
+            raise ValueError('Unknown method \'{}\', use ewm or rolling'.format(method))
+        if params:
+            raise TypeError('Unexpected parameters for method \'{}\': {}'.format(method, ', '.join(sorted(params))))
+        self.method = method
+        self.k = k
+        self._states = {}
+
+    def _new_state(self, state=None):
+        state = state or {}
+        if self.method == 'ewm':
+            return {'mean': _EwmMean(self.params['halflife_mean'], state.get('mean')),
+                    'std': _EwmStd(self.params['halflife_std'], state.get('std'))}
+        return {'mean': _RollingWindow(self.params['lookback_mean'], state.get('mean')),
+                'std': _RollingWindow(self.params['lookback_std'], state.get('std'))}
+
+    def score(self, key, value):
+        """Score of a new point (xn - mu_hat(n-1)) / std_hat(n-1), without updating the state (NaN if undefined)"""
+        state = self._states.get(key)
+        if state is None:
+            return math.nan
+        if self.method == 'ewm':
+            mean, std = state['mean'].value(), state['std'].value()
+        else:
+            mean, std = state['mean'].mean(), state['std'].std()
+        if math.isnan(mean) or not std > 0:
+            return math.nan
+        return (value - mean) / std
+
+    def update(self, key, value, date=None):
+        """Add a new point of a series
+        :argument key: entity (any hashable, str to be able to save the snapshot as JSON)
+        :argument value: float, new point (NaN if missing)
+        :argument date: date of the point, only reported in the event
+        :returns an AnomalyEvent if the point is an anomaly, None otherwise
+        """
+        value = math.nan if value is None else float(value)
+        score = self.score(key, value)
+        state = self._states.setdefault(key, self._new_state())
+        state['mean'].update(value)
+        state['std'].update(value)
+        if score > self.k:
+            return AnomalyEvent(key, date, value, score)
+        return None
+
+    def update_many(self, values, date=None):
+        """Add a new point for several entities
+        :argument values: dictionary, keys are entities and values are the new points
+        :returns list of AnomalyEvent
+        """
+        events = [self.update(key, value, date) for key, value in values.items()]
+        return [event for event in events if event is not None]
+
+    def snapshot(self):
+        """State of the detector as a dictionary of lists and floats (can be saved as JSON or pickled)"""
+        return {'method': self.method, 'k': self.k, 'params': dict(self.params),
+                'states': {key: {'mean': state['mean'].state(), 'std': state['std'].state()}
+                           for key, state in self._states.items()}}
+
+    @classmethod
+    def restore(cls, snapshot):
+        """Create a detector from a snapshot"""
+        detector = cls(snapshot['method'], snapshot['k'], **snapshot['params'])
+        for key, state in snapshot['states'].items():
+            detector._states[key] = detector._new_state(state)
+        return detector
@@ -0,0 +1,272 @@
+##################################
+# RESUMABLE BATCH RUNNER (used by the huginn command line, see cli.py)
+#
+# Interest is fetched by the main process (5 entities per Google Trends call), then each entity goes through
+# anomalies -> articles -> summaries in a process pool. Only nyt_concurrency processes call the NYT API at once,
+# the other ones run LDA and summarization. The NYT rate limits are token buckets served by a manager process to every
+# process of the pool, and the state of the daily quota is kept with the checkpoints, so a resumed run doesn't start
+# with a full quota. The result of every stage is checkpointed in a directory per entity, so a run stopped by a crash
+# or by the NYT daily quota resumes where it stopped. Interest checkpoints are only reused during the REFRESH_AFTER
+# period they were fetched in, so a run on a later day sees the new months (and their anomalies).
+
+import contextlib
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import SyncManager
+from pathlib import Path
+
+from .huginn import Huginn
+from .interest import get_interests, resolve_mid, first_suggestion, prefer_type, MAX_TERMS, REFRESH_AFTER
+from .anomalies import MAX_ANOMALIES
+from .article_table import ArticleTable
+from .scheduler import get_scheduler, configure_scheduler, TokenBucket, PersistentTokenBucket
+from .exceptions import NytQuotaError
+from .instrument import progress
+
+STAGES = ['interest', 'anomalies', 'articles', 'summaries']
+#status of an entity in the results
+OK = 'ok'
+ERROR = 'error' #the entity is processed again by the next run
+QUOTA_EXHAUSTED = 'quota_exhausted' #the NYT daily quota is exhausted, the run stops
+QUOTA_FILE = 'nyt_quota.json' #state of the NYT daily quota, in the checkpoints directory
+
+DEFAULT_OPTIONS = {'stages': STAGES, 'method': 'ewm', 'top_k': MAX_ANOMALIES, 'num_links': 'all', 'n_components': 2,
+                   'min_length': 50, 'max_length': 150, 'model': None}
+
+def read_entities(path):
+    """Read an entity file: one entity per line, optionally followed by a tab and its mid (empty lines and # comments are skipped)
+    :returns list of (entity, mid), mid is None if not given
+    """
+    entities = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entity, _, mid = line.partition('\t')
+            entities.append((entity.strip(), mid.strip() or None))
+    return entities
+
+def policy_from_name(name):
+    """Ranking policy from its name: 'none' (search the keyword), 'first' (first suggestion) or a type (ex: 'Company')"""
+    if name in (None, 'none'):
+        return None
+    if name == 'first':
+        return first_suggestion
+    return prefer_type(name)
+
+def refresh_epoch(now=None):
+    """Number of the REFRESH_AFTER period of now (time.time() if None): interest checkpoints of an older period are
+    fetched again, as the series of the interest store are refreshed (the later stages then only process new dates,
+    their searches, articles and summaries are cached)
+    """
+    return int((time.time() if now is None else now) // REFRESH_AFTER)
+
+def stage_keys(options, mid=None, epoch=None):
+    """Key of each stage: the parameters of the stage and of the previous ones (a checkpoint is reused only if they match)
+    :argument mid: mid of the entity (None if its keyword is searched)
+    :argument epoch: refresh period of the interest (see refresh_epoch, the current one if None)
+    """
+    epoch = refresh_epoch() if epoch is None else epoch
+    parameters = {'interest': (mid, epoch), 'anomalies': (options['method'], options['top_k']), 'articles': (options['num_links'],),
+                  'summaries': (options['n_components'], options['min_length'], options['max_length'], options['model'])}
+    keys, previous = {}, ()
+    for stage in STAGES:
+        previous = previous + parameters[stage]
+        keys[stage] = hashlib.sha1(repr(previous).encode('utf-8')).hexdigest()[:10]
+    return keys
+
+class Checkpoint:
+    """Results of the stages of one entity, kept in a directory
+    Each result is written to a temporary file which is then renamed, so an interrupted write leaves no checkpoint.
+    """
+    def __init__(self, directory, entity):
+        digest = hashlib.sha1(entity.encode('utf-8')).hexdigest()[:8]
+        self.path = Path(directory) / '{}-{}'.format(re.sub(r'[^\w.-]+', '_', entity)[:60], digest)
+
+    def _file(self, stage, key):
+        #the articles are an ArticleTable directory (see ArticleTable.save), its text is memory-mapped when loaded
+        return self.path / ('{}-{}'.format(stage, key) + ('' if stage == 'articles' else '.pkl'))
+
+    def has(self, stage, key):
+        return self._file(stage, key).exists()
+
+    def save(self, stage, key, value):
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self._file(stage, key)
+        tmp = target.with_name(target.name + '.tmp')
+        if stage == 'articles':
+            shutil.rmtree(str(tmp), ignore_errors=True)
+            value.save(str(tmp))
+            shutil.rmtree(str(target), ignore_errors=True)
+        else:
+            with open(str(tmp), 'wb') as f:
+                pickle.dump(value, f)
+        os.replace(str(tmp), str(target))
+
+    def load(self, stage, key, default=None):
+        if not self.has(stage, key):
+            return default
+        if stage == 'articles':
+            return ArticleTable.load(str(self._file(stage, key)), mmap=True)
+        with open(str(self._file(stage, key)), 'rb') as f:
+            return pickle.load(f)
+
+class _LimitsManager(SyncManager):
+    """Manager process serving the NYT rate limits to the processes of the pool"""
+
+_LimitsManager.register('TokenBucket', TokenBucket)
+_LimitsManager.register('PersistentTokenBucket', PersistentTokenBucket)
+
+_nyt_slots = None #semaphore of the pool limiting the number of processes calling the NYT API at once
+
+def _init_worker(nyt_slots, minute_bucket, day_bucket):
+    """Initializer of the processes of the pool: the NYT scheduler uses the buckets of the manager"""
+    global _nyt_slots
+    _nyt_slots = nyt_slots
+    configure_scheduler(minute_bucket=minute_bucket, day_bucket=day_bucket)
+
+def _nyt_slot():
+    return _nyt_slots if _nyt_slots is not None else contextlib.suppress()
+
+def process_entity(entity, mid, checkpoints, options, epoch=None):
+    """Run the stages of one entity, reusing its checkpoints
+    :argument checkpoints: directory of the checkpoints
+    :argument options: dictionary (see DEFAULT_OPTIONS)
+    :argument epoch: refresh period of the interest (see refresh_epoch)
+    :returns the result of the entity (dictionary, see to_record)
+    """
+    checkpoint, keys = Checkpoint(checkpoints, entity), stage_keys(options, mid, epoch)
+    try:
+        interest = checkpoint.load('interest', keys['interest'])
+        if interest is None: #normally fetched by fetch_interests
+            interest = get_interests([entity], [mid])
+            checkpoint.save('interest', keys['interest'], interest)
+        huginn = Huginn(entity, mid=False, interest=interest)
+
+        scores = checkpoint.load('anomalies', keys['anomalies'])
+        if scores is None:
+            huginn.get_anomalies(method=options['method'], top_k=options['top_k'])
+            checkpoint.save('anomalies', keys['anomalies'], huginn.anomaly_scores)
+        else:
+            huginn.anomaly_scores = scores
+            huginn._set_anomalies(scores.index)
+
+        table, summaries = None, None
+        if 'articles' in options['stages'] or 'summaries' in options['stages']:
+            table = checkpoint.load('articles', keys['articles'])
+            if table is None:
+                with _nyt_slot():
+                    table = huginn.get_articles_info(num_links=options['num_links'])
+                checkpoint.save('articles', keys['articles'], table)
+            else:
+                huginn._set_article_table(table, num_links=options['num_links'])
+
+        if 'summaries' in options['stages']:
+            summaries = checkpoint.load('summaries', keys['summaries'])
+            if summaries is None:
+                summaries = huginn.get_local_summaries(options['n_components'], options['min_length'],
+                                                       options['max_length'], model=options['model'])
+                checkpoint.save('summaries', keys['summaries'], summaries)
+    except NytQuotaError as e:
+        return {'entity': entity, 'mid': mid, 'status': QUOTA_EXHAUSTED, 'error': str(e)}
+    except Exception as e:
+        return {'entity': entity, 'mid': mid, 'status': ERROR, 'error': '{}: {}'.format(type(e).__name__, e)}
+    return to_record(entity, mid, huginn.anomaly_scores, table, summaries)
+
+def to_record(entity, mid, scores, table=None, summaries=None):
+    """Result of an entity as a JSON-serializable dictionary"""
+    record = {'entity': entity, 'mid': mid, 'status': OK,
+              'anomalies': [{'date': str(date.date()), 'score': float(score)} for date, score in scores.items()]}
+    if table is not None:
+        record['articles'] = {str(date.date()): [{'url': table.url[row], 'title': table.title[row]}
+                                                 for row in table.rows(i)]
+                              for i, date in enumerate(table.dates)}
+    if summaries is not None:
+        record['summaries'] = {date: {str(topic): summary for topic, summary in topics.items()}
+                               for date, topics in summaries.items()}
+    return record
+
+def fetch_interests(entities, checkpoints, options, epoch=None):
+    """Fetch the interest of the entities without an interest checkpoint, MAX_TERMS entities per Google Trends call
+    :argument entities: list of (entity, mid)
+    :argument epoch: refresh period of the interest (see refresh_epoch)
+    :returns a dictionary, keys are entities whose interest could not be fetched and values are their errors
+    """
+    missing = [(entity, mid) for entity, mid in entities
+               if not Checkpoint(checkpoints, entity).has('interest', stage_keys(options, mid, epoch)['interest'])]
+    errors = {}
+    for start in range(0, len(missing), MAX_TERMS):
+        chunk = missing[start:start + MAX_TERMS]
+        try:
+            interest = get_interests([entity for entity, _ in chunk], [mid for _, mid in chunk])
+        except Exception as e:
+            errors.update({entity: '{}: {}'.format(type(e).__name__, e) for entity, _ in chunk})
+            continue
+        for entity, mid in chunk:
+            Checkpoint(checkpoints, entity).save('interest', stage_keys(options, mid, epoch)['interest'],
+                                                 interest[[entity]])
+    return errors
+
+def run_batch(entities, checkpoints, options=None, processes=None, nyt_concurrency=1, policy=None):
+    """Process a list of entities, resuming from the checkpoints of a previous run
+    :argument entities: list of (entity, mid), see read_entities
+    :argument checkpoints: directory of the checkpoints
+    :argument options: dictionary of the parameters of the stages (see DEFAULT_OPTIONS)
+    :argument processes: number of processes (os.cpu_count() if None, 0 runs everything in the current process)
+    :argument nyt_concurrency: maximum number of processes calling the NYT API at once (the rate limits of the NYT
+        scheduler of the current process are shared by all processes)
+    :argument policy: ranking policy resolving the mids not given (see interest.resolve_mid), keywords are searched if None
+    :returns a generator of results (dictionaries, see to_record), in the order they are completed.
+        After the NYT daily quota is exhausted, the entities not started yet are not processed.
+    """
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    if policy is not None:
+        entities = [(entity, mid if mid else resolve_mid(entity, policy=policy)) for entity, mid in entities]
+    epoch = refresh_epoch() #the same for the whole run
+    errors = fetch_interests(entities, checkpoints, options, epoch)
+    for entity, mid in entities:
+        if entity in errors:
+            yield {'entity': entity, 'mid': mid, 'status': ERROR, 'error': errors[entity]}
+    entities = [(entity, mid) for entity, mid in entities if entity not in errors]
+
+    scheduler = get_scheduler()
+    minute, day = scheduler.minute_bucket, scheduler.day_bucket
+    Path(checkpoints).mkdir(parents=True, exist_ok=True)
+    quota_path = str(Path(checkpoints) / QUOTA_FILE)
+
+    if processes == 0:
+        scheduler.day_bucket = PersistentTokenBucket(quota_path, day.capacity, day.period)
+        try:
+            for i, (entity, mid) in enumerate(entities):
+                record = process_entity(entity, mid, checkpoints, options, epoch)
+                progress('{}/{} {}: {}'.format(i + 1, len(entities), entity, record['status']), entity=entity)
+                yield record
+                if record['status'] == QUOTA_EXHAUSTED:
+                    return
+        finally:
+            scheduler.day_bucket = day
+        return
+
+    with _LimitsManager() as manager, ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker,
+            initargs=(manager.BoundedSemaphore(nyt_concurrency), manager.TokenBucket(minute.capacity, minute.period),
+                      manager.PersistentTokenBucket(quota_path, day.capacity, day.period))) as executor:
+        futures = {executor.submit(process_entity, entity, mid, checkpoints, options, epoch): entity
+                   for entity, mid in entities}
+        done = 0
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            record = future.result()
+            done += 1
+            progress('{}/{} {}: {}'.format(done, len(entities), futures[future], record['status']), entity=futures[future])
+            yield record
+            if record['status'] == QUOTA_EXHAUSTED: #entities already started still finish
+                for other in futures:
+                    other.cancel()
@@ -0,0 +1,138 @@
+##################################
+# NYT API SCHEDULER (rate limits, retries)
+
+import json
+import os
+import random
+import threading
+import time
+
+from .exceptions import NytApiError, NytQuotaError
+from .session import get_session, TIMEOUT
+from .instrument import count
+
+PER_MINUTE = 10 #NYT article search limits (https://developer.nytimes.com/faq)
+PER_DAY = 4000
+MAX_RETRIES = 5 #number of retries for a 429 or 5xx response
+BACKOFF = 2. #base delay (seconds) of the exponential backoff
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+    """Token bucket: at most capacity calls at once, refilled at capacity tokens per period (seconds)"""
+    def __init__(self, capacity, period, clock=time.monotonic):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_acquire(self):
+        """Take one token if there is one
+        :returns 0 if a token was taken, otherwise the number of seconds to wait for the next token
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+class PersistentTokenBucket(TokenBucket):
+    """Token bucket whose state is kept in a json file, so that a quota is still counted after a restart
+    The clock must be the wall clock (time.time): the state is compared with the clock of the next run.
+    """
+    def __init__(self, path, capacity, period, clock=time.time):
+        super().__init__(capacity, period, clock=clock)
+        self.path = str(path)
+        self._file_lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.tokens = min(float(capacity), float(state['tokens']))
+            self.last = min(self.last, float(state['last']))
+        except (OSError, ValueError, KeyError): #first run
+            pass
+
+    def _write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'tokens': self.tokens, 'last': self.last}, f)
+        os.replace(tmp_path, self.path)
+
+    def try_acquire(self):
+        with self._file_lock:
+            wait = super().try_acquire()
+            if wait == 0:
+                self._write()
+            return wait
+
+class NytScheduler:
+    """Send requests to the NYT API within the per-minute and per-day limits
+    429 and 5xx responses are retried with an exponential backoff with full jitter.
+    minute_bucket and day_bucket replace the buckets of per_minute and per_day (ex: proxies of buckets shared by several
+    processes, see runner.run_batch).
+    """
+    def __init__(self, per_minute=PER_MINUTE, per_day=PER_DAY, max_retries=MAX_RETRIES, backoff=BACKOFF,
+                 clock=time.monotonic, sleep=time.sleep, minute_bucket=None, day_bucket=None):
+        self.minute_bucket = TokenBucket(per_minute, 60., clock=clock) if minute_bucket is None else minute_bucket
+        self.day_bucket = TokenBucket(per_day, 24 * 3600., clock=clock) if day_bucket is None else day_bucket
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+    def _acquire(self):
+        """Wait until a call is allowed by both limits (raise NytQuotaError if the daily quota is exhausted)"""
+        if self.day_bucket.try_acquire() > 0:
+            raise NytQuotaError('NYT daily quota exhausted')
+        while True:
+            wait = self.minute_bucket.try_acquire()
+            if wait == 0:
+                return
+            self.sleep(wait)
+
+    def get(self, url):
+        """GET url once a call is allowed, retrying 429 and 5xx responses
+        :argument url: str
+        :returns requests.Response
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            count('requests', service='nyt_search')
+            r = get_session().get(url, timeout=TIMEOUT)
+            count('bytes', len(r.content), service='nyt_search')
+            if r.status_code not in RETRY_STATUS:
+                return r
+            if attempt == self.max_retries:
+                break
+            count('retries', service='nyt_search', status=r.status_code)
+            retry_after = r.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                delay = float(retry_after)
+            else:
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+            self.sleep(delay)
+        raise NytApiError('NYT API still answering {} after {} retries'.format(r.status_code, self.max_retries))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Get the NYT scheduler shared by every Huginn object of the process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = NytScheduler()
+        return _scheduler
+
+def configure_scheduler(**kwargs):
+    """Replace the shared NYT scheduler (see NytScheduler for the arguments, ex: per_minute=5)"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = NytScheduler(**kwargs)
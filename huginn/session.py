@@ -0,0 +1,44 @@
+##################################
+# HTTP SESSIONS AND CONCURRENT FETCHING
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = (5, 30) #(connect, read) timeouts in seconds for every HTTP call
+MAX_WORKERS = 8 #default number of concurrent fetches
+POOL_SIZE = 16 #number of keep-alive connections kept per host
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Get the HTTP session shared by the whole process
+    Connections are pooled per host and kept alive, so consecutive calls to the NYT API
+    or to nytimes.com reuse the same TCP/TLS connections.
+    :returns requests.Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+def fetch_all(function, items, max_workers=MAX_WORKERS):
+    """Apply function to every item with at most max_workers threads
+    :argument function: callable taking one item (typically doing network I/O)
+    :argument items: iterable of items
+    :argument max_workers: int, maximum number of concurrent calls
+    :returns list of results, in the same order as items
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
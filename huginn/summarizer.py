@@ -1,18 +1,83 @@
 ##################################
 # SUMMARIZER
 
-from transformers import pipeline
+import gc
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from .cache import get_cache
+from .instrument import span, count
+
+MAX_MODELS = 2 #maximum number of summarization models kept in memory at the same time
+BATCH_SIZE = 8 #number of texts sent to the model in one forward pass
+MAX_INPUT_TOKENS = 1024 #input size of a model whose tokenizer doesn't give it
+CHUNK_MIN_LENGTH = 30 #length of the summary of a chunk, independent of the requested length
+CHUNK_MAX_LENGTH = 120 #so that chunk summaries can be reused by every summary
+MAX_DEPTH = 5 #maximum number of reduce steps of a map-reduce summary
+MAX_CHUNK_SUMMARIES = 4096 #number of chunk summaries kept in memory
+
+_summarizers = OrderedDict() #model name -> loaded pipeline, least recently used first
+_summarizers_lock = threading.Lock()
+_chunk_summaries = OrderedDict() #(model, chunk) -> summary, least recently used first
+_chunk_summaries_lock = threading.Lock()
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def _load_pipeline(model):
+    """Load a summarization pipeline (model=None is the transformers default summarization model)"""
+    from transformers import pipeline #heavy import (torch), only done when a model is loaded
+    if model is None:
+        return pipeline("summarization")
+    return pipeline("summarization", model=model)
+
+def release_summarizers(model=None):
+    """Drop loaded summarization models from the registry to free memory
+    :argument model: name of the model to release, all models are released if None
+    """
+    with _summarizers_lock:
+        if model is None:
+            _summarizers.clear()
+        else:
+            _summarizers.pop(model, None)
+    gc.collect()
+
+def get_summarizer(model=None):
+    """Get the summarization pipeline of a model, loading it only once per process
+    At most MAX_MODELS models are kept, the least recently used one is evicted first.
+    If memory runs out while loading, every other model is evicted and loading is retried once.
+    :argument model: str, name of the transformers model (None for the default summarization model)
+    :returns a transformers summarization pipeline
+    """
+    with _summarizers_lock:
+        if model in _summarizers:
+            _summarizers.move_to_end(model)
+            return _summarizers[model]
+
+        while len(_summarizers) >= MAX_MODELS:
+            _summarizers.popitem(last=False)
+
+        count('model_loads', model=str(model))
+        try:
+            summarizer = _load_pipeline(model)
+        except MemoryError:
+            _summarizers.clear()
+            gc.collect()
+            summarizer = _load_pipeline(model)
+
+        _summarizers[model] = summarizer
+        return summarizer
 
 def lda_filter_articles(ids, articles):
     """From sets of ids to set of sentences (str)
-    :argument ids: dictionary (keys are topics and values are ids of articles
+    :argument ids: dictionary (keys are topics and values are sorted arrays of ids of articles, see LDA.topic_partition)
     :argument articles: list of str
     :returns a dictionary, keys are topics and values are sentences (str)
     """
     articles_per_topic = {}
     for topic in ids.keys():
-        tmp_topic_articles = [article for i,article in enumerate(articles) if i in ids[topic]]
-        articles_per_topic[topic] = ' '.join(tmp_topic_articles)
+        articles_per_topic[topic] = ' '.join([articles[i] for i in ids[topic]])
     return articles_per_topic
 
 def lda_filter_articles_anomalies(dic_ids, dic_articles):
@@ -27,27 +92,235 @@ def lda_filter_articles_anomalies(dic_ids, dic_articles):
         preprocessed_LDA_articles[date] = lda_filter_articles(dic_ids[date], dic_articles[date])
     return preprocessed_LDA_articles
 
-def run_summary(sentence, min_length, max_length):
-    """Summarize sentence with a maximum of max_length characters
+def lda_filter_table(dic_ids, table, join=True):
+    """Preprocess articles of an ArticleTable for each anomaly date (with the output of LDA.run_lda_table)
+    :argument dic_ids: dictionary of dictionary, keys are dates and values are dictionary whose keys are topics and values are arrays of ids (rows of table)
+    :argument table: ArticleTable
+    :argument join: True to concatenate the articles of each topic, False to keep a list of articles
+    :returns the same output as lda_filter_articles_anomalies (lists of str if join is False)
+    """
+    gather = table.text.join if join else table.text.take
+    return {date: {topic: gather(ids) for topic, ids in topics.items()} for date, topics in dic_ids.items()}
+
+def _summary_key(model, sentence, min_length, max_length):
+    """Key of a summary in the cache: hash of the model, the input and the generation parameters"""
+    text = '\x1f'.join(['default' if model is None else str(model), str(min_length), str(max_length), sentence])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def run_summaries(sentences, min_length, max_length, model=None, batch_size=BATCH_SIZE):
+    """Summarize several sentences, sending them to the model by batches of batch_size
+    Summaries are kept in the persistent 'summaries' cache (see huginn.cache.configure_cache for its size), only
+    sentences never summarized with the same model and lengths are sent to the model (which is not loaded otherwise).
+    Hits and misses are counted by the cache: get_cache('summaries').stats()
+    :argument sentences: list of str (sentences to summarize)
+    :argument max_length: maximum length of each output
+    :argument model: name of the summarization model (None for the default one)
+    :argument batch_size: number of sentences per forward pass
+    :returns list of str: summary of each sentence (same order)
+    """
+    sentences = list(sentences)
+    cache = get_cache('summaries')
+    keys = [_summary_key(model, sentence, min_length, max_length) for sentence in sentences]
+    summaries = [cache.get(key) for key in keys]
+    missing = OrderedDict() #sentence -> positions (each distinct sentence is summarized once)
+    for i, summary in enumerate(summaries):
+        if summary is None:
+            missing.setdefault(sentences[i], []).append(i)
+    if not missing:
+        return summaries
+
+    summarizer = get_summarizer(model)
+    new_sentences = list(missing)
+    with span('summarization', model=str(model)):
+        for start in range(0, len(new_sentences), batch_size):
+            batch = new_sentences[start:start + batch_size]
+            outputs = summarizer(batch, min_length=min_length, max_length=max_length)
+            for sentence, output in zip(batch, outputs):
+                for i in missing[sentence]:
+                    summaries[i] = output['summary_text']
+                cache.set(keys[missing[sentence][0]], output['summary_text'])
+    count('summaries', len(new_sentences), model=str(model))
+    return summaries
+
+def split_sentences(text):
+    """Split a text on sentence boundaries (., ! or ? followed by a space)"""
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+def _token_counter(summarizer):
+    """Function counting the tokens of a text for a summarization pipeline (words if it has no tokenizer)"""
+    tokenizer = getattr(summarizer, 'tokenizer', None)
+    if tokenizer is None:
+        return lambda text: len(text.split())
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+def _input_size(summarizer):
+    """Maximum number of tokens of an input of a summarization pipeline"""
+    size = getattr(getattr(summarizer, 'tokenizer', None), 'model_max_length', MAX_INPUT_TOKENS)
+    size = size if size <= 100000 else MAX_INPUT_TOKENS #tokenizers without limit report a huge number
+    return max(size - 8, 16) #room for special tokens
+
+def chunk_text(text, max_tokens, count_tokens):
+    """Split a text in chunks of at most max_tokens tokens, on sentence boundaries
+    Sentences longer than max_tokens are split on words.
+    :argument text: str
+    :argument max_tokens: int
+    :argument count_tokens: function giving the number of tokens of a str
+    :returns list of str
+    """
+    chunks, chunk, size = [], [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens: #split the sentence in pieces of (about) max_tokens tokens
+            words = sentence.split()
+            n_pieces = math.ceil(tokens / max_tokens) + 1
+            step = math.ceil(len(words) / n_pieces)
+            pieces = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            tokens = count_tokens(piece) if len(pieces) > 1 else tokens
+            if chunk and size + tokens > max_tokens:
+                chunks.append(' '.join(chunk))
+                chunk, size = [], 0
+            chunk.append(piece)
+            size += tokens
+    if chunk:
+        chunks.append(' '.join(chunk))
+    return chunks
+
+def pack_documents(documents, max_tokens, count_tokens):
+    """Split documents in chunks of at most max_tokens tokens, consecutive documents sharing a chunk
+    Each document is split with chunk_text, then its chunks are appended to the current chunk while it fits, so
+    short documents are summarized together instead of one model input each.
+    :argument documents: list of str
+    :returns list of str
+    """
+    chunks, chunk, size = [], [], 0
+    for document in documents:
+        for piece in chunk_text(document, max_tokens, count_tokens):
+            tokens = count_tokens(piece)
+            if chunk and size + tokens > max_tokens:
+                chunks.append(' '.join(chunk))
+                chunk, size = [], 0
+            chunk.append(piece)
+            size += tokens
+    if chunk:
+        chunks.append(' '.join(chunk))
+    return chunks
+
+def _summarize_chunks(chunks, model, count_tokens, batch_size):
+    """Summarize chunks (map step), with CHUNK_MIN_LENGTH and CHUNK_MAX_LENGTH
+    Chunks already shorter than a summary are kept as they are, chunk summaries are kept in memory so that
+    the global summary, the local summaries and the summary of summaries share them.
+    :returns list of str (same order)
+    """
+    summaries = [None] * len(chunks)
+    missing = OrderedDict() #chunk -> positions
+    with _chunk_summaries_lock:
+        for i, chunk in enumerate(chunks):
+            if count_tokens(chunk) <= CHUNK_MAX_LENGTH:
+                summaries[i] = chunk
+            elif (model, chunk) in _chunk_summaries:
+                _chunk_summaries.move_to_end((model, chunk))
+                summaries[i] = _chunk_summaries[(model, chunk)]
+            else:
+                missing.setdefault(chunk, []).append(i)
+
+    new_summaries = run_summaries(list(missing), CHUNK_MIN_LENGTH, CHUNK_MAX_LENGTH, model=model, batch_size=batch_size)
+    with _chunk_summaries_lock:
+        for (chunk, positions), summary in zip(missing.items(), new_summaries):
+            for i in positions:
+                summaries[i] = summary
+            _chunk_summaries[(model, chunk)] = summary
+        while len(_chunk_summaries) > MAX_CHUNK_SUMMARIES:
+            _chunk_summaries.popitem(last=False)
+    return summaries
+
+def summarize_groups(groups, min_length, max_length, model=None, batch_size=BATCH_SIZE):
+    """Summarize several groups of documents with map-reduce, whatever their length
+    The documents are packed in chunks that fit in the model (map, see pack_documents), the chunk summaries of a group are
+    concatenated and chunked again until they fit in one input (reduce), which is summarized with
+    min_length and max_length. The chunks of all groups are sent to the model together, in batches.
+    :argument groups: list of lists of str (documents)
+    :argument max_length: maximum length of each output
+    :argument model: name of the summarization model (None for the default one)
+    :argument batch_size: number of texts per forward pass
+    :returns list of str: summary of each group (same order)
+    """
+    if not groups:
+        return []
+    #summaries of whole groups are cached too, so that the model isn't loaded when every group was already summarized
+    cache = get_cache('summaries')
+    keys = [_group_key(model, group, min_length, max_length) for group in groups]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, summary in enumerate(results) if summary is None]
+    if missing:
+        summaries = _summarize_groups([groups[i] for i in missing], min_length, max_length, model, batch_size)
+        for i, summary in zip(missing, summaries):
+            results[i] = summary
+            cache.set(keys[i], summary)
+    return results
+
+def _group_key(model, group, min_length, max_length):
+    """Key of the summary of a group of documents in the cache (see _summary_key)"""
+    return _summary_key(model, '\x1e'.join(['group'] + list(group)), min_length, max_length)
+
+def _summarize_groups(groups, min_length, max_length, model, batch_size):
+    """Map-reduce of summarize_groups, without the cache of whole groups"""
+    summarizer = get_summarizer(model)
+    count_tokens, max_tokens = _token_counter(summarizer), _input_size(summarizer)
+    pending = [pack_documents(group, max_tokens, count_tokens) for group in groups]
+
+    for depth in range(MAX_DEPTH):
+        reduce = [i for i, chunks in enumerate(pending) if len(chunks) > 1]
+        if not reduce:
+            break
+        summaries = _summarize_chunks([chunk for i in reduce for chunk in pending[i]], model, count_tokens, batch_size)
+        start = 0
+        for i in reduce:
+            partial = summaries[start:start + len(pending[i])]
+            start += len(pending[i])
+            pending[i] = chunk_text(' '.join(partial), max_tokens, count_tokens)
+
+    #after MAX_DEPTH reduce steps, what is left is truncated by the model
+    return run_summaries([' '.join(chunks) for chunks in pending], min_length, max_length, model=model,
+                         batch_size=batch_size)
+
+def summarize_documents(documents, min_length, max_length, model=None):
+    """Summarize several documents as one (see summarize_groups)
+    :argument documents: list of str
+    :returns str: summary of the documents
+    """
+    return summarize_groups([list(documents)], min_length, max_length, model=model)[0]
+
+def run_summary(sentence, min_length, max_length, model=None):
+    """Summarize sentence with a maximum of max_length characters (map-reduce if it doesn't fit in the model, see summarize_groups)
     :argument sentence: str (sentence to summarize)
     :argument max_length: maximum length of the output
+    :argument model: name of the summarization model (None for the default one)
     :returns str: summary of the sentence
     """
-    summarizer = pipeline("summarization")
-    return summarizer(sentence, min_length=min_length, max_length=max_length)[0]['summary_text']
+    return summarize_documents([sentence], min_length, max_length, model=model)
 
-def get_summaries_by_topic(dic_anoamlies_topic_articles, min_length, max_length):
+def get_summaries_by_topic(dic_anoamlies_topic_articles, min_length, max_length, model=None):
     """Compute the summary for each anoamly date
     Articles are supposed to be already filtered by LDA
-    :argument dic_anoamlies_topic_articles: dic, keys are dates, values are dic (keys are topics, values are sentences (str))
+    All (date, topic) texts are summarized together with map-reduce (see summarize_groups) with a single model load.
+    :argument dic_anoamlies_topic_articles: dic, keys are dates, values are dic (keys are topics, values are sentences (str) or lists of articles)
     :argument max_length: int, max length of the summary
     :returns a summary (str) for each anomaly date, for each topic (dic of dic)
     """
+    keys, groups = [], []
+    for date, topics in dic_anoamlies_topic_articles.items():
+        for topic, articles in topics.items():
+            keys.append((date, topic))
+            groups.append([articles] if isinstance(articles, str) else list(articles))
+
+    summaries = summarize_groups(groups, min_length, max_length, model=model)
+
     summaries_by_topic = {}
-    dates = dic_anoamlies_topic_articles.keys()
-    for date in dates:
+    for date in dic_anoamlies_topic_articles.keys():
         summaries_by_topic[date.strftime('%m-%Y')] = {}
-        for topic in dic_anoamlies_topic_articles[date].keys():
-            summaries_by_topic[date.strftime('%m-%Y')][topic] = run_summary(dic_anoamlies_topic_articles[date][topic], 
-                                                              min_length, max_length)
-    return summaries_by_topic
\ No newline at end of file
+    for (date, topic), summary in zip(keys, summaries):
+        summaries_by_topic[date.strftime('%m-%Y')][topic] = summary
+    return summaries_by_topic
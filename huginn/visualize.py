@@ -3,10 +3,11 @@
 
 import matplotlib.pyplot as plt
 import pandas as pd
-import plotly
-import plotly.express as px
+
+from .instrument import progress
 
 def plot_data_plotly(data):
+    import plotly, plotly.express as px #only needed for interactive plots
     fig = px.line(data, x=data.index, y=data.columns[0])
 
     fig.update_layout(
@@ -37,6 +38,7 @@ def plot_data(data):
     plt.show()
 
 def plot_data_with_anomalies_plotly(data, anomalies):
+    import plotly, plotly.express as px #only needed for interactive plots
     fig = px.line(data, x=data.index, y=data.columns[0])
 
     shapes = []
@@ -92,10 +94,12 @@ def plot_data_with_anomalies(data, anomalies):
 
     plt.legend()
     plt.show()
-    print("""
+    progress("""
     If you are not happy with these anomalies, you can call the method \'get_anomalies\' and
     specify the function to get anomalies:
     - method = 'constant' with parameter k (set to 1 by default)
     - method = 'rolling' with parameters lookback_mean, lookback_std and k (set to 1, 10, 1 by default)
     - method = 'ewm' with parameters halflife_mean, halflife_std and k(set to 1,10,1 by default) [default method]
+    To compare many parameters at once, call the method 'sweep_anomalies' with lists of values
+    (ex: k=[0.5, 1, 2], halflife_std=[5, 10, 20]).
     """)
\ No newline at end of file
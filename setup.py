@@ -12,9 +12,9 @@ setup(name='huginn',
       author='Jesse Cahill, Thomas Causero, James DeAntonis, Ryan McNally',
       author_email='jcahill225@gmail.com, tc3030@columbia.edu, jad2295@columbia.edu, rom2109@columbia.edu',
       license='MIT',
-      packages=find_packages(exclude=('tests',)),
+      packages=find_packages(exclude=('tests', 'benchmarks', 'benchmarks.*')),
       include_package_data=True,
-      python_requires='>=3.5, <3.7',
+      python_requires='>=3.7', #asyncio.get_running_loop, ProcessPoolExecutor(initializer=...)
       install_requires=[
             'pandas',
             'matplotlib',
@@ -25,6 +25,7 @@ setup(name='huginn',
             'numpy',
             'click',
             'bs4',
+            'lxml',
             'plotly',
             'pyLDAvis',
             'gensim',
@@ -34,4 +35,6 @@ setup(name='huginn',
             'torch',
             'transformers'
        ],
+      entry_points={'console_scripts': ['huginn=huginn.cli:main']},
+      extras_require={'async': ['aiohttp']}, #non-blocking downloads for huginn.aio (threads otherwise)
       zip_safe=False)
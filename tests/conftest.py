@@ -0,0 +1,11 @@
+import pytest
+
+from huginn import cache
+
+
+@pytest.fixture(autouse=True)
+def huginn_cache(tmp_path):
+    """Every test gets its own empty cache directory"""
+    cache.configure_cache(directory=str(tmp_path / 'huginn_cache'), ttl=None, offline=False, enabled=True)
+    yield cache
+    cache.configure_cache(directory=cache.CACHE_DIR, offline=False)
@@ -0,0 +1,104 @@
+##################################
+# STAND-INS FOR GOOGLE TRENDS, THE NYT SEARCH API AND NYT ARTICLE PAGES (used by the tests and the benchmarks)
+#
+# StandInTrendReq answers synthetic series. StandInServer serves the recorded search of tests/fixtures/nyt_search.json
+# (paged as the NYT API, 10 documents per page, with urls rewritten to the stand-in) and the saved article pages
+# of tests/fixtures.
+
+import json
+import os
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEARCH_PATH = '/svc/search/v2/articlesearch.json'
+PAGE_SIZE = 10
+MONTHS = pd.date_range('2004-01-01', periods=200, freq='MS')
+
+class StandInTrendReq:
+    """Google Trends stand-in: synthetic monthly series, the biggest term of a payload peaks at 100"""
+    def __init__(self):
+        self.calls = 0
+
+    def build_payload(self, kw_list, **kwargs):
+        self.terms = kw_list
+
+    def interest_over_time(self):
+        self.calls += 1
+        data = pd.DataFrame({term: synthetic_series(term) for term in self.terms}, index=MONTHS)
+        data = data / data.values.max() * 100
+        data['isPartial'] = False
+        return data
+
+def synthetic_series(term, months=len(MONTHS)):
+    """Noisy seasonal series with a few bursts, the same for a given term"""
+    rng = np.random.default_rng(sum(map(ord, term)))
+    values = 20 + 5 * np.sin(np.arange(months) / 2) + rng.random(months) * 10
+    values[rng.integers(0, months, 3)] += rng.random(3) * 80
+    return values
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == SEARCH_PATH:
+            page = int(parse_qs(url.query).get('page', ['0'])[0])
+            self.server.searches += 1
+            self._send(json.dumps(self.server.search_page(page)).encode('utf-8'), 'application/json')
+        elif url.path.endswith('.html'):
+            self.server.pages += 1
+            name = 'nyt_blog.html' if os.path.basename(url.path).startswith('blog') else 'nyt_article.html'
+            self._send(self.server.fixtures[name], 'text/html')
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(HTTPServer):
+    """HTTP server on localhost answering the requests of huginn.articles
+    searches and pages count the requests received. Use as a context manager:
+
+        with StandInServer() as server:
+            articles.NYT_API_URL = server.search_url
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures=FIXTURES):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        self.search_url = self.base_url + SEARCH_PATH
+        self.fixtures = {}
+        for name in os.listdir(fixtures):
+            with open(os.path.join(fixtures, name), 'rb') as f:
+                self.fixtures[name] = f.read()
+        search = json.loads(self.fixtures['nyt_search.json'].decode('utf-8'))
+        self.docs = search['response']['docs']
+        for doc in self.docs:
+            doc['web_url'] = doc['web_url'].replace('https://www.nytimes.com', self.base_url)
+        self.searches, self.pages = 0, 0
+        self._thread = None
+
+    def search_page(self, page):
+        """Answer of the search API for a page of results"""
+        docs = self.docs[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        return {'status': 'OK', 'response': {'docs': docs, 'meta': {'hits': len(self.docs), 'offset': page * PAGE_SIZE}}}
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from huginn import aio, articles, interest
+from huginn.cache import configure_cache
+from huginn.huginn import Huginn
+from huginn.scheduler import configure_scheduler, PER_MINUTE, PER_DAY
+from tests.standins import StandInTrendReq, StandInServer
+
+DATES = pd.DatetimeIndex(['2018-01-01', '2018-02-01', '2018-03-01'])
+
+@pytest.fixture(params=['aiohttp', 'requests'])
+def server(request, monkeypatch):
+    if request.param == 'aiohttp':
+        pytest.importorskip('aiohttp')
+    else: #aiohttp not installed: pages are downloaded with the requests session
+        monkeypatch.setattr(aio, '_aiohttp', lambda: None)
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: StandInTrendReq())
+    monkeypatch.setenv('NYT_API_KEY', 'test')
+    with StandInServer() as server:
+        monkeypatch.setattr(articles, 'NYT_API_URL', server.search_url)
+        configure_scheduler(per_minute=10 ** 6, per_day=10 ** 9)
+        try:
+            yield server
+        finally:
+            configure_scheduler(per_minute=PER_MINUTE, per_day=PER_DAY)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_aget_articles_info_matches_get_articles_info(server, tmp_path):
+    executor = CountingExecutor()
+    aio.configure_executor(executor)
+
+    async def investigate(name):
+        cl = await Huginn.acreate(name, mid=False)
+        cl._set_anomalies(DATES)
+        return await cl.aget_articles_info(num_links=5)
+
+    async def investigate_all():
+        try:
+            return await asyncio.gather(investigate('Point72'), investigate('Citadel'))
+        finally:
+            await aio.close()
+
+    try:
+        tables = asyncio.run(investigate_all())
+    finally:
+        aio.configure_executor(None)
+        executor.shutdown()
+    assert executor.submitted > 0 #parsing and the table ran in the configured executor
+
+    configure_cache(directory=str(tmp_path / 'sync_cache'))
+    cl = Huginn('Point72', mid=False)
+    cl._set_anomalies(DATES)
+    expected = cl.get_articles_info(num_links=5)
+
+    for table in tables:
+        assert len(table) == len(expected) > 0
+        assert table.by_date('url') == expected.by_date('url')
+        assert table.by_date('text') == expected.by_date('text')
+        assert list(table.found) == list(expected.found)
+
+
+def test_ascrape_article_reports_http_errors(server):
+    async def scrape():
+        try:
+            return await aio.ascrape_article(server.base_url + '/missing')
+        finally:
+            await aio.close()
+
+    extraction = asyncio.run(scrape())
+    assert extraction.error == articles.HTTP_ERROR
+
+
+def test_ascrape_article_reports_request_errors(server):
+    async def scrape():
+        try:
+            return await aio.ascrape_article('http://127.0.0.1:1/unreachable')
+        finally:
+            await aio.close()
+
+    extraction = asyncio.run(scrape())
+    assert extraction.error == articles.REQUEST_ERROR
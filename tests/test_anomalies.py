@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from huginn import anomalies
+
+DATES = pd.date_range('2004-01-01', periods=200, freq='MS')
+
+
+def _pandas_ewm(data, halflife_mean=1, halflife_std=10, k=1):
+    """Reference implementation (pandas) of ewm_std"""
+    mean = data.ewm(halflife=halflife_mean).mean().shift(1)
+    std = data.ewm(halflife=halflife_std).std().shift(1)
+    tmp = (data - mean) / (k * std[std > 0])
+    return tmp[tmp.iloc[:, 0] > 1].sort_values(by=tmp.columns[0], ascending=False)[0:10].index.sort_values()
+
+
+def _pandas_rolling(data, lookback_mean=1, lookback_std=10, k=1):
+    """Reference implementation (pandas) of rolling_std"""
+    mean = data.rolling(lookback_mean).mean().shift(1)
+    std = data.rolling(lookback_std).std().shift(1)
+    tmp = (data - mean) / (k * std[std > 0])
+    return tmp[tmp.iloc[:, 0] > 1].sort_values(by=tmp.columns[0], ascending=False)[0:10].index.sort_values()
+
+
+def _pandas_constant(data, k=1):
+    """Reference implementation (pandas) of constant_sd"""
+    tmp = data - data.mean().iloc[0] - k * data.std().iloc[0]
+    return tmp[tmp.iloc[:, 0] > 0].sort_values(by=tmp.columns[0], ascending=False)[0:10].index.sort_values()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_detectors_match_pandas(seed):
+    rng = np.random.default_rng(seed)
+    values = rng.random(len(DATES)) * 100
+    values[:rng.integers(0, 50)] = 0 #no interest at the beginning
+    data = pd.DataFrame({'entity': values}, index=DATES)
+
+    assert anomalies.ewm_std(data).equals(_pandas_ewm(data))
+    assert anomalies.ewm_std(data, 3, 5, 0.5).equals(_pandas_ewm(data, 3, 5, 0.5))
+    assert anomalies.rolling_std(data).equals(_pandas_rolling(data))
+    assert anomalies.rolling_std(data, 2, 6, 2).equals(_pandas_rolling(data, 2, 6, 2))
+    assert anomalies.constant_sd(data).equals(_pandas_constant(data))
+
+
+def test_detect_many_series():
+    rng = np.random.default_rng(0)
+    values = rng.random((50, len(DATES))) * 100
+    values[3, :40] = np.nan #series starting later (aligned frame of several entities)
+    data = pd.DataFrame(values.T, index=DATES, columns=['e{}'.format(i) for i in range(50)])
+
+    positions, scores = anomalies.detect(values, 'ewm', top_k=5)
+    results = anomalies.detect_anomalies(data, 'ewm', top_k=5)
+
+    assert positions.shape == scores.shape == (50, 5)
+    for i, column in enumerate(data.columns):
+        single = data[[column]].dropna()
+        expected = anomalies.detect_anomalies(single, 'ewm', top_k=5)[column]
+        assert results[column].index.equals(expected.index)
+        assert np.allclose(results[column].values, expected.values)
+        assert (np.diff(positions[i][positions[i] >= 0]) > 0).all()
+    assert (scores[~np.isnan(scores)] > 1).all()
+
+
+def test_detect_pads_when_few_anomalies():
+    values = np.zeros(30)
+    values[20] = 50
+    positions, scores = anomalies.detect(values, 'constant', top_k=3)
+    assert positions.tolist() == [[20, -1, -1]]
+    assert np.isnan(scores[0, 1:]).all()
+
+
+def test_sweep_matches_detect():
+    rng = np.random.default_rng(3)
+    data = pd.DataFrame(rng.random((len(DATES), 3)) * 100, index=DATES, columns=['a', 'b', 'c'])
+
+    result = anomalies.sweep(data, 'ewm', k=[0.5, 1, 2], halflife_mean=[1, 2], halflife_std=[5, 10])
+
+    assert len(result.params) == 12
+    assert result.flags.shape == (12, 3, len(DATES))
+    for i, row in result.params.iterrows():
+        expected = anomalies.get_anomalies(data, 'ewm', k=row['k'], halflife_mean=row['halflife_mean'],
+                                           halflife_std=row['halflife_std'])
+        for column in data.columns:
+            matrix = result.matrix(column)
+            assert matrix.columns[matrix.loc[i].values].equals(expected[column])
+    stability = result.stability()
+    assert stability.shape == (len(DATES), 3)
+    assert ((stability >= 0) & (stability <= 1)).all().all()
+
+    constant = anomalies.sweep(data, 'constant', k=[1, 2])
+    assert list(constant.params.columns) == ['k']
+    assert constant.matrix('b').loc[0].sum() == len(anomalies.constant_sd(data[['b']]))
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from huginn.article_table import ArticleTable, StringColumn
+from huginn import summarizer
+
+DATES = [pd.Timestamp('20180101'), pd.Timestamp('20180601'), pd.Timestamp('20181001')]
+URLS = [['a1', 'a2', 'a3'], ['b1', 'failed', 'b2'], []]
+
+
+def _scrap(url):
+    if url == 'failed':
+        return None, None, None
+    return [url + '.jpg', url + '.png'], url.upper(), url + ' text é'
+
+
+def _table():
+    return ArticleTable.from_scrapped(DATES, URLS, [[_scrap(url) for url in urls] for urls in URLS])
+
+
+def test_string_column():
+    column = StringColumn.from_strings(['abc', '', 'été'])
+    assert len(column) == 3
+    assert column.take([2, 0, 1]) == ['été', 'abc', '']
+    assert column.join(np.array([0, 2])) == 'abc été'
+    assert column.join([]) == ''
+
+
+def test_article_table_is_aligned():
+    table = _table()
+
+    assert len(table) == 5
+    assert table.found.tolist() == [3, 3, 0]
+    assert table.by_date('url') == {DATES[0]: ['a1', 'a2', 'a3'], DATES[1]: ['b1', 'b2'], DATES[2]: []}
+    assert table.by_date('title')[DATES[1]] == ['B1', 'B2']
+    assert table.by_date('images')[DATES[1]] == [['b1.jpg', 'b1.png'], ['b2.jpg', 'b2.png']]
+    assert table.rows(1).tolist() == [3, 4]
+
+
+def test_article_table_memmap(tmp_path):
+    table = _table()
+    table.save(str(tmp_path / 'articles'))
+    loaded = ArticleTable.load(str(tmp_path / 'articles'), mmap=True)
+
+    assert isinstance(loaded.text.data, np.memmap)
+    assert list(loaded.dates) == DATES
+    for column in ['url', 'title', 'text', 'images']:
+        assert loaded.by_date(column) == table.by_date(column)
+
+
+def test_lda_filter_table():
+    table = _table()
+    topics = {DATES[0]: {1: np.array([0, 2]), 0: np.array([1])}, DATES[1]: {0: np.array([3, 4])}}
+
+    filtered = summarizer.lda_filter_table(topics, table)
+
+    assert filtered[DATES[0]] == {1: 'a1 text é a3 text é', 0: 'a2 text é'}
+    assert filtered[DATES[1]] == {0: 'b1 text é b2 text é'}
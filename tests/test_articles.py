@@ -36,3 +36,61 @@ def test_get_links():
     assert len(five_link_list) == 5
 
     assert 'www.nytimes.com' in link
+
+
+def test_get_articles_title_text_images_all_dates_keeps_order(monkeypatch):
+    import random
+    import time
+
+    dates = [pd.Timestamp('20180101'), pd.Timestamp('20180601')]
+    urls = {dates[0]: ['a1', 'a2', 'a3'], dates[1]: ['b1', 'failed', 'b2']}
+
+    def fake_get_article_urls(keyword, date, num_links='all'):
+        return urls[date]
+
+    def fake_get_article_title_text_images(url):
+        time.sleep(random.random() / 100)
+        if url == 'failed':
+            return None, None, None
+        return [url + '.jpg'], url, url + ' text'
+
+    monkeypatch.setattr(articles, 'get_article_urls', fake_get_article_urls)
+    monkeypatch.setattr(articles, 'get_article_title_text_images', fake_get_article_title_text_images)
+
+    results = articles.get_articles_title_text_images_all_dates('keyword', dates, max_workers=4)
+
+    assert results['urls'] == urls
+    assert results['titles'] == {dates[0]: ['a1', 'a2', 'a3'], dates[1]: ['b1', 'b2']}
+    assert results['images'][dates[1]] == [['b1.jpg'], ['b2.jpg']]
+
+
+def test_plan_searches_merges_overlapping_windows():
+    dates = [pd.Timestamp('20180301'), pd.Timestamp('20180101'), pd.Timestamp('20181001'), pd.Timestamp('20180201')]
+
+    assert articles.plan_searches(dates) == [[1, 3, 0], [2]]
+
+
+def test_overlapping_dates_share_searches_and_scrapping(monkeypatch):
+    dates = [pd.Timestamp('20180101'), pd.Timestamp('20180201')]
+    docs = [{'web_url': 'jan', 'document_type': 'article', 'pub_date': '2018-01-10T05:00:00+0000'},
+            {'web_url': 'both', 'document_type': 'article', 'pub_date': '2018-02-02T05:00:00+0000'},
+            {'web_url': 'video', 'document_type': 'multimedia', 'pub_date': '2018-02-10T05:00:00+0000'},
+            {'web_url': 'feb', 'document_type': 'article', 'pub_date': '2018-02-20T05:00:00+0000'}]
+    searches, scrapped = [], []
+
+    def fake_search_window(keyword, begin_date, end_date, pages=1):
+        searches.append((begin_date, end_date, pages))
+        return docs, True
+
+    def fake_get_article_title_text_images(url):
+        scrapped.append(url)
+        return [], url, url + ' text'
+
+    monkeypatch.setattr(articles, '_search_window', fake_search_window)
+    monkeypatch.setattr(articles, 'get_article_title_text_images', fake_get_article_title_text_images)
+
+    table = articles.get_article_table('keyword', dates)
+
+    assert searches == [('20171230', '20180303', 1)] #one search for both windows
+    assert table.by_date('url') == {dates[0]: ['jan', 'both'], dates[1]: ['both', 'feb']}
+    assert sorted(scrapped) == ['both', 'feb', 'jan'] #'both' is downloaded once
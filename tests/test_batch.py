@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from huginn import HuginnBatch, interest
+from huginn.anomalies import ewm_std
+
+DATES = pd.date_range('2004-01-01', periods=120, freq='MS')
+
+
+class FakeTrendReq:
+    """Google Trends scales every term of a payload together (the biggest term peaks at 100)"""
+    def __init__(self):
+        self.payloads = []
+
+    def build_payload(self, kw_list, **kwargs):
+        assert len(kw_list) <= 5
+        self.payloads.append(kw_list)
+
+    def interest_over_time(self):
+        raw = {term: _raw_series(term) for term in self.payloads[-1]}
+        peak = max(series.max() for series in raw.values())
+        data = pd.DataFrame({term: series / peak * 100 for term, series in raw.items()}, index=DATES)
+        data['isPartial'] = False
+        return data
+
+
+def _raw_series(term):
+    rng = np.random.default_rng(sum(map(ord, term)))
+    return pd.Series(rng.random(len(DATES)) * (1 + len(term)), index=DATES)
+
+
+def test_huginn_batch(monkeypatch):
+    trends = FakeTrendReq()
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: trends)
+    names = ['entity{}'.format(i) for i in range(7)]
+
+    batch = HuginnBatch(names)
+    anomalies = batch.get_anomalies()
+
+    assert trends.payloads == [names[:5], names[5:]]
+    assert len(batch) == 7
+    for name in names:
+        single = _raw_series(name) / _raw_series(name).max() * 100
+        assert np.allclose(batch[name].interest[name], single)
+        assert anomalies[name].equals(ewm_std(batch[name].interest))
+        assert batch[name].anomalies.equals(anomalies[name])
@@ -0,0 +1,93 @@
+import sqlite3
+import time
+
+import pandas as pd
+import pytest
+
+from huginn import articles
+from huginn.cache import DiskCache, get_cache, configure_cache
+from huginn.exceptions import CacheMissError
+
+
+def test_disk_cache_persists(tmp_path):
+    DiskCache(tmp_path / 'test.sqlite').set(('a', 'b'), [1, 2])
+
+    assert DiskCache(tmp_path / 'test.sqlite').get(('a', 'b')) == [1, 2]
+    assert DiskCache(tmp_path / 'test.sqlite').get('missing', 'default') == 'default'
+
+
+def test_disk_cache_ttl(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / 'test.sqlite', ttl=10)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+
+    now = __import__('time').time()
+    monkeypatch.setattr('huginn.cache.time.time', lambda: now + 11)
+    assert cache.get('key') is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(tmp_path / 'test.sqlite', max_size=2500)
+    cache.set('a', 'x' * 1000)
+    cache.set('b', 'x' * 1000)
+    cache.get('a')
+    cache.set('c', 'x' * 1000)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_disk_cache_counts_hits_and_misses(tmp_path):
+    cache = DiskCache(tmp_path / 'test.sqlite')
+    cache.set('a', 'value')
+    cache.get('a')
+    cache.get('b')
+    assert 'b' not in cache #not counted
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    assert stats['size'] > 0
+
+
+def test_disk_cache_hits_do_not_write(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / 'test.sqlite')
+    cache.set('a', 'value')
+    def accessed():
+        with sqlite3.connect(str(tmp_path / 'test.sqlite')) as connection:
+            return connection.execute('SELECT accessed FROM cache').fetchone()[0]
+    written = accessed()
+
+    now = time.time()
+    monkeypatch.setattr('huginn.cache.time.time', lambda: now + 100)
+    assert cache.get('a') == 'value'
+    assert accessed() == written
+    cache.set('b', 'value') #access times are written with the next set
+    assert accessed() == now + 100
+
+
+def test_disk_cache_keeps_the_total_size(tmp_path):
+    cache = DiskCache(tmp_path / 'test.sqlite', max_size=2500)
+    for key in ['a', 'b', 'a', 'c', 'd']:
+        cache.set(key, 'x' * 1000)
+    with sqlite3.connect(str(tmp_path / 'test.sqlite')) as connection:
+        total = connection.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+    assert cache.stats()['size'] == total <= 2500
+    assert DiskCache(tmp_path / 'test.sqlite').stats()['size'] == total
+
+
+def test_offline_search_uses_cache(monkeypatch):
+    date = pd.Timestamp('20180212')
+    docs = [{'web_url': 'https://www.nytimes.com/a', 'document_type': 'article', 'pub_date': '2018-02-13'},
+            {'web_url': 'https://www.nytimes.com/v', 'document_type': 'multimedia', 'pub_date': '2018-02-14'}]
+    begin_date, end_date = articles._get_search_window(date)
+    get_cache('nyt_search').set(('Point72', begin_date, end_date, articles._get_sections()),
+                                {'docs': docs, 'pages': 1, 'hits': 2})
+    get_cache('articles').set('https://www.nytimes.com/a', ([], 'Title', 'Title. Text'))
+    configure_cache(offline=True)
+
+    assert articles.get_article_urls('Point72', date) == ['https://www.nytimes.com/a']
+    assert articles.get_article_title_text_images('https://www.nytimes.com/a') == ([], 'Title', 'Title. Text')
+    assert articles.get_article_title_text_images('https://www.nytimes.com/b') == (None, None, None)
+    with pytest.raises(CacheMissError):
+        articles.get_article_urls('Point72', pd.Timestamp('20190212'))
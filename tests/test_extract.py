@@ -0,0 +1,58 @@
+import os
+
+from huginn import articles, extract
+from huginn.extract import extract_article
+from tests.standins import FIXTURES
+
+PAGE = b'''<html><head><script>var html = "<article>";</script></head>
+<body><img src="logo.png">
+<article><header><h1>Big <b>news</b></h1></header><img src="a.jpg">
+<section><p>First.</p><div><p>Second &amp; more</p></div></section></article>
+<footer><p>not in the article</p></footer></body></html>'''
+
+
+def test_extract_article():
+    assert extract_article(PAGE) == (['a.jpg'], 'Big news', 'Big news. First. Second & more', None)
+
+    blog = b'<article><header><h1>T</h1></header><div class="post entry-content"><p>blog</p></div></article>'
+    assert extract_article(blog) == ([], 'T', 'T. blog', None)
+
+
+def test_extract_article_failures():
+    assert extract_article(b'<html><body><p>no article</p></body></html>').error == extract.NO_ARTICLE
+    assert extract_article(b'<article><h1>T</h1><section><p>p</p></section></article>').error == extract.NO_TITLE
+    assert extract_article(b'<article><header><h1>T</h1></header><p>p</p></article>').error == extract.NO_PARAGRAPHS
+    assert extract_article(b'').error == extract.PARSE_ERROR
+
+
+def test_extract_article_ignores_headers_around_the_article():
+    page = b'''<body><header><article><h1>Not a title</h1><header><h1>Title</h1></header>
+    <section><p>p</p></section></article></header></body>'''
+    assert extract_article(page) == ([], 'Title', 'Title. p', None)
+
+    page = b'<body><header><article><h1>Not a title</h1><section><p>p</p></section></article></header></body>'
+    assert extract_article(page).error == extract.NO_TITLE
+
+
+def test_extract_fixtures():
+    for name in ['nyt_article.html', 'nyt_blog.html']:
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            extraction = extract_article(f.read())
+        assert extraction.error is None
+        assert extraction.text.startswith(extraction.title + '. The company said')
+        assert len(extraction.images) == 1 #only the image of the article, not the logo of the page
+
+
+def test_scrape_article_reports_http_errors(monkeypatch):
+    class FakeResponse:
+        status_code = 404
+        content = b''
+
+    class FakeSession:
+        def get(self, url, timeout=None):
+            return FakeResponse()
+
+    monkeypatch.setattr(articles, 'get_session', lambda: FakeSession())
+
+    assert articles.scrape_article('https://www.nytimes.com/missing').error == extract.HTTP_ERROR
+    assert articles.get_article_title_text_images('https://www.nytimes.com/missing') == (None, None, None)
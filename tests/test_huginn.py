@@ -1,25 +1,76 @@
-import time
-
+import numpy as np
 import pytest
 import pandas as pd
 
+from huginn import articles, interest, huginn, LDA, summarizer, archive
+from huginn.article_table import ArticleTable
+from huginn.exceptions import ArchiveError
 from huginn.huginn import Huginn
+from huginn.scheduler import configure_scheduler, PER_MINUTE, PER_DAY
+from tests.standins import StandInTrendReq, StandInServer
 
 @pytest.fixture
-def point72():
+def point72(monkeypatch):
+    """Huginn object whose Google Trends and NYT calls go to local stand-ins (see tests/standins.py)"""
     key_word = "Point72"
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: StandInTrendReq())
+    monkeypatch.setenv('NYT_API_KEY', 'test')
+
+    with StandInServer() as server:
+        monkeypatch.setattr(articles, 'NYT_API_URL', server.search_url)
+        configure_scheduler(per_minute=10 ** 6, per_day=10 ** 9)
+        try:
+            cl = Huginn(key_word, mid=False)
+            cl.get_anomalies()
+            yield cl
+        finally:
+            configure_scheduler(per_minute=PER_MINUTE, per_day=PER_DAY)
+
+
+class FakeSummarizer:
+    def __call__(self, sentences, min_length, max_length):
+        return [{'summary_text': sentence.upper()} for sentence in sentences]
 
-    cl = Huginn(key_word)
-    cl.get_anomalies()
 
-    return cl
+def article_texts(date):
+    return ['{} article {} é'.format(date.date(), i) for i in range(2)]
+
+
+@pytest.fixture
+def stand_ins(monkeypatch):
+    """Articles, LDA and summarization replaced by stand-ins
+    :returns a dictionary: 'fetched' and 'lda' are the lists of dates given to each call of get_article_table and run_lda_table
+    """
+    calls = {'fetched': [], 'lda': []}
+    def fake_get_article_table(keyword, anomalies, num_links, max_workers=None):
+        calls['fetched'].append(list(anomalies))
+        texts = [article_texts(date) for date in anomalies]
+        return ArticleTable.from_scrapped(anomalies, texts, [[(['img'], 'title', text) for text in day] for day in texts])
+
+    def fake_run_lda_table(table, n_components, **kwargs):
+        calls['lda'].append(list(table.dates))
+        return {date: {0: table.rows(i)} for i, date in enumerate(table.dates)}
+
+    monkeypatch.setattr(huginn, 'get_article_table', fake_get_article_table)
+    monkeypatch.setattr(LDA, 'run_lda_table', fake_run_lda_table)
+    monkeypatch.setattr(summarizer, '_load_pipeline', lambda model: FakeSummarizer())
+    summarizer.release_summarizers()
+    return calls
+
+
+@pytest.fixture
+def entity(stand_ins):
+    """Huginn object of a synthetic interest with 5 clear anomalies, whose later stages are stand-ins"""
+    dates = pd.date_range('2010-01-01', periods=60, freq='MS')
+    values = np.random.default_rng(0).random(60) * 10
+    values[[10, 20, 30, 40, 50]] = [100, 90, 80, 70, 60]
+    return Huginn('entity', mid='/m/0abc', interest=pd.DataFrame({'entity': values}, index=dates))
 
 
 def test_get_text(point72):
-    time.sleep(45)
-    point72.get_text()
+    point72.get_articles_info()
 
-    text = point72.text
+    text = point72.articles
 
     assert type(text) == dict
 
@@ -30,3 +81,71 @@ def test_get_text(point72):
         assert type(text) == list
 
 
+
+def test_pipeline_only_processes_new_dates(entity, stand_ins):
+    with pytest.raises(AttributeError):
+        entity.get_articles_info()
+    first = entity.get_anomalies(top_k=3)
+    assert not hasattr(entity, 'articles')
+    entity.get_articles_info()
+    summaries = entity.get_local_summaries()
+    assert len(summaries) == 3
+
+    second = entity.get_anomalies(top_k=5)
+    new_dates = [date for date in second if date not in first]
+    assert len(entity.articles) == 5 #fetched on access
+    assert stand_ins['fetched'] == [list(first), new_dates]
+    assert len(entity.summary_by_anomalies_by_topics) == 5
+    assert stand_ins['lda'] == [list(first), new_dates]
+    assert entity.summary_by_anomalies_by_topics[new_dates[0].strftime('%m-%Y')][0] == \
+        ' '.join(article_texts(new_dates[0])).upper()
+
+    entity.get_anomalies(top_k=3) #back to the first anomalies: nothing is processed again
+    assert list(entity.article_table.dates) == list(first)
+    assert len(entity.summary_by_anomalies_by_topics) == 3
+    assert len(stand_ins['fetched']) == 2 and len(stand_ins['lda']) == 2
+
+
+def test_save_and_load(entity, monkeypatch, tmp_path):
+    entity.get_anomalies(top_k=5)
+    entity.get_articles_info()
+    entity.get_anomalies(top_k=3) #articles of 5 dates are stored, 3 are current
+    summaries = entity.get_local_summaries()
+    entity.save(str(tmp_path / 'entity.huginn'))
+
+    monkeypatch.setattr(huginn, 'get_article_table', None) #nothing is fetched again
+    loaded = Huginn.load(str(tmp_path / 'entity.huginn'))
+    assert loaded.name == 'entity'
+    pd.testing.assert_frame_equal(loaded.interest, entity.interest, check_freq=False)
+    assert list(loaded.anomalies) == list(entity.anomalies)
+    pd.testing.assert_series_equal(loaded.anomaly_scores, entity.anomaly_scores, check_freq=False)
+
+    text = loaded.article_table.text
+    assert isinstance(text.data, archive.CompressedBuffer) and not text.data._blocks #texts are read on access
+    assert loaded.urls == entity.urls and loaded.images == entity.images
+    assert loaded.articles == entity.articles
+    assert loaded.summary_by_anomalies_by_topics == summaries
+
+    loaded.get_anomalies(top_k=5) #dates saved but not current are reused too
+    assert loaded.articles == {date: article_texts(date) for date in loaded.anomalies}
+
+    (tmp_path / 'other').write_bytes(b'not a zip')
+    with pytest.raises(ArchiveError):
+        Huginn.load(str(tmp_path / 'other'))
+
+
+def test_memmap_tables_are_written_to_new_directories(entity, tmp_path):
+    entity.get_anomalies(top_k=3)
+    first = entity.get_articles_info(memmap=str(tmp_path / 'articles'))
+    texts = first.by_date('text')
+    assert isinstance(first.text.data, np.memmap)
+
+    entity.get_anomalies(top_k=5)
+    second = entity.article_table
+    assert isinstance(second.text.data, np.memmap)
+    assert first.by_date('text') == texts #the previous table is still readable
+    assert len(second) == 10
+
+    in_memory = entity.get_articles_info(memmap=None) #the storage mode is part of the key of the table
+    assert not isinstance(in_memory.text.data, np.memmap)
+    assert in_memory.by_date('text') == second.by_date('text')
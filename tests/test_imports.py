@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ['torch', 'transformers', 'spacy', 'gensim', 'plotly', 'matplotlib', 'sklearn']
+
+
+def test_import_huginn_does_not_load_heavy_backends():
+    code = ("import sys, huginn; "
+            "print(','.join(m for m in {} if m in sys.modules))".format(HEAVY_MODULES))
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True)
+    assert out.stdout.decode().strip() == ''
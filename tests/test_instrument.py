@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from huginn import articles, instrument
+from huginn.cache import get_cache
+from huginn.instrument import Metrics, add_sink, remove_sink, count, span
+
+
+@pytest.fixture
+def events():
+    received = []
+    sink = add_sink(received.append)
+    yield received
+    remove_sink(sink)
+
+
+def test_metrics_aggregate_counters_and_spans():
+    metrics = Metrics()
+    sink = add_sink(metrics)
+    try:
+        count('requests', service='nyt')
+        count('requests', service='nyt')
+        count('bytes', 100, service='nyt')
+        count('requests', service='google_trends')
+        with span('search', keyword='point72'):
+            pass
+        with span('search', keyword='point72'):
+            pass
+    finally:
+        remove_sink(sink)
+    count('requests', service='nyt') #not received anymore
+
+    assert metrics.counter('requests') == 3
+    assert metrics.counter('requests', service='nyt') == 2
+    assert metrics.counter('bytes') == 100
+    assert metrics.spans[('search', (('keyword', 'point72'),))][0] == 2
+
+    text = metrics.prometheus_text()
+    assert '# TYPE huginn_requests_total counter' in text
+    assert 'huginn_requests_total{service="nyt"} 2' in text
+    assert 'huginn_search_seconds_count{keyword="point72"} 2' in text
+
+
+def test_span_is_emitted_on_error(events):
+    with pytest.raises(ValueError):
+        with span('lda'):
+            raise ValueError()
+    assert [(event.kind, event.name) for event in events] == [(instrument.SPAN, 'lda')]
+
+
+def test_progress_event_when_no_article_is_found(monkeypatch, events):
+    monkeypatch.setattr(articles, 'get_article_urls_all_dates', lambda *args, **kwargs: [[], ['url']])
+    monkeypatch.setattr(articles, 'get_article_title_text_images', lambda url: (['image'], 'title', 'text'))
+    dates = pd.to_datetime(['2018-01-01', '2018-02-01'])
+
+    table = articles.get_article_table('point72', dates)
+
+    assert len(table) == 1
+    messages = [event for event in events if event.kind == instrument.PROGRESS]
+    assert [event.labels['found'] for event in messages] == [0, 1]
+    assert messages[0].value == 'anomaly n°1: 0 articles were found and 0% were retrieved'
+    assert messages[1].value == 'anomaly n°2: 1 articles were found and 100% were retrieved'
+    assert {event.name for event in events if event.kind == instrument.SPAN} == {'search', 'scrape'}
+
+
+def test_cache_hits_and_misses_are_counted(events):
+    cache = get_cache('articles')
+    cache.get('missing')
+    cache.set('key', 'value')
+    cache.get('key')
+    assert [(event.name, event.labels) for event in events] == [('cache_misses', {'cache': 'articles'}),
+                                                               ('cache_hits', {'cache': 'articles'})]
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from huginn import cache, interest
+from huginn.exceptions import CacheMissError
+from huginn.interest_store import InterestStore
+
+MONTHS = pd.date_range('2004-01-01', '2020-06-01', freq='MS')
+TRUE_INTEREST = pd.Series(np.random.default_rng(0).random(len(MONTHS)) * 50 + 10, index=MONTHS)
+
+
+class FakeTrendReq:
+    """Google Trends: monthly points for 'all', weekly points for shorter timeframes, each call scaled to peak at 100"""
+    def __init__(self, last_month):
+        self.last_month = pd.Timestamp(last_month)
+        self.timeframes = []
+
+    def build_payload(self, kw_list, timeframe='all', **kwargs):
+        self.terms, self.timeframe = kw_list, timeframe
+        self.timeframes.append(timeframe)
+
+    def interest_over_time(self):
+        series = TRUE_INTEREST[:self.last_month]
+        if self.timeframe != 'all':
+            start = pd.Timestamp(self.timeframe.split(' ')[0])
+            weeks = pd.date_range(start, self.last_month + pd.DateOffset(days=27), freq='7D')
+            series = series.reindex(weeks, method='ffill')
+        data = pd.DataFrame({term: series / series.max() * 100 for term in self.terms})
+        data['isPartial'] = [False] * (len(data) - 1) + [True]
+        return data
+
+
+def test_get_interest_appends_new_months(monkeypatch):
+    trends = FakeTrendReq('2019-12-01')
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: trends)
+
+    first = interest.get_interest('Point72')
+    assert trends.timeframes == ['all']
+    assert first.index[-1] == pd.Timestamp('2019-12-01')
+    assert interest.get_interest('Point72').equals(first) #fresh: no call
+    assert len(trends.timeframes) == 1
+
+    trends.last_month = pd.Timestamp('2020-06-01')
+    now = interest.time.time()
+    monkeypatch.setattr(interest.time, 'time', lambda: now + interest.REFRESH_AFTER + 1)
+    refreshed = interest.get_interest('Point72')
+
+    assert trends.timeframes[1] == '2019-09-01 ' + pd.Timestamp.today().strftime('%Y-%m-%d')
+    assert refreshed.index[-1] == pd.Timestamp('2020-06-01')
+    expected = TRUE_INTEREST / TRUE_INTEREST.max() * 100
+    assert np.allclose(refreshed['Point72'].values, expected.values)
+
+
+class EmptyTrendReq:
+    """Google Trends without any data for the terms"""
+    def __init__(self):
+        self.timeframes = []
+
+    def build_payload(self, kw_list, timeframe='all', **kwargs):
+        self.timeframes.append(timeframe)
+
+    def interest_over_time(self):
+        return pd.DataFrame()
+
+
+def test_stale_interest_without_data(monkeypatch):
+    trends = EmptyTrendReq()
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: trends)
+    assert len(interest.get_interest('nobody')) == 0
+
+    now = interest.time.time()
+    monkeypatch.setattr(interest.time, 'time', lambda: now + interest.REFRESH_AFTER + 1)
+    assert len(interest.get_interest('nobody')) == 0
+    assert trends.timeframes == ['all', 'all'] #refetched from the start
+
+
+def test_interest_store_persists(tmp_path):
+    store = InterestStore(tmp_path / 'interest.npz')
+    store.put(('a', '', 'news', ''), TRUE_INTEREST[:10], partial=False)
+    store.put(('b', '/m/0abc', 'news', 'US'), TRUE_INTEREST[5:20], partial=True)
+    store.save()
+
+    loaded = InterestStore(tmp_path / 'interest.npz')
+    frame = loaded.frame([('a', '', 'news', ''), ('b', '/m/0abc', 'news', 'US')])
+    assert list(frame.columns) == ['a', 'b']
+    assert len(frame) == 20
+    assert loaded.get(('b', '/m/0abc', 'news', 'US'))[1] is True
+    assert np.allclose(frame['b'].dropna().values, TRUE_INTEREST[5:20].values)
+
+
+def test_interest_store_merges_concurrent_saves(tmp_path):
+    first, second = InterestStore(tmp_path / 'interest.npz'), InterestStore(tmp_path / 'interest.npz')
+    first.put(('a', '', 'news', ''), TRUE_INTEREST[:10], partial=False, fetched=1.)
+    second.put(('a', '', 'news', ''), TRUE_INTEREST[:12], partial=False, fetched=2.)
+    second.put(('b', '', 'news', ''), TRUE_INTEREST[:5], partial=False)
+    second.save()
+    first.put(('c', '', 'news', ''), TRUE_INTEREST[:3], partial=False)
+    first.save() #as if saved by another process: the series saved by second are kept
+
+    loaded = InterestStore(tmp_path / 'interest.npz')
+    assert sorted(loaded.keys()) == [('a', '', 'news', ''), ('b', '', 'news', ''), ('c', '', 'news', '')]
+    assert len(loaded.get(('a', '', 'news', ''))[0]) == 12 #the most recent fetch
+
+
+def test_get_interest_offline():
+    cache.configure_cache(offline=True)
+    with pytest.raises(CacheMissError):
+        interest.get_interest('Point72')
+
+
+class FakeSuggestions:
+    def __init__(self):
+        self.calls = 0
+
+    def suggestions(self, keyword):
+        self.calls += 1
+        return [{'mid': '/m/fruit', 'title': 'Apple', 'type': 'Fruit'},
+                {'mid': '/m/company', 'title': 'Apple', 'type': 'Technology company'}]
+
+
+def test_resolve_mid_is_cached(monkeypatch):
+    trends = FakeSuggestions()
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: trends)
+
+    assert interest.resolve_mid('Apple', policy=interest.prefer_type('Company')) == '/m/company'
+    assert interest.resolve_mid('Apple', policy=interest.first_suggestion) == '/m/company' #saved in the map
+    assert interest.get_suggestions('Apple')[0]['mid'] == '/m/fruit'
+    assert trends.calls == 1
+
+    cache.configure_cache(offline=True)
+    assert interest.resolve_mid('Apple') == '/m/company'
+    with pytest.raises(CacheMissError):
+        interest.resolve_mid('Banana', policy=interest.first_suggestion)
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from huginn import LDA
+from huginn.cache import get_cache_dir
+
+
+class FakeToken:
+    def __init__(self, word):
+        self.lemma_ = word.rstrip('s') #'cats' -> 'cat'
+        self.pos_ = 'NOUN'
+
+
+class FakeNlp:
+    """spacy stand-in counting the documents it processes"""
+    def __init__(self):
+        self.documents = 0
+
+    def pipe(self, texts, batch_size=None, n_process=None):
+        for text in texts:
+            self.documents += 1
+            yield [FakeToken(word) for word in text.split()]
+
+
+ARTICLES = {pd.Timestamp('20190101'): ['cats eat fish daily', 'cats sleep often', 'markets fell sharply today',
+                                       'markets rallied after earnings'],
+            pd.Timestamp('20190201'): ['stocks fell', 'stocks rose', 'cats purr']}
+
+
+def test_lemmas_feed_vectorizer_and_are_cached(monkeypatch):
+    nlp = FakeNlp()
+    monkeypatch.setattr(LDA, 'get_nlp', lambda: nlp)
+
+    lemmas = LDA.lemmatize_articles(ARTICLES[pd.Timestamp('20190101')])
+    data, vectorizer = LDA.preprocess(lemmas)
+
+    assert lemmas[0] == 'cat eat fish daily'
+    assert 'cat' in vectorizer.vocabulary_ and 'cats' not in vectorizer.vocabulary_
+    assert data.shape[0] == 4
+    assert nlp.documents == 4
+
+    topics = LDA.run_lda(ARTICLES, n_components=2)
+    assert nlp.documents == 7 #only the 3 new articles were lemmatized
+    for date, articles in ARTICLES.items():
+        ids = sorted(i for topic_ids in topics[date].values() for i in topic_ids)
+        assert ids == list(range(len(articles)))
+
+
+def test_former_signatures_lemmatize_with_nlp():
+    sentences = ARTICLES[pd.Timestamp('20190101')]
+    with pytest.deprecated_call():
+        data, vectorizer = LDA.preprocess(sentences, FakeNlp())
+    assert 'cat' in vectorizer.vocabulary_ and 'cats' not in vectorizer.vocabulary_
+    assert data.shape[0] == 4
+
+    with pytest.deprecated_call():
+        topics = LDA.run_lda_once(sentences, FakeNlp(), 2)
+    expected = LDA.run_lda_once(LDA.lemmatization(list(LDA.sent_to_words(sentences)), FakeNlp()), 2)
+    assert {topic: ids.tolist() for topic, ids in topics.items()} == {topic: ids.tolist() for topic, ids in expected.items()}
+
+
+def test_topic_partition():
+    doc_topic = np.array([[0.9, 0.1, 0.0], [0.2, 0.7, 0.1], [0.1, 0.8, 0.1], [0.6, 0.3, 0.1], [0.1, 0.2, 0.7],
+                          [0.3, 0.6, 0.1]])
+    partition = LDA.topic_partition(doc_topic)
+
+    assert list(partition) == [1, 0, 2] #biggest topics first
+    assert partition[1].tolist() == [1, 2, 5]
+    assert partition[0].tolist() == [0, 3]
+    assert partition[2].tolist() == [4]
+
+
+def test_run_lda_in_parallel(monkeypatch):
+    monkeypatch.setattr(LDA, 'get_nlp', lambda: FakeNlp())
+    serial = LDA.run_lda(ARTICLES, n_components=2)
+    parallel = LDA.run_lda(ARTICLES, n_components=2, n_jobs=2)
+
+    for date in ARTICLES:
+        assert {t: ids.tolist() for t, ids in serial[date].items()} == {t: ids.tolist() for t, ids in parallel[date].items()}
+
+
+def test_shared_lda_is_persisted_and_incremental(monkeypatch):
+    monkeypatch.setattr(LDA, 'get_nlp', lambda: FakeNlp())
+    first = {date: ARTICLES[date] for date in list(ARTICLES)[:1]}
+    topics = LDA.run_lda(first, n_components=2, shared=True, entity='cats')
+    corpus = LDA.load_corpus_lda('cats', 2)
+    vocabulary = dict(corpus.vectorizer.vocabulary_)
+    assert len(corpus) == 4 and corpus.matrix.shape[0] == 4
+
+    topics = LDA.run_lda(ARTICLES, n_components=2, shared=True, entity='cats')
+    corpus = LDA.load_corpus_lda('cats', 2)
+    assert len(corpus) == 7 and corpus.matrix.shape[0] == 7 #only the new articles were added
+    assert corpus.vectorizer.vocabulary_ == vocabulary #the vocabulary is fitted once
+    for date, articles in ARTICLES.items():
+        ids = sorted(i for topic_ids in topics[date].values() for i in topic_ids)
+        assert ids == list(range(len(articles)))
+
+
+def test_shared_lda_has_its_own_file_and_keeps_recent_articles(monkeypatch):
+    monkeypatch.setattr(LDA, 'get_nlp', lambda: FakeNlp())
+    LDA.run_lda(ARTICLES, n_components=2, shared=True, entity='cats')
+    assert [path.suffix for path in (get_cache_dir() / LDA.MODELS_DIR).iterdir()] == ['.pkl'] #not in a sqlite cache
+
+    corpus = LDA.CorpusLDA(2, max_articles=3)
+    first = LDA.lemmatize_articles(ARTICLES[pd.Timestamp('20190101')])
+    corpus.add(first)
+    rows = corpus.add(first[:1] + ['stock fell', 'stock rose'])
+    assert len(corpus) == corpus.matrix.shape[0] == 3
+    assert sorted(rows.tolist()) == [0, 1, 2] #the articles of the last batch are kept
+    assert corpus.partition(rows)
+
+
+def test_run_lda_table_returns_rows(monkeypatch):
+    from huginn.article_table import ArticleTable
+    monkeypatch.setattr(LDA, 'get_nlp', lambda: FakeNlp())
+    dates = list(ARTICLES)
+    table = ArticleTable.from_scrapped(dates, [list(ARTICLES[date]) for date in dates],
+                                       [[([], text, text) for text in ARTICLES[date]] for date in dates])
+
+    by_date = LDA.run_lda(ARTICLES, n_components=2)
+    by_row = LDA.run_lda_table(table, n_components=2)
+
+    for i, date in enumerate(dates):
+        assert {t: (ids + table.offsets[i]).tolist() for t, ids in by_date[date].items()} == \
+               {t: ids.tolist() for t, ids in by_row[date].items()}
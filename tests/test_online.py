@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from huginn import anomalies
+from huginn.online import OnlineDetector
+
+DATES = pd.date_range('2004-01-01', periods=150, freq='MS')
+
+
+@pytest.mark.parametrize('method, params', [('ewm', {}), ('ewm', {'halflife_mean': 3, 'halflife_std': 5}),
+                                            ('rolling', {}), ('rolling', {'lookback_mean': 2, 'lookback_std': 6})])
+def test_online_matches_batch(method, params):
+    rng = np.random.default_rng(1)
+    values = rng.random(len(DATES)) * 100
+    values[:20] = 0
+    data = pd.DataFrame({'entity': values}, index=DATES)
+
+    detector = OnlineDetector(method, k=1, **params)
+    scores, events = [], []
+    for date, value in zip(DATES, values):
+        scores.append(detector.score('entity', value))
+        event = detector.update('entity', value, date)
+        if event is not None:
+            events.append(event)
+
+    expected_scores = anomalies._scores(values[np.newaxis, :], method, **params)[0]
+    assert np.allclose(scores, expected_scores, equal_nan=True)
+    flagged = pd.Series([e.score for e in events], index=[e.date for e in events])
+    expected = anomalies.detect_anomalies(data, method, top_k=None, **params)['entity']
+    assert flagged.index.equals(expected.index)
+    top = flagged.sort_values(ascending=False)[:10].index.sort_values()
+    assert top.equals(anomalies.get_anomalies(data, method, **params)['entity'])
+
+
+def test_snapshot_restore():
+    values = np.random.default_rng(2).random(100) * 100
+    detector = OnlineDetector('ewm')
+    for value in values[:60]:
+        detector.update('a', value)
+    restored = OnlineDetector.restore(json.loads(json.dumps(detector.snapshot())))
+
+    for value in values[60:]:
+        assert detector.update('a', value) == restored.update('a', value)
@@ -0,0 +1,121 @@
+import json
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from huginn import huginn, interest
+from huginn.article_table import ArticleTable
+from huginn.cli import main
+from huginn.exceptions import NytQuotaError
+from huginn.runner import run_batch, read_entities, Checkpoint, stage_keys, DEFAULT_OPTIONS, QUOTA_EXHAUSTED
+from huginn.scheduler import get_scheduler, configure_scheduler, PER_MINUTE, PER_DAY
+from tests.standins import StandInTrendReq
+
+@pytest.fixture
+def entity_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: StandInTrendReq())
+    path = tmp_path / 'entities.txt'
+    path.write_text('# entities\nPoint72\nCitadel\t/m/0abc\n\nBridgewater\n', encoding='utf-8')
+    return str(path)
+
+
+def test_read_entities(entity_file):
+    assert read_entities(entity_file) == [('Point72', None), ('Citadel', '/m/0abc'), ('Bridgewater', None)]
+
+
+def test_cli_resumes_after_quota_exhaustion(entity_file, tmp_path, monkeypatch):
+    fetched, exhausted = [], ['Citadel'] #the quota is exhausted once, when Citadel is searched
+    def fake_get_article_table(keyword, anomalies, num_links, max_workers=None):
+        if keyword in exhausted:
+            exhausted.remove(keyword)
+            raise NytQuotaError('NYT daily quota exhausted')
+        fetched.append(keyword)
+        urls = [['{}/{}'.format(keyword, date.date())] for date in anomalies]
+        return ArticleTable.from_scrapped(anomalies, urls, [[([], 'title', 'text')] for _ in anomalies])
+    monkeypatch.setattr(huginn, 'get_article_table', fake_get_article_table)
+
+    arguments = ['run', entity_file, '-o', str(tmp_path / 'results.jsonl'), '--checkpoints', str(tmp_path / 'checkpoints'),
+                 '--stage', 'articles', '--processes', '0']
+    result = CliRunner().invoke(main, arguments)
+    assert result.exit_code == 1
+    records = [json.loads(line) for line in open(str(tmp_path / 'results.jsonl'))]
+    assert [(record['entity'], record['status']) for record in records] == [('Point72', 'ok'),
+                                                                           ('Citadel', 'quota_exhausted')]
+
+    result = CliRunner().invoke(main, arguments)
+    assert result.exit_code == 0
+    assert fetched == ['Point72', 'Citadel', 'Bridgewater'] #Point72 was not fetched again
+    records = [json.loads(line) for line in open(str(tmp_path / 'results.jsonl'))]
+    assert [record['entity'] for record in records] == ['Point72', 'Citadel', 'Bridgewater']
+    for record in records:
+        assert record['mid'] == ('/m/0abc' if record['entity'] == 'Citadel' else None)
+        assert len(record['articles']) == len(record['anomalies']) > 0
+        for date, links in record['articles'].items():
+            assert links == [{'url': '{}/{}'.format(record['entity'], date), 'title': 'title'}]
+
+
+def test_run_batch_in_process_pool(entity_file, tmp_path):
+    entities = read_entities(entity_file)
+    options = dict(DEFAULT_OPTIONS, stages=['interest', 'anomalies'])
+    records = list(run_batch(entities, str(tmp_path), options, processes=2))
+
+    assert sorted(record['entity'] for record in records) == ['Bridgewater', 'Citadel', 'Point72']
+    assert all(record['status'] == 'ok' and record['anomalies'] for record in records)
+    assert all(Checkpoint(str(tmp_path), entity).has('anomalies', stage_keys(options, mid)['anomalies'])
+               for entity, mid in entities)
+
+
+def test_interest_is_fetched_again_after_the_refresh_period(entity_file, tmp_path, monkeypatch):
+    trends = StandInTrendReq()
+    monkeypatch.setattr(interest, 'get_pytrend', lambda: trends)
+    entities = read_entities(entity_file)
+    options = dict(DEFAULT_OPTIONS, stages=['interest', 'anomalies'])
+
+    assert all(record['status'] == 'ok' for record in run_batch(entities, str(tmp_path), options, processes=0))
+    calls = trends.calls
+    list(run_batch(entities, str(tmp_path), options, processes=0))
+    assert trends.calls == calls #same period: the checkpoints are reused
+
+    later = time.time() + interest.REFRESH_AFTER + 1
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert all(record['status'] == 'ok' for record in run_batch(entities, str(tmp_path), options, processes=0))
+    assert trends.calls > calls #refreshed
+    assert all(Checkpoint(str(tmp_path), entity).has('interest', stage_keys(options, mid)['interest'])
+               for entity, mid in entities)
+
+
+def test_stage_keys_depend_on_the_mid():
+    assert stage_keys(DEFAULT_OPTIONS)['interest'] != stage_keys(DEFAULT_OPTIONS, '/m/0abc')['interest']
+    assert stage_keys(DEFAULT_OPTIONS)['summaries'] != stage_keys(DEFAULT_OPTIONS, '/m/0abc')['summaries']
+
+
+def test_processes_share_the_nyt_daily_quota(entity_file, tmp_path, monkeypatch):
+    def fake_get_article_table(keyword, anomalies, num_links, max_workers=None):
+        get_scheduler()._acquire() #one NYT call per entity
+        return ArticleTable.from_scrapped(anomalies, [[] for _ in anomalies], [[] for _ in anomalies])
+    monkeypatch.setattr(huginn, 'get_article_table', fake_get_article_table)
+    entities = read_entities(entity_file)
+    options = dict(DEFAULT_OPTIONS, stages=['interest', 'anomalies', 'articles'])
+
+    configure_scheduler(per_minute=10 ** 6, per_day=2)
+    try:
+        records = list(run_batch(entities, str(tmp_path), options, processes=3, nyt_concurrency=3))
+        statuses = sorted(record['status'] for record in records)
+        assert statuses == ['ok', 'ok', QUOTA_EXHAUSTED] #2 calls for the 3 processes
+
+        #the quota is still exhausted when the run is resumed (the 2 other entities are read from their checkpoints)
+        configure_scheduler(per_minute=10 ** 6, per_day=2)
+        records = list(run_batch(entities, str(tmp_path), options, processes=3, nyt_concurrency=3))
+        assert sorted(record['status'] for record in records) == statuses
+    finally:
+        configure_scheduler(per_minute=PER_MINUTE, per_day=PER_DAY)
+
+
+@pytest.mark.parametrize('num_links', ['abc', '0', '-3'])
+def test_cli_rejects_invalid_num_links(entity_file, tmp_path, num_links):
+    checkpoints = tmp_path / 'checkpoints'
+    result = CliRunner().invoke(main, ['run', entity_file, '--checkpoints', str(checkpoints), '--num-links', num_links])
+    assert result.exit_code == 2 #usage error, nothing is run
+    assert "is not 'all' or a positive integer" in result.output
+    assert not checkpoints.exists()
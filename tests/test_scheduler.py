@@ -0,0 +1,128 @@
+import pandas as pd
+import pytest
+
+from huginn import articles, scheduler
+from huginn.exceptions import NytApiError, NytQuotaError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, json=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._json = json or {}
+        self.content = b'{}'
+
+    def json(self):
+        return self._json
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return self.responses.pop(0)
+
+
+def test_scheduler_enforces_per_minute_limit(monkeypatch):
+    clock = FakeClock()
+    session = FakeSession([FakeResponse(200)] * 4)
+    monkeypatch.setattr(scheduler, 'get_session', lambda: session)
+    nyt = scheduler.NytScheduler(per_minute=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(4):
+        nyt.get('url')
+
+    assert clock.now == pytest.approx(60.)
+
+
+def test_scheduler_retries_then_fails(monkeypatch):
+    clock = FakeClock()
+    session = FakeSession([FakeResponse(429), FakeResponse(503), FakeResponse(200)])
+    monkeypatch.setattr(scheduler, 'get_session', lambda: session)
+    nyt = scheduler.NytScheduler(max_retries=2, clock=clock, sleep=clock.sleep)
+    assert nyt.get('url').status_code == 200
+
+    session = FakeSession([FakeResponse(500)] * 3)
+    monkeypatch.setattr(scheduler, 'get_session', lambda: session)
+    with pytest.raises(NytApiError):
+        nyt.get('url')
+
+
+def test_scheduler_daily_quota(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, 'get_session', lambda: FakeSession([FakeResponse(200)]))
+    nyt = scheduler.NytScheduler(per_day=1, clock=clock, sleep=clock.sleep)
+    nyt.get('url')
+    with pytest.raises(NytQuotaError):
+        nyt.get('url')
+
+
+def test_daily_quota_is_kept_after_a_restart(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / 'quota.json')
+    bucket = scheduler.PersistentTokenBucket(path, 2, 24 * 3600., clock=clock)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+
+    clock.now += 60
+    restarted = scheduler.PersistentTokenBucket(path, 2, 24 * 3600., clock=clock)
+    assert restarted.try_acquire() > 0 #not refilled by the restart
+    clock.now += 12 * 3600
+    assert scheduler.PersistentTokenBucket(path, 2, 24 * 3600., clock=clock).try_acquire() == 0
+
+
+def test_get_article_urls_follows_pages(monkeypatch):
+    def page(start, n):
+        return FakeResponse(200, {'response': {
+            'meta': {'hits': 25},
+            'docs': [{'web_url': 'https://www.nytimes.com/{}'.format(i), 'document_type': 'article',
+                      'pub_date': '2018-02-13'} for i in range(start, start + n)]}})
+
+    session = FakeSession([page(0, 10), page(10, 10), page(20, 5)])
+    monkeypatch.setattr(scheduler, 'get_session', lambda: session)
+    monkeypatch.setattr(articles, 'get_api_key', lambda: 'key')
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, '_scheduler', scheduler.NytScheduler(clock=clock, sleep=clock.sleep))
+
+    urls = articles.get_article_urls('Point72', pd.Timestamp('20180212'), num_links=15)
+    assert len(urls) == 15
+    assert 'page=1' in session.urls[-1]
+
+    urls = articles.get_article_urls('Point72', pd.Timestamp('20180212'), num_links=40)
+    assert len(urls) == 25
+    assert len(session.urls) == 3
+
+
+def test_get_article_urls_same_links_from_cache(monkeypatch):
+    def page(start, n):
+        return FakeResponse(200, {'response': {
+            'meta': {'hits': 22},
+            'docs': [{'web_url': 'https://www.nytimes.com/{}'.format(i),
+                      'document_type': 'multimedia' if i % 3 == 0 else 'article',
+                      'pub_date': '2018-02-13'} for i in range(start, start + n)]}})
+
+    session = FakeSession([page(0, 10), page(10, 10), page(20, 2)])
+    monkeypatch.setattr(scheduler, 'get_session', lambda: session)
+    monkeypatch.setattr(articles, 'get_api_key', lambda: 'key')
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, '_scheduler', scheduler.NytScheduler(clock=clock, sleep=clock.sleep))
+
+    cold = articles.get_article_urls('Point72', pd.Timestamp('20180212'), num_links=15)
+    warm = articles.get_article_urls('Point72', pd.Timestamp('20180212'), num_links=15)
+    assert len(cold) == 14 #every article of the 22 documents
+    assert warm == cold
+    assert len(session.urls) == 3
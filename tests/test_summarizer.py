@@ -0,0 +1,145 @@
+import pandas as pd
+
+from huginn import summarizer
+from huginn.cache import get_cache
+
+
+class FakeSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, sentences, min_length, max_length):
+        self.calls.append(list(sentences))
+        return [{'summary_text': sentence.upper()} for sentence in sentences]
+
+
+def _fake_loader(loaded):
+    def load(model):
+        loaded.append(model)
+        return FakeSummarizer()
+    return load
+
+
+def test_get_summarizer_loads_once(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(summarizer, '_load_pipeline', _fake_loader(loaded))
+    summarizer.release_summarizers()
+
+    first = summarizer.get_summarizer()
+    second = summarizer.get_summarizer()
+
+    assert first is second
+    assert loaded == [None]
+
+
+def test_get_summarizer_evicts_least_recently_used(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(summarizer, '_load_pipeline', _fake_loader(loaded))
+    monkeypatch.setattr(summarizer, 'MAX_MODELS', 2)
+    summarizer.release_summarizers()
+
+    summarizer.get_summarizer('a')
+    summarizer.get_summarizer('b')
+    summarizer.get_summarizer('a')
+    summarizer.get_summarizer('c') #evicts 'b'
+    summarizer.get_summarizer('a')
+    summarizer.get_summarizer('b')
+
+    assert loaded == ['a', 'b', 'c', 'b']
+
+
+def test_get_summaries_by_topic_is_batched(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(summarizer, '_load_pipeline', _fake_loader(loaded))
+    summarizer.release_summarizers()
+
+    articles = {pd.Timestamp('20190101'): {0: 'a', 1: 'b'},
+                pd.Timestamp('20190201'): {0: 'c'}}
+    summaries = summarizer.get_summaries_by_topic(articles, 1, 10)
+
+    assert summaries == {'01-2019': {0: 'A', 1: 'B'}, '02-2019': {0: 'C'}}
+    assert summarizer.get_summarizer().calls == [['a', 'b', 'c']]
+    assert loaded == [None]
+
+
+class ShortFakeSummarizer(FakeSummarizer):
+    """Keeps the first max_length words"""
+    def __call__(self, sentences, min_length, max_length):
+        self.calls.append(list(sentences))
+        return [{'summary_text': ' '.join(sentence.split()[:max_length]) + '.'} for sentence in sentences]
+
+
+def test_chunk_text_on_sentence_boundaries():
+    count = lambda text: len(text.split())
+    text = 'one two three. four five! six seven eight nine? ten'
+
+    assert summarizer.split_sentences(text) == ['one two three.', 'four five!', 'six seven eight nine?', 'ten']
+    assert summarizer.chunk_text(text, 5, count) == ['one two three. four five!', 'six seven eight nine? ten']
+    chunks = summarizer.chunk_text('a b c d e f g h i j.', 4, count) #sentence longer than a chunk
+    assert all(count(chunk) <= 4 for chunk in chunks) and ' '.join(chunks) == 'a b c d e f g h i j.'
+
+
+def test_map_reduce_summary_covers_all_input_and_reuses_chunks(monkeypatch):
+    fake = ShortFakeSummarizer()
+    monkeypatch.setattr(summarizer, '_load_pipeline', lambda model: fake)
+    monkeypatch.setattr(summarizer, 'MAX_INPUT_TOKENS', 24) #16 tokens per chunk
+    monkeypatch.setattr(summarizer, 'CHUNK_MAX_LENGTH', 3)
+    summarizer.release_summarizers()
+    summarizer._chunk_summaries.clear()
+
+    documents = ['w{0}a w{0}b w{0}c w{0}d w{0}e. w{0}f w{0}g w{0}h w{0}i w{0}j.'.format(i) for i in range(6)]
+    summary = summarizer.summarize_documents(documents, 1, 5)
+
+    assert all(len(text.split()) <= 16 for call in fake.calls for text in call) #every input fits in the model
+    assert fake.calls[0] == documents #map: each document is one chunk
+    assert len(fake.calls) == 3 #one reduce step, then the final summary
+    assert 'w5a' in fake.calls[-1][0] #the last document is part of the final input
+    assert len(summary.split()) <= 5
+
+    n_calls = len(fake.calls)
+    summaries = summarizer.get_summaries_by_topic({pd.Timestamp('20190101'): {0: documents[:3], 1: documents[3:]}}, 1, 5)
+    assert documents not in fake.calls[n_calls:] #chunk summaries are reused
+    assert all(len(summary.split()) <= 5 for summary in summaries['01-2019'].values())
+
+
+def test_short_documents_share_model_inputs(monkeypatch):
+    fake = ShortFakeSummarizer()
+    monkeypatch.setattr(summarizer, '_load_pipeline', lambda model: fake)
+    monkeypatch.setattr(summarizer, 'MAX_INPUT_TOKENS', 24) #16 tokens per chunk
+    monkeypatch.setattr(summarizer, 'CHUNK_MAX_LENGTH', 3)
+    summarizer.release_summarizers()
+    summarizer._chunk_summaries.clear()
+
+    documents = ['w{0}a w{0}b w{0}c w{0}d.'.format(i) for i in range(12)]
+    summarizer.summarize_documents(documents, 1, 5)
+
+    assert fake.calls[0] == [' '.join(documents[i:i + 4]) for i in range(0, 12, 4)] #3 inputs instead of 12
+    assert sum(len(call) for call in fake.calls) == 4 #and the final summary
+
+
+def test_summaries_are_cached_by_text_and_lengths(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(summarizer, '_load_pipeline', _fake_loader(loaded))
+    summarizer.release_summarizers()
+
+    assert summarizer.run_summaries(['a', 'b', 'a'], 1, 10) == ['A', 'B', 'A']
+    summarizer.release_summarizers()
+    assert summarizer.run_summaries(['b', 'a'], 1, 10) == ['B', 'A']
+    assert loaded == [None] #every summary was cached, the model was not loaded again
+
+    summarizer.run_summaries(['a'], 1, 20) #other lengths
+    assert summarizer.get_summarizer().calls == [['a']]
+    stats = get_cache('summaries').stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 4, 3)
+
+
+def test_cached_summaries_do_not_load_the_model(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(summarizer, '_load_pipeline', _fake_loader(loaded))
+    summarizer.release_summarizers()
+
+    first = summarizer.summarize_groups([['a. b.'], ['c.']], 1, 10)
+    summarizer.release_summarizers()
+    assert summarizer.summarize_groups([['c.'], ['a. b.']], 1, 10) == first[::-1]
+    assert summarizer.run_summary('a. b.', 1, 10) == first[0]
+    assert loaded == [None] #loaded for the first call only